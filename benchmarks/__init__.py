@@ -0,0 +1,11 @@
+'''Benchmarks for pyramid_jsonapi.
+
+These are not part of the installed package. Run them from the top level of
+the repository, for example::
+
+    python -m benchmarks.async_vs_sync
+
+The benchmarks use their own models (:py:mod:`benchmarks.models`, a copy of
+the test project's people/blogs/posts/comments/articles schema) backed by
+SQLite so that they can be run without a database server.
+'''
@@ -0,0 +1,124 @@
+'''Build a pyramid_jsonapi WSGI app and synthetic data for benchmarks.'''
+import datetime
+
+from pyramid.config import Configurator
+from pyramid.renderers import JSON
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+import pyramid_jsonapi
+from pyramid_jsonapi.synthetic import insert_chunked
+
+from . import latency, models
+
+
+def make_engine(url='sqlite://', latency_ms=0, jitter_ms=0, seed=None,
+                **kwargs):
+    '''Create an engine suitable for sharing between benchmark threads.
+
+    Keyword Args:
+        latency_ms (float): delay added to each round trip to the database
+            (see :py:mod:`benchmarks.latency`).
+        jitter_ms (float): random variation of the delay, up to +/- this.
+        seed: seed for the jitter's random numbers.
+    '''
+    if url.startswith('sqlite'):
+        kwargs.setdefault('connect_args', {'check_same_thread': False})
+        if url in ('sqlite://', 'sqlite:///:memory:'):
+            # One connection shared by everyone, or each would see a
+            # different empty database.
+            kwargs.setdefault('poolclass', StaticPool)
+    if latency_ms or jitter_ms:
+        delay = latency.Delay(latency_ms / 1000, jitter_ms / 1000, seed)
+        kwargs['creator'] = latency.latency_creator(
+            url, delay, kwargs.pop('connect_args', None)
+        )
+    return create_engine(url, **kwargs)
+
+
+def make_app(engine, settings=None):
+    '''Make a WSGI app serving the benchmark models from ``engine``.
+
+    Each request gets ``models.DBSession`` as ``request.db``; the session is
+    removed when the request finishes.
+
+    Returns:
+        pyramid.router.Router: the app.
+    '''
+    models.DBSession.remove()
+    models.DBSession.configure(bind=engine)
+    config = Configurator(settings=dict(settings or {}))
+
+    def db(request):
+        request.add_finished_callback(lambda request: models.DBSession.remove())
+        return models.DBSession
+    config.add_request_method(db, 'db', reify=True)
+
+    renderer = JSON()
+    renderer.add_adapter(
+        datetime.date, lambda obj, request: obj.isoformat()
+    )
+    config.add_renderer('json', renderer)
+
+    pyramid_jsonapi.view_classes.clear()
+    pyramid_jsonapi.create_jsonapi(config, models, engine=engine)
+    return config.make_wsgi_app()
+
+
+def populate(
+        engine, people=100, posts_per_person=5, comments_per_post=3,
+        articles=0
+):
+    '''Create tables and fill them with synthetic data.
+
+    Every person gets one blog, ``posts_per_person`` posts in that blog and
+    ``comments_per_post`` comments (by other people) on each post. There are
+    ``articles`` articles (by association), each by two people.
+    '''
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    published = datetime.datetime(2015, 1, 1)
+    n_posts = people * posts_per_person
+    with engine.begin() as conn:
+        insert_chunked(conn, models.Person.__table__, (
+            {'id': i, 'name': 'person{}'.format(i)}
+            for i in range(1, people + 1)
+        ))
+        insert_chunked(conn, models.Blog.__table__, (
+            {'id': i, 'title': 'blog{}'.format(i), 'owner_id': i}
+            for i in range(1, people + 1)
+        ))
+        insert_chunked(conn, models.Post.__table__, (
+            {
+                'id': i,
+                'title': 'post{}'.format(i),
+                'content': 'content of post{}'.format(i),
+                'published_at': published,
+                'blog_id': (i - 1) // posts_per_person + 1,
+                'author_id': (i - 1) // posts_per_person + 1,
+            }
+            for i in range(1, n_posts + 1)
+        ))
+        insert_chunked(conn, models.Comment.__table__, (
+            {
+                'comments_id': i,
+                'content': 'comment{}'.format(i),
+                'author_id': i % people + 1,
+                'post_id': (i - 1) // comments_per_post + 1,
+            }
+            for i in range(1, n_posts * comments_per_post + 1)
+        ))
+        insert_chunked(conn, models.ArticleByAssoc.__table__, (
+            {
+                'articles_by_assoc_id': i,
+                'title': 'article{}'.format(i),
+                'content': 'content of article{}'.format(i),
+                'published_at': published,
+            }
+            for i in range(1, articles + 1)
+        ))
+        insert_chunked(conn, models.authors_articles_assoc, (
+            {'author_id': (i + offset) % people + 1, 'article_id': i}
+            for i in range(1, articles + 1)
+            for offset in range(min(2, people))
+        ))
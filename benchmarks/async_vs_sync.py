@@ -0,0 +1,135 @@
+'''Compare requests/s of the sync WSGI path and the asyncio read path.
+
+Both apps serve the same SQLite file: the sync app through a thread pool, the
+async app (:py:class:`pyramid_jsonapi.asgi.AsyncReadApp`) through aiosqlite.
+``--clients`` requests are kept in flight at once.
+
+Usage::
+
+    python -m benchmarks.async_vs_sync [--clients 64] [--concurrency 8]
+
+``--concurrency`` is how many relationship and include queries of each async
+request may run at once.
+
+Requires SQLAlchemy >= 1.4 and aiosqlite.
+'''
+import argparse
+import asyncio
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from webob import Request
+
+from pyramid_jsonapi.asgi import AsyncReadApp
+
+from .app import make_app, make_engine, populate
+
+PATHS = [
+    '/people?include=posts',
+    '/posts?page[limit]=20',
+    '/people/1/posts',
+    '/posts/1/relationships/comments',
+]
+
+
+def bench_sync(app, clients, requests):
+    def fetch(path):
+        return Request.blank(path).get_response(app).status_code
+
+    paths = [PATHS[i % len(PATHS)] for i in range(requests)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as pool:
+        statuses = list(pool.map(fetch, paths))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, statuses
+
+
+async def asgi_get(app, path):
+    parts = urlsplit(path)
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': parts.path,
+        'query_string': parts.query.encode('latin-1'),
+        'headers': [],
+        'server': ('localhost', 80),
+    }
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b''}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sent[0]['status']
+
+
+async def bench_async(app, clients, requests):
+    queue = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(PATHS[i % len(PATHS)])
+    statuses = []
+
+    async def client():
+        while not queue.empty():
+            statuses.append(await asgi_get(app, queue.get_nowait()))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(clients)))
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, statuses
+
+
+def main(argv=None):
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.orm import sessionmaker
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--people', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.sqlite')
+        engine = make_engine('sqlite:///' + path)
+        populate(engine, people=args.people)
+        wsgi_app = make_app(engine)
+        async_engine = create_async_engine('sqlite+aiosqlite:///' + path)
+        async_app = AsyncReadApp(
+            wsgi_app,
+            sessionmaker(async_engine, class_=AsyncSession),
+            concurrency=args.concurrency
+        )
+
+        sync_rps, sync_statuses = bench_sync(
+            wsgi_app, args.clients, args.requests
+        )
+        async_rps, async_statuses = asyncio.run(
+            bench_async(async_app, args.clients, args.requests)
+        )
+
+    print(json.dumps({
+        'clients': args.clients,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'sync': {
+            'requests_per_second': round(sync_rps, 1),
+            'errors': sum(1 for s in sync_statuses if s >= 400),
+        },
+        'async': {
+            'requests_per_second': round(async_rps, 1),
+            'errors': sum(1 for s in async_statuses if s >= 400),
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
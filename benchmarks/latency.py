@@ -0,0 +1,113 @@
+'''Add network-like latency to every round trip to the database.
+
+SQLite runs a query in microseconds, so an N+1 pattern which costs seconds
+against a database across a network barely shows up in benchmarks. These
+wrappers around DBAPI connections and cursors sleep for ``latency`` seconds,
+plus or minus up to ``jitter``, before each ``execute()``, ``executemany()``,
+``commit()`` and ``rollback()``. Use them with
+:py:func:`benchmarks.app.make_engine`::
+
+    engine = make_engine('sqlite://', latency_ms=1, jitter_ms=0.5)
+
+or pass ``--latency-ms`` and ``--jitter-ms`` to the benchmark suite.
+'''
+import random
+import time
+
+
+class Delay:
+    '''Sleeps for latency +/- jitter seconds (never less than 0).
+
+    Keyword Args:
+        seed: seed for the jitter's random numbers, for repeatable runs.
+
+    Attributes:
+        count (int): number of delays so far.
+        total (float): seconds slept so far.
+    '''
+
+    def __init__(self, latency, jitter=0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.count = 0
+        self.total = 0
+
+    def __call__(self):
+        seconds = self.latency
+        if self.jitter:
+            seconds += self.random.uniform(-self.jitter, self.jitter)
+        seconds = max(seconds, 0)
+        self.count += 1
+        self.total += seconds
+        time.sleep(seconds)
+
+
+class LatencyCursor:
+    '''DBAPI cursor proxy which delays each execute.'''
+
+    def __init__(self, cursor, delay):
+        self._cursor = cursor
+        self._delay = delay
+
+    def execute(self, *args, **kwargs):
+        self._delay()
+        return self._cursor.execute(*args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        self._delay()
+        return self._cursor.executemany(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+
+class LatencyConnection:
+    '''DBAPI connection proxy whose cursors and transactions are delayed.'''
+
+    def __init__(self, connection, delay):
+        # Avoid __setattr__, which sets attributes on the real connection.
+        object.__setattr__(self, '_connection', connection)
+        object.__setattr__(self, '_delay', delay)
+
+    def cursor(self, *args, **kwargs):
+        return LatencyCursor(
+            self._connection.cursor(*args, **kwargs), self._delay
+        )
+
+    def commit(self):
+        self._delay()
+        return self._connection.commit()
+
+    def rollback(self):
+        self._delay()
+        return self._connection.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._connection, name, value)
+
+
+def latency_creator(url, delay, connect_args=None):
+    '''A ``creator`` for ``create_engine()`` making delayed connections.
+
+    Args:
+        url (str): database URL (used to find the DBAPI and its arguments).
+        delay (Delay): the delay to add.
+        connect_args (dict): extra arguments for the DBAPI ``connect()``.
+    '''
+    from sqlalchemy import create_engine
+    plain = create_engine(url)
+    cargs, cparams = plain.dialect.create_connect_args(plain.url)
+    cparams.update(connect_args or {})
+
+    def creator():
+        return LatencyConnection(
+            plain.dialect.connect(*cargs, **cparams), delay
+        )
+    return creator
@@ -0,0 +1,172 @@
+'''Memory used per request, and memory kept between requests.
+
+For each request shape the app (on an in-memory SQLite database) handles
+``--requests`` requests under tracemalloc, after one unmeasured request. For
+each shape it reports:
+
+* ``peak_kib``: the mean peak of memory allocated while handling a request
+  (session identity map, ``included``, the response document and the rendered
+  body are all alive at some point);
+* ``retained_kib_per_request``: how much more memory is in use after each
+  request than before it, once garbage is collected. Anything but about zero
+  is memory kept across requests;
+* ``body_kib``: size of the rendered response.
+
+Then, for all requests together, ``retained`` reports what is still alive:
+the number of entries in each ``functools.lru_cache`` used by the views
+(these are keyed on, and so keep alive, requests and view instances), the
+number of live requests and view instances, how much memory clearing the
+caches frees and the source lines which allocated the most retained memory.
+
+Usage::
+
+    python -m benchmarks.memory [--requests 10] [--output memory.json]
+'''
+import argparse
+import gc
+import json
+import statistics
+import tracemalloc
+
+from pyramid.request import Request
+
+import pyramid_jsonapi
+from pyramid_jsonapi.collection_view_base import CollectionViewBase
+
+from . import models
+from .app import make_app, make_engine, populate
+
+SHAPES = {
+    'item': '/posts/1',
+    'page_10': '/posts?page[limit]=10',
+    'page_100': '/posts?page[limit]=100',
+    'page_100_sparse': '/posts?page[limit]=100&fields[posts]=title',
+    'page_100_include': '/posts?page[limit]=100&include=author,comments',
+    'deep_include': '/people?page[limit]=10&include=posts.comments.author',
+}
+
+# The lru_cache memoised functions of the views, by name.
+CACHES = {
+    'collection_query_info': CollectionViewBase.collection_query_info.__func__,
+    'requested_field_names': CollectionViewBase.requested_field_names.fget,
+    'requested_include_names': CollectionViewBase.requested_include_names,
+    'view_instance': CollectionViewBase.view_instance,
+    'pluralize': pyramid_jsonapi.pluralize,
+}
+
+
+def get(app, path):
+    response = Request.blank(path).get_response(app)
+    assert response.status_int < 400, (path, response.status)
+    return response
+
+
+def in_use():
+    '''Bytes traced by tracemalloc and in use after a garbage collection.'''
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0]
+
+
+def measure_shape(app, path, requests):
+    get(app, path)
+    peaks = []
+    retained = []
+    body = 0
+    for _ in range(requests):
+        before = in_use()
+        tracemalloc.reset_peak()
+        response = get(app, path)
+        peaks.append(tracemalloc.get_traced_memory()[1] - before)
+        body = len(response.body)
+        del response
+        retained.append(in_use() - before)
+    return {
+        'peak_kib': round(statistics.mean(peaks) / 1024, 1),
+        'retained_kib_per_request': round(
+            statistics.mean(retained) / 1024, 2
+        ),
+        'body_kib': round(body / 1024, 1),
+    }
+
+
+def live(cls):
+    '''Number of live instances of cls (or its subclasses).'''
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, cls))
+
+
+def retained_report(start_snapshot, top):
+    gc.collect()
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+    ])
+    top_lines = [
+        {
+            'line': str(stat.traceback),
+            'kib': round(stat.size_diff / 1024, 1),
+            'blocks': stat.count_diff,
+        }
+        for stat in snapshot.compare_to(start_snapshot, 'lineno')[:top]
+    ]
+    report = {
+        'cache_entries': {
+            name: func.cache_info().currsize for name, func in CACHES.items()
+        },
+        'live_requests': live(Request),
+        'live_views': live(CollectionViewBase),
+        'top_lines': top_lines,
+    }
+    before = in_use()
+    for func in CACHES.values():
+        func.cache_clear()
+    report['freed_by_clearing_caches_kib'] = round(
+        (before - in_use()) / 1024, 1
+    )
+    report['live_requests_after_clearing'] = live(Request)
+    report['live_views_after_clearing'] = live(CollectionViewBase)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=10)
+    parser.add_argument('--people', type=int, default=200)
+    parser.add_argument('--top', type=int, default=10)
+    parser.add_argument(
+        '--only', type=lambda s: s.split(','), default=None,
+        help='comma separated request shape names'
+    )
+    parser.add_argument('--output', default=None)
+    options = parser.parse_args(argv)
+
+    engine = make_engine()
+    populate(engine, people=options.people)
+    app = make_app(engine, {'pyramid_jsonapi.paging.max_limit': '1000'})
+    # Fill the caches that last for the life of the app before measuring.
+    for path in SHAPES.values():
+        get(app, path)
+
+    tracemalloc.start()
+    try:
+        start_snapshot = tracemalloc.take_snapshot()
+        shapes = {
+            name: measure_shape(app, path, options.requests)
+            for name, path in SHAPES.items()
+            if not options.only or name in options.only
+        }
+        results = {
+            'requests_per_shape': options.requests,
+            'shapes': shapes,
+            'retained': retained_report(start_snapshot, options.top),
+        }
+    finally:
+        tracemalloc.stop()
+        models.DBSession.remove()
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+'''Microbenchmarks of the pure Python hot paths of a request.
+
+Each benchmark calls one function many times on a fake request (built with
+``Request.blank`` and matched against the app's routes, but never sent
+through the app) and, where it needs them, ORM objects loaded beforehand, so
+no SQL is run while timing. Results are in nanoseconds per call (the best of
+``--repeat`` runs). Functions memoised with ``functools.lru_cache`` are timed
+both through the cache on a warm request (``cached``) and by calling the
+undecorated function (``parse``), which is the cost paid once per request.
+
+A cProfile profile of each benchmark is saved to ``--profile-dir`` (as
+``<name>.pstats``, for ``python -m pstats`` or snakeviz).
+
+Usage::
+
+    python -m benchmarks.micro [--only NAME,...] [--output micro.json]
+        [--compare previous.json] [--profile-dir micro-profiles]
+'''
+import argparse
+import cProfile
+import json
+import os
+import timeit
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.request import Request
+from pyramid.threadlocal import manager
+
+import pyramid_jsonapi
+
+from . import models
+from .app import make_app, make_engine, populate
+
+QUERY = (
+    'page[limit]=20&page[offset]=40&sort=-title,author.name'
+    '&filter[title:eq]=post1&filter[author.name:like]=person%25'
+    '&include=author.comments,blog.owner.posts,comments'
+)
+
+
+def fake_request(app, path):
+    '''A request for path, matched against app's routes but not handled.'''
+    request = Request.blank(path)
+    request.registry = app.registry
+    info = app.registry.getUtility(IRoutesMapper)(request)
+    request.matchdict = info['match']
+    request.matched_route = info['route']
+    request.db = models.DBSession
+    return request
+
+
+def make_view(app, model, path):
+    '''An instance of model's view class for a fake request for path.'''
+    return pyramid_jsonapi.view_classes[model](fake_request(app, path))
+
+
+def benchmarks(app):
+    '''Functions to benchmark by name.
+
+    Each one is a zero argument callable doing one operation.
+    '''
+    view_class = pyramid_jsonapi.view_classes[models.Post]
+    collection_path = '/posts?' + QUERY
+    request = fake_request(app, collection_path)
+    view = make_view(app, models.Post, collection_path)
+    query_info = view_class.collection_query_info.__wrapped__
+    include_names = view_class.requested_include_names.__wrapped__
+    view_class.collection_query_info(request)
+    view.requested_include_names()
+
+    sparse_path = '/posts?fields[posts]=title,content,published_at'
+    sparse_view = make_view(app, models.Post, sparse_path)
+    # Preload the items so that serialising them runs no SQL.
+    items = models.DBSession.query(models.Post).limit(20).all()
+    obj = sparse_view.serialise_db_item(items[0], {})
+
+    person_view = make_view(app, models.Person, '/people')
+    person_obj = person_view.serialise_db_item(
+        models.DBSession.query(models.Person).get(1), {}
+    )
+
+    def serialise_page():
+        for item in items:
+            sparse_view.serialise_db_item(item, {})
+
+    return {
+        'collection_query_info.parse':
+            lambda: query_info(view_class, request),
+        'collection_query_info.cached':
+            lambda: view_class.collection_query_info(request),
+        'requested_include_names.parse':
+            lambda: include_names(view),
+        'requested_include_names.cached':
+            lambda: view.requested_include_names(),
+        'bad_include_paths': lambda: view.bad_include_paths,
+        'pagination_links': lambda: view.pagination_links(count=1000),
+        'serialise_resource_identifier':
+            lambda: view.serialise_resource_identifier(42),
+        'serialise_db_item.attributes_only':
+            lambda: sparse_view.serialise_db_item(items[0], {}),
+        'serialise_db_item.page_of_20': serialise_page,
+        'acso_after_serialise_object.post':
+            lambda: pyramid_jsonapi.acso_after_serialise_object(
+                sparse_view, obj
+            ),
+        'acso_after_serialise_object.person':
+            lambda: pyramid_jsonapi.acso_after_serialise_object(
+                person_view, person_obj
+            ),
+    }
+
+
+def time_ns(func, repeat):
+    '''Best time per call of func in ns, and the number of calls per run.'''
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=repeat, number=number))
+    return best / number * 1e9, number
+
+
+def profile(func, number, path):
+    '''Save a cProfile profile of number calls of func to path.'''
+    profiler = cProfile.Profile()
+    profiler.enable()
+    for _ in range(number):
+        func()
+    profiler.disable()
+    profiler.dump_stats(path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--only', type=lambda s: s.split(','), default=None,
+        help='comma separated benchmark names'
+    )
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--profile-dir', default='micro-profiles')
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    options = parser.parse_args(argv)
+
+    engine = make_engine()
+    populate(engine, people=50)
+    app = make_app(engine, {'pyramid_jsonapi.paging.max_limit': '1000'})
+    pyramid_jsonapi.append_callback_set_to_all_views(
+        'access_control_serialised_objects'
+    )
+    os.makedirs(options.profile_dir, exist_ok=True)
+
+    results = {}
+    # route_url() and friends look up the registry thread locally.
+    manager.push({'registry': app.registry, 'request': None})
+    try:
+        for name, func in benchmarks(app).items():
+            if options.only and name not in options.only:
+                continue
+            ns, number = time_ns(func, options.repeat)
+            results[name] = {'ns_per_op': round(ns, 1), 'ops': number}
+            profile(func, number, os.path.join(
+                options.profile_dir, '{}.pstats'.format(name)
+            ))
+    finally:
+        manager.pop()
+        models.DBSession.remove()
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)
+        print(json.dumps({'changes': {
+            name: '{:+.1f}%'.format(
+                (result['ns_per_op'] - previous[name]['ns_per_op']) /
+                previous[name]['ns_per_op'] * 100
+            )
+            for name, result in results.items() if name in previous
+        }}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+'''Replay a log of requests against the app and report how it copes.
+
+Each line of the log is one request, in any of these forms:
+
+* a JSON object: ``{"method": "PATCH", "path": "/posts/1?x=y", "body": {...}}``
+  (``method`` defaults to GET and ``body`` may be an object or a string);
+* ``METHOD /path?query`` optionally followed by a JSON body;
+* an access log line in common or combined log format (only the request line,
+  ``"GET /path?query HTTP/1.1"``, is used).
+
+Blank lines and lines starting with ``#`` are skipped.
+
+Requests are sent by ``--concurrency`` client threads, either straight to the
+WSGI app in this process (``--mode inprocess``) or over HTTP to the app served
+by waitress on a local port (``--mode waitress``). The app is the benchmark app
+on a SQLite file of synthetic data (``--people``, ``--db`` to reuse a file,
+``--latency-ms`` to add database latency) or, with ``--ini``, the app
+configured by a paste ini file (a local copy of a deployment, say).
+
+The report (printed and written to ``--output`` as JSON) has throughput and,
+in total and for each route name (``pyramid_jsonapi:people:item`` and so on),
+the number of requests, error rate, statuses, latency percentiles and a
+histogram of latencies, and SQL statements per request.
+
+Usage::
+
+    python -m benchmarks.replay requests.log [--concurrency 8]
+        [--mode inprocess|waitress] [--repeat 1] [--output replay.json]
+        [--ini production-copy.ini | --people 1000 [--db DIR]]
+'''
+import argparse
+import collections
+import http.client
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pyramid.interfaces import IRoutesMapper
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from webob import Request
+
+from . import models
+from .app import make_app, make_engine, populate
+from .suite import JSONAPI_TYPE, percentile
+
+ACCESS_LOG_REQUEST = re.compile(r'"([A-Z]+) (\S+) HTTP/[0-9.]+"')
+
+# Upper bounds, in ms, of the latency histogram buckets.
+HISTOGRAM_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+QUERIES_HEADER = 'X-Replay-Queries'
+
+Entry = collections.namedtuple('Entry', 'method path body')
+Result = collections.namedtuple('Result', 'route status seconds queries')
+
+
+def parse_line(line):
+    '''Parse one line of a request log.
+
+    Returns:
+        Entry: the request, or None for lines to skip.
+
+    Raises:
+        ValueError: if the line is not in a known form.
+    '''
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    if line.startswith('{'):
+        obj = json.loads(line)
+        body = obj.get('body')
+        if body is not None and not isinstance(body, str):
+            body = json.dumps(body)
+        return Entry(obj.get('method', 'GET').upper(), obj['path'], body)
+    match = ACCESS_LOG_REQUEST.search(line)
+    if match:
+        return Entry(match.group(1), match.group(2), None)
+    parts = line.split(None, 2)
+    if len(parts) >= 2 and parts[0].isalpha() and parts[1].startswith('/'):
+        return Entry(
+            parts[0].upper(), parts[1], parts[2] if len(parts) > 2 else None
+        )
+    raise ValueError('Unrecognised request line: {!r}'.format(line))
+
+
+def read_log(path):
+    with open(path) as f:
+        entries = []
+        for number, line in enumerate(f, 1):
+            try:
+                entry = parse_line(line)
+            except ValueError as exc:
+                raise ValueError('{}:{}: {}'.format(path, number, exc))
+            if entry is not None:
+                entries.append(entry)
+    return entries
+
+
+class QueryCounter:
+    '''WSGI middleware reporting the statements run for each request.
+
+    Statements executed on any engine are counted per thread and the count
+    for a request is returned in the ``X-Replay-Queries`` response header, so
+    that it reaches the client whether the app is called directly or through
+    a server.
+    '''
+
+    def __init__(self, app):
+        self.app = app
+        self.local = threading.local()
+        event.listen(Engine, 'before_cursor_execute', self.before_execute)
+
+    def close(self):
+        event.remove(Engine, 'before_cursor_execute', self.before_execute)
+
+    def before_execute(self, *args):
+        self.local.count = getattr(self.local, 'count', 0) + 1
+
+    def __call__(self, environ, start_response):
+        self.local.count = 0
+
+        def counting_start_response(status, headers, exc_info=None):
+            headers.append((QUERIES_HEADER, str(self.local.count)))
+            return start_response(status, headers, exc_info)
+        return self.app(environ, counting_start_response)
+
+
+class RouteNamer:
+    '''Finds the name of the route a request will match.'''
+
+    def __init__(self, app):
+        registry = getattr(app, 'registry', None)
+        self.mapper = registry and registry.queryUtility(IRoutesMapper)
+        self.cache = {}
+
+    def __call__(self, entry):
+        path = entry.path.split('?', 1)[0]
+        key = (entry.method, path)
+        if key not in self.cache:
+            name = 'unknown'
+            if self.mapper is not None:
+                route = self.mapper(
+                    Request.blank(path, method=entry.method)
+                )['route']
+                name = route.name if route is not None else 'unmatched'
+            self.cache[key] = name
+        return self.cache[key]
+
+
+def inprocess_sender(app):
+    '''A function sending an entry to app, returning (status, queries).'''
+    def send(entry):
+        request = Request.blank(entry.path, method=entry.method)
+        if entry.body is not None:
+            request.body = entry.body.encode()
+            request.content_type = JSONAPI_TYPE
+        response = request.get_response(app)
+        return response.status_code, int(response.headers[QUERIES_HEADER])
+    return send
+
+
+def http_sender(host, port):
+    '''A function sending an entry over HTTP (a connection per thread).'''
+    local = threading.local()
+
+    def send(entry):
+        if getattr(local, 'connection', None) is None:
+            local.connection = http.client.HTTPConnection(host, port)
+        headers = {}
+        body = None
+        if entry.body is not None:
+            body = entry.body.encode()
+            headers['Content-Type'] = JSONAPI_TYPE
+        try:
+            local.connection.request(
+                entry.method, entry.path, body=body, headers=headers
+            )
+            response = local.connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            local.connection.close()
+            local.connection = None
+            raise
+        return (
+            response.status, int(response.getheader(QUERIES_HEADER) or 0)
+        )
+    return send
+
+
+def replay(entries, send, name_route, concurrency):
+    '''Send entries from concurrency threads.
+
+    Returns:
+        tuple: (list of Result, seconds taken). Requests which failed to get
+        a response at all have status 0.
+    '''
+    def run(entry):
+        began = time.perf_counter()
+        try:
+            status, queries = send(entry)
+        except (OSError, http.client.HTTPException):
+            status, queries = 0, 0
+        return Result(
+            name_route(entry), status, time.perf_counter() - began, queries
+        )
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(run, entries))
+    return results, time.perf_counter() - began
+
+
+def histogram(ms):
+    '''Count of latencies (in ms) in each bucket, keyed by upper bound.'''
+    counts = collections.OrderedDict(
+        ('<={}'.format(bound), 0) for bound in HISTOGRAM_MS
+    )
+    counts['>{}'.format(HISTOGRAM_MS[-1])] = 0
+    keys = list(counts)
+    for value in ms:
+        for bound, key in zip(HISTOGRAM_MS, keys):
+            if value <= bound:
+                counts[key] += 1
+                break
+        else:
+            counts[keys[-1]] += 1
+    return counts
+
+
+def summarise(results):
+    ms = sorted(result.seconds * 1000 for result in results)
+    errors = sum(
+        1 for result in results if not 0 < result.status < 400
+    )
+    return {
+        'requests': len(results),
+        'errors': errors,
+        'error_rate': round(errors / len(results), 4),
+        'statuses': dict(collections.Counter(
+            str(result.status) for result in results
+        ).most_common()),
+        'latency_ms': {
+            'mean': round(sum(ms) / len(ms), 3),
+            'p50': round(percentile(ms, 50), 3),
+            'p90': round(percentile(ms, 90), 3),
+            'p99': round(percentile(ms, 99), 3),
+            'max': round(ms[-1], 3),
+        },
+        'histogram_ms': histogram(ms),
+        'queries_per_request': round(
+            sum(result.queries for result in results) / len(results), 2
+        ),
+    }
+
+
+def report(results, seconds):
+    by_route = collections.defaultdict(list)
+    for result in results:
+        by_route[result.route].append(result)
+    return {
+        'seconds': round(seconds, 3),
+        'requests_per_second': round(len(results) / seconds, 1),
+        'total': summarise(results),
+        'routes': {
+            route: summarise(route_results)
+            for route, route_results in sorted(by_route.items())
+        },
+    }
+
+
+def load_app(options, db_dir):
+    '''The app to replay against.'''
+    if options.ini:
+        from pyramid.paster import get_app, setup_logging
+        setup_logging(options.ini)
+        return get_app(options.ini)
+    path = os.path.join(db_dir, 'replay-{}.sqlite'.format(options.people))
+    exists = os.path.exists(path)
+    engine = make_engine(
+        'sqlite:///' + path, latency_ms=options.latency_ms,
+        jitter_ms=options.jitter_ms
+    )
+    if not exists:
+        populate(engine, people=options.people, articles=options.people // 2)
+    return make_app(engine, {'pyramid_jsonapi.paging.max_limit': '1000'})
+
+
+def run(app, entries, options):
+    counted = QueryCounter(app)
+    name_route = RouteNamer(app)
+    try:
+        if options.mode == 'waitress':
+            from waitress import create_server
+            server = create_server(
+                counted, host='127.0.0.1', port=0,
+                threads=options.concurrency
+            )
+            thread = threading.Thread(target=server.run, daemon=True)
+            thread.start()
+            try:
+                return replay(
+                    entries, http_sender('127.0.0.1', server.effective_port),
+                    name_route, options.concurrency
+                )
+            finally:
+                server.close()
+        return replay(
+            entries, inprocess_sender(counted), name_route,
+            options.concurrency
+        )
+    finally:
+        counted.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('log', help='file of requests, one per line')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument(
+        '--mode', choices=('inprocess', 'waitress'), default='inprocess'
+    )
+    parser.add_argument(
+        '--repeat', type=int, default=1,
+        help='replay the log this many times'
+    )
+    parser.add_argument(
+        '--ini', default=None,
+        help='paste ini file of the app (default: the benchmark app)'
+    )
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument(
+        '--db', default=None,
+        help='directory to keep the benchmark app SQLite file in'
+    )
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--output', default=None)
+    options = parser.parse_args(argv)
+
+    entries = read_log(options.log) * options.repeat
+    if not entries:
+        parser.error('no requests in {}'.format(options.log))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        app = load_app(options, options.db or tmpdir)
+        results, seconds = run(app, entries, options)
+    models.DBSession.remove()
+
+    results = dict(report(results, seconds), **{
+        'mode': options.mode,
+        'concurrency': options.concurrency,
+    })
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+'''Measure route matching cost against the number of collections.
+
+For each schema size (synthetic models from :py:mod:`benchmarks.startup`)
+builds an app with per-collection routes and one with generic routes
+(``pyramid_jsonapi.generic_routes``) and times matching a request for an item
+of the first and of the last collection registered.
+
+Usage::
+
+    python -m benchmarks.routing [--sizes 10 100 1000] [--matches 2000]
+'''
+import argparse
+import json
+import time
+
+from pyramid.config import Configurator
+from pyramid.interfaces import IRoutesMapper
+from pyramid.request import Request
+
+import pyramid_jsonapi
+
+from .startup import synthetic_models
+
+
+def make_mapper(models, generic):
+    pyramid_jsonapi.view_classes.clear()
+    config = Configurator(settings={
+        'pyramid_jsonapi.generic_routes': 'true' if generic else 'false',
+    })
+    pyramid_jsonapi.create_jsonapi(config, models)
+    app = config.make_wsgi_app()
+    return app.registry.queryUtility(IRoutesMapper)
+
+
+def time_match(mapper, path, matches):
+    '''Mean time in microseconds to match ``path``.'''
+    request = Request.blank(path)
+    start = time.perf_counter()
+    for _ in range(matches):
+        info = mapper(request)
+    elapsed = time.perf_counter() - start
+    assert info['route'] is not None
+    return round(elapsed / matches * 1e6, 2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 100, 1000]
+    )
+    parser.add_argument('--matches', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in args.sizes:
+        models = synthetic_models(size)
+        first = '/{}/1'.format(pyramid_jsonapi.pluralize('thing0'))
+        last = '/{}/1'.format(
+            pyramid_jsonapi.pluralize('thing{}'.format(size - 1))
+        )
+        results[size] = {}
+        for mode, generic in (('per_collection', False), ('generic', True)):
+            mapper = make_mapper(models, generic)
+            results[size][mode] = {
+                'first_us': time_match(mapper, first, args.matches),
+                'last_us': time_match(mapper, last, args.matches),
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
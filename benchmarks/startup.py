@@ -0,0 +1,140 @@
+'''Measure the cost of create_jsonapi() for synthetic schemas.
+
+Builds chains of N models (each with a few columns and a MANYTOONE/ONETOMANY
+relationship pair to the previous model) and times:
+
+* ``create_jsonapi``: pyramid_jsonapi's own introspection and registration;
+* ``commit``: Pyramid executing the registered actions (routes, views);
+* ``total``: both, plus ``make_wsgi_app()``.
+
+With ``--schema-cache`` each size is booted twice with
+``pyramid_jsonapi.schema_cache`` set, on fresh copies of the models: ``cold``
+introspects the models and writes the cache, ``warm`` reads it.
+
+Usage::
+
+    python -m benchmarks.startup [--sizes 10 100 1000] [--profile DIR] \
+        [--schema-cache]
+'''
+import argparse
+import cProfile
+import json
+import os
+import tempfile
+import time
+
+from pyramid.config import Configurator
+from sqlalchemy import Column, ForeignKey, Integer, Text
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import configure_mappers, relationship
+
+import pyramid_jsonapi
+
+
+def synthetic_models(n, configure=True):
+    '''Return a list of n mapped model classes on a new declarative base.
+
+    Mappers are configured unless ``configure`` is False.
+    '''
+    Base = declarative_base()
+    models = []
+    for i in range(n):
+        attrs = {
+            '__tablename__': 'thing{}'.format(i),
+            'id': Column(Integer, primary_key=True),
+            'name': Column(Text),
+            'description': Column(Text),
+            'value': Column(Integer),
+        }
+        # Both sides declared (rather than a backref) so that mappers need
+        # not be configured to find them.
+        if i:
+            attrs['parent_id'] = Column(
+                Integer, ForeignKey('thing{}.id'.format(i - 1))
+            )
+            attrs['parent'] = relationship(
+                'Thing{}'.format(i - 1), back_populates='children'
+            )
+        if i < n - 1:
+            attrs['children'] = relationship(
+                'Thing{}'.format(i + 1), back_populates='parent'
+            )
+        models.append(type('Thing{}'.format(i), (Base,), attrs))
+    if configure:
+        configure_mappers()
+    return models
+
+
+def time_startup(models, settings=None):
+    pyramid_jsonapi.view_classes.clear()
+    config = Configurator(settings=dict(settings or {}))
+    start = time.perf_counter()
+    pyramid_jsonapi.create_jsonapi(config, models)
+    created = time.perf_counter()
+    config.commit()
+    committed = time.perf_counter()
+    config.make_wsgi_app()
+    done = time.perf_counter()
+    return {
+        'create_jsonapi': round(created - start, 4),
+        'commit': round(committed - created, 4),
+        'total': round(done - start, 4),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--sizes', type=int, nargs='+', default=[10, 100, 1000]
+    )
+    parser.add_argument(
+        '--profile', metavar='DIR',
+        help='save a cProfile of each run to DIR/startup_<size>.pstats'
+    )
+    parser.add_argument(
+        '--setting', action='append', default=[], metavar='KEY=VALUE',
+        help='extra app setting (may be repeated)'
+    )
+    parser.add_argument(
+        '--schema-cache', action='store_true',
+        help='compare boots writing and reading pyramid_jsonapi.schema_cache'
+    )
+    args = parser.parse_args(argv)
+    settings = dict(s.split('=', 1) for s in args.setting)
+
+    if args.schema_cache:
+        results = {}
+        for size in args.sizes:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                cache_settings = dict(settings)
+                cache_settings['pyramid_jsonapi.schema_cache'] = \
+                    os.path.join(tmpdir, 'schema.json')
+                # Unconfigured mappers: reading the cache leaves them so.
+                results[size] = {
+                    run: time_startup(
+                        synthetic_models(size, configure=False),
+                        cache_settings
+                    )
+                    for run in ('cold', 'warm')
+                }
+        print(json.dumps(results, indent=2))
+        return
+
+    results = {}
+    for size in args.sizes:
+        models = synthetic_models(size)
+        if args.profile:
+            os.makedirs(args.profile, exist_ok=True)
+            profile = cProfile.Profile()
+            profile.enable()
+        results[size] = time_startup(models, settings)
+        if args.profile:
+            profile.disable()
+            profile.dump_stats(
+                os.path.join(args.profile, 'startup_{}.pstats'.format(size))
+            )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+'''Latency, queries and allocations of representative requests at scale.
+
+For each scale (roughly the total number of rows: ``1k``, ``100k``, ``1M``)
+synthetic people, blogs, posts, comments and articles are generated into a
+SQLite file and the WSGI app is driven through webtest. Each scenario
+(collection pages, deep includes, sparse fields, filters, writes...) is run
+``--requests`` times after ``--warmup`` unmeasured runs and reports:
+
+* ``latency_ms``: mean and 50th, 90th, 99th percentile and max;
+* ``queries_per_request``: SQL statements executed, on average;
+* ``alloc_peak_kib``: the mean peak of memory allocated while handling a
+  request, measured with tracemalloc in a separate, shorter pass (so that
+  tracing does not slow the latency measurements).
+
+Results are printed (and written to ``--output``) as JSON. ``--compare`` an
+earlier results file to also print the change in each figure.
+
+Generating the larger scales takes a while: pass ``--db-dir`` to keep the
+SQLite files and reuse them on later runs.
+
+SQLite answers in microseconds, which hides the cost of each extra query.
+``--latency-ms`` (and ``--jitter-ms``) add a delay to every round trip to
+the database, as a database across a network would (see
+:py:mod:`benchmarks.latency`).
+
+Usage::
+
+    python -m benchmarks.suite [--scales 1k,100k,1M] [--requests 100]
+        [--output results.json] [--compare previous.json] [--db-dir DIR]
+        [--latency-ms 1 [--jitter-ms 0.5]]
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sqlalchemy
+from sqlalchemy import event
+import webtest
+
+import pyramid_jsonapi
+
+from . import models
+from .app import make_app, make_engine, populate
+
+SCALES = {
+    '1k': 1000,
+    '100k': 100000,
+    '1M': 1000000,
+}
+
+# Rows per person: a person, a blog, 5 posts, 15 comments and (shared) an
+# article with two author associations per 2 people.
+ROWS_PER_PERSON = 1 + 1 + 5 + 15 + 1.5
+
+JSONAPI_TYPE = 'application/vnd.api+json'
+
+
+def sizes(rows):
+    '''Arguments to :py:func:`benchmarks.app.populate` for ~rows rows.'''
+    people = max(int(rows / ROWS_PER_PERSON), 2)
+    return {'people': people, 'articles': people // 2}
+
+
+def scenarios(people):
+    '''Scenarios by name: functions making (method, path, body) per run.
+
+    Runs are numbered so that requests spread over the data.
+    '''
+    posts = people * 5
+
+    def person(i):
+        return i * 7919 % people + 1
+
+    def post(i):
+        return i * 7919 % posts + 1
+
+    created = []
+
+    def create(i):
+        return ('POST', '/comments', {'data': {
+            'type': 'comments',
+            'attributes': {'content': 'benchmark comment {}'.format(i)},
+            'relationships': {
+                'author': {'data': {'type': 'people', 'id': str(person(i))}},
+                'post': {'data': {'type': 'posts', 'id': str(post(i))}},
+            },
+        }})
+
+    def delete(i):
+        return ('DELETE', '/comments/{}'.format(created[i]), None)
+
+    return {
+        'collection_page': lambda i: (
+            'GET', '/posts?page[limit]=50&page[offset]={}'.format(
+                i * 50 % posts
+            ), None
+        ),
+        'item': lambda i: ('GET', '/posts/{}'.format(post(i)), None),
+        'related': lambda i: (
+            'GET', '/people/{}/posts'.format(person(i)), None
+        ),
+        'relationships': lambda i: (
+            'GET', '/posts/{}/relationships/comments'.format(post(i)), None
+        ),
+        'include': lambda i: (
+            'GET', '/posts?page[limit]=20&include=author,comments', None
+        ),
+        'deep_include': lambda i: (
+            'GET',
+            '/people?page[limit]=10&include=posts.comments.author', None
+        ),
+        'sparse_fields': lambda i: (
+            'GET',
+            '/posts?page[limit]=50&fields[posts]=title,author', None
+        ),
+        'filter': lambda i: (
+            'GET', '/posts?filter[title:eq]=post{}'.format(post(i)), None
+        ),
+        'sort_filter': lambda i: (
+            'GET',
+            '/people?filter[name:like]=person1%25&sort=-name'
+            '&page[limit]=20', None
+        ),
+        'update': lambda i: ('PATCH', '/posts/{}'.format(post(i)), {'data': {
+            'type': 'posts', 'id': str(post(i)),
+            'attributes': {'title': 'post{}'.format(post(i))},
+        }}),
+        # create and delete share created: delete removes what create made,
+        # so the (possibly reused) database is left as it was.
+        'create': create,
+        'delete': delete,
+    }, created
+
+
+class QueryCounter:
+    '''Counts statements executed on an engine.'''
+
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self.before_execute)
+
+    def before_execute(self, *args):
+        self.count += 1
+
+
+def request(app, method, path, body):
+    if body is None:
+        return app.request(path, method=method, expect_errors=True)
+    return app.request(
+        path, method=method, body=json.dumps(body).encode(),
+        content_type=JSONAPI_TYPE, expect_errors=True
+    )
+
+
+def percentile(values, pct):
+    '''Nearest rank percentile of sorted values.'''
+    rank = max(int(round(pct / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+def run_scenario(app, make_request, counter, runs, warmup, alloc_runs,
+                 start=0, on_response=None):
+    '''Run one scenario and summarise it.
+
+    Args:
+        start (int): number of the first run (so that later passes go on to
+            new data).
+        on_response (callable): called with each response.
+    '''
+    for i in range(start, start + warmup):
+        response = request(app, *make_request(i))
+        if on_response is not None:
+            on_response(response)
+    start += warmup
+    latencies = []
+    queries = 0
+    errors = 0
+    for i in range(start, start + runs):
+        method, path, body = make_request(i)
+        counter.count = 0
+        began = time.perf_counter()
+        response = request(app, method, path, body)
+        latencies.append(time.perf_counter() - began)
+        queries += counter.count
+        if response.status_int >= 400:
+            errors += 1
+        if on_response is not None:
+            on_response(response)
+    start += runs
+    peaks = []
+    if alloc_runs:
+        tracemalloc.start()
+        try:
+            for i in range(start, start + alloc_runs):
+                method, path, body = make_request(i)
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                response = request(app, method, path, body)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+                if on_response is not None:
+                    on_response(response)
+        finally:
+            tracemalloc.stop()
+    latencies.sort()
+    ms = [latency * 1000 for latency in latencies]
+    return {
+        'requests': runs,
+        'errors': errors,
+        'latency_ms': {
+            'mean': round(statistics.mean(ms), 3),
+            'p50': round(percentile(ms, 50), 3),
+            'p90': round(percentile(ms, 90), 3),
+            'p99': round(percentile(ms, 99), 3),
+            'max': round(ms[-1], 3),
+        },
+        'queries_per_request': round(queries / runs, 2),
+        'alloc_peak_kib': round(
+            statistics.mean(peaks) / 1024, 1
+        ) if peaks else None,
+    }
+
+
+def database(scale, rows, db_dir):
+    '''Path to a populated SQLite file for scale, reusing one in db_dir.
+
+    Returns:
+        tuple: (path, populate arguments, seconds spent populating).
+    '''
+    args = sizes(rows)
+    path = os.path.join(db_dir, 'bench-{}-{}.sqlite'.format(
+        scale, args['people']
+    ))
+    if os.path.exists(path):
+        return path, args, 0
+    engine = make_engine('sqlite:///' + path)
+    began = time.perf_counter()
+    populate(engine, **args)
+    seconds = time.perf_counter() - began
+    engine.dispose()
+    return path, args, seconds
+
+
+def run_scale(scale, rows, db_dir, options):
+    path, args, populate_seconds = database(scale, rows, db_dir)
+    engine = make_engine(
+        'sqlite:///' + path, latency_ms=options.latency_ms,
+        jitter_ms=options.jitter_ms, seed=0
+    )
+    app = webtest.TestApp(make_app(engine))
+    counter = QueryCounter(engine)
+    scenario_requests, created = scenarios(args['people'])
+
+    def record_created(response):
+        created.append(response.json['data']['id'])
+
+    response_hooks = {'create': record_created}
+    results = {}
+    for name, make_request in scenario_requests.items():
+        if options.only and name not in options.only:
+            continue
+        runs, warmup, alloc_runs = \
+            options.requests, options.warmup, options.alloc_requests
+        if name == 'delete':
+            # Delete exactly the comments made by create.
+            total = len(created)
+            warmup = min(warmup, total)
+            alloc_runs = min(alloc_runs, total - warmup)
+            runs = total - warmup - alloc_runs
+            if runs <= 0:
+                continue
+        results[name] = run_scenario(
+            app, make_request, counter, runs, warmup, alloc_runs,
+            on_response=response_hooks.get(name)
+        )
+    engine.dispose()
+    return {
+        'rows': rows,
+        'people': args['people'],
+        'populate_seconds': round(populate_seconds, 3),
+        'scenarios': results,
+    }
+
+
+def compare(previous, current):
+    '''Percentage changes of the main figures from previous to current.'''
+    changes = {}
+    for scale, result in current['scales'].items():
+        before = previous.get('scales', {}).get(scale)
+        if before is None:
+            continue
+        for name, figures in result['scenarios'].items():
+            old = before['scenarios'].get(name)
+            if old is None:
+                continue
+            pairs = {
+                'p50_ms': (old['latency_ms']['p50'],
+                           figures['latency_ms']['p50']),
+                'p99_ms': (old['latency_ms']['p99'],
+                           figures['latency_ms']['p99']),
+                'queries_per_request': (old['queries_per_request'],
+                                        figures['queries_per_request']),
+                'alloc_peak_kib': (old['alloc_peak_kib'],
+                                   figures['alloc_peak_kib']),
+            }
+            changes.setdefault(scale, {})[name] = {
+                key: '{:+.1f}%'.format((new - was) / was * 100)
+                for key, (was, new) in pairs.items()
+                if was and new is not None
+            }
+    return changes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--scales', default='1k',
+        help='comma separated scales from {} (default 1k)'.format(
+            ', '.join(SCALES)
+        )
+    )
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--alloc-requests', type=int, default=10)
+    parser.add_argument(
+        '--only', type=lambda s: s.split(','), default=None,
+        help='comma separated scenario names'
+    )
+    parser.add_argument('--db-dir', default=None)
+    parser.add_argument(
+        '--latency-ms', type=float, default=0,
+        help='delay added to each database round trip'
+    )
+    parser.add_argument(
+        '--jitter-ms', type=float, default=0,
+        help='random variation (+/-) of the delay'
+    )
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--compare', default=None)
+    options = parser.parse_args(argv)
+
+    results = {
+        'meta': {
+            'time': datetime.datetime.utcnow().isoformat() + 'Z',
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'sqlalchemy': sqlalchemy.__version__,
+            'pyramid_jsonapi': pyramid_jsonapi.__version__,
+            'requests': options.requests,
+            'latency_ms': options.latency_ms,
+            'jitter_ms': options.jitter_ms,
+        },
+        'scales': {},
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_dir = options.db_dir or tmpdir
+        for scale in options.scales.split(','):
+            results['scales'][scale] = run_scale(
+                scale, SCALES[scale], db_dir, options
+            )
+    models.DBSession.remove()
+
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+    if options.compare:
+        with open(options.compare) as f:
+            previous = json.load(f)
+        print(json.dumps(
+            {'changes': compare(previous, results)}, indent=2
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+'''Measure per-worker memory with and without pyramid_jsonapi.warmup().
+
+For each mode a master process builds the app (on a SQLite file), optionally
+calls :py:func:`pyramid_jsonapi.warmup`, then forks ``--workers`` workers.
+Each worker serves ``--requests`` requests and reports, from
+``/proc/self/smaps_rollup``, its RSS and its private (i.e. not shared with the
+master) memory before and after. Linux only.
+
+Usage::
+
+    python -m benchmarks.warmup [--workers 4] [--requests 200]
+'''
+import argparse
+import json
+import os
+import tempfile
+
+from webob import Request
+
+import pyramid_jsonapi
+
+from .app import make_app, make_engine, populate
+
+PATHS = [
+    '/people?include=posts',
+    '/posts?page[limit]=20',
+    '/people/1/posts',
+    '/posts/1/relationships/comments',
+    '/comments?include=author',
+    '/blogs/1',
+]
+
+
+def memory():
+    '''RSS and private memory of this process in KiB.'''
+    fields = {}
+    with open('/proc/self/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss_kib': fields['Rss'],
+        'private_kib': fields['Private_Clean'] + fields['Private_Dirty'],
+    }
+
+
+def worker(app, requests, out):
+    before = memory()
+    for i in range(requests):
+        Request.blank(PATHS[i % len(PATHS)]).get_response(app)
+    after = memory()
+    os.write(out, json.dumps({'before': before, 'after': after}).encode())
+
+
+def run_master(path, warm, workers, requests):
+    '''Build an app, maybe warm it up, fork workers and collect their reports.
+
+    Runs in its own process so that each mode starts from cold caches.
+    '''
+    engine = make_engine('sqlite:///' + path)
+    app = make_app(engine)
+    engine.dispose()
+    if warm:
+        pyramid_jsonapi.warmup(app, engine=engine)
+    pipes = []
+    for _ in range(workers):
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read)
+            worker(app, requests, write)
+            os._exit(0)
+        os.close(write)
+        pipes.append((pid, read))
+    reports = []
+    for pid, read in pipes:
+        chunks = []
+        while True:
+            chunk = os.read(read, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        os.close(read)
+        os.waitpid(pid, 0)
+        reports.append(json.loads(b''.join(chunks)))
+    return reports
+
+
+def summarise(reports):
+    def mean(when, key):
+        return round(sum(r[when][key] for r in reports) / len(reports))
+    return {
+        when: {
+            key: mean(when, key) for key in ('rss_kib', 'private_kib')
+        }
+        for when in ('before', 'after')
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--people', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.sqlite')
+        populate(make_engine('sqlite:///' + path), people=args.people)
+        for mode, warm in (('cold', False), ('warm', True)):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read)
+                reports = run_master(path, warm, args.workers, args.requests)
+                os.write(write, json.dumps(summarise(reports)).encode())
+                os._exit(0)
+            os.close(write)
+            with os.fdopen(read) as f:
+                results[mode] = json.loads(f.read())
+            os.waitpid(pid, 0)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
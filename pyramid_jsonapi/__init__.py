@@ -3,17 +3,31 @@ import logging
 
 import sqlalchemy
 from pyramid.httpexceptions import (
+    HTTPBadRequest,
     HTTPForbidden,
-    HTTPError
+    HTTPError,
+    HTTPNotFound
 )
+from pyramid.request import Request
 import types
 import importlib
-from collections import deque
+import gc
+import time
+from collections import namedtuple
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm.relationships import RelationshipProperty
-from sqlalchemy.ext.declarative.api import DeclarativeMeta
+from sqlalchemy.ext.declarative import DeclarativeMeta
 import inflection
-from pyramid_jsonapi.collection_view_base import CollectionViewBase
+from pyramid_jsonapi.callback_chain import CallbackChain, CallbackChains
+from pyramid_jsonapi.collection_view_base import (
+    AllowedFieldsCache,
+    CollectionViewBase,
+)
+from pyramid_jsonapi import metrics, profiling, schema_cache, synthetic
+from pyramid_jsonapi.query_budget import QueryBudget
+from pyramid_jsonapi.slow_log import SlowLog
 
 __version__ = 0.3
 
@@ -22,6 +36,12 @@ MANYTOMANY = sqlalchemy.orm.interfaces.MANYTOMANY
 MANYTOONE = sqlalchemy.orm.interfaces.MANYTOONE
 
 view_classes = {}
+model_descriptors = {}
+
+ModelDescriptor = namedtuple(
+    'ModelDescriptor',
+    ['mapper', 'key_columns', 'table_name', 'columns', 'relationships']
+)
 
 log = logging.getLogger(__name__)
 
@@ -70,7 +90,9 @@ def create_jsonapi(
         for attr in models.__dict__.values():
             if isinstance(attr, DeclarativeMeta):
                 try:
-                    keycols = sqlalchemy.inspect(attr).primary_key
+                    # Not describe_model(): models are only introspected if
+                    # there is no cached schema.
+                    sqlalchemy.inspect(attr)
                 except sqlalchemy.exc.NoInspectionAvailable:
                     # Trying to inspect the declarative_base() raises this
                     # exception. We don't want to add it to the API.
@@ -81,8 +103,33 @@ def create_jsonapi(
 
     settings = config.registry.settings
 
+    # Add the profile endpoints if profiling is configured and they are
+    # protected: either by a secret or by being on a debug server. These come
+    # before the other debug endpoints so that /debug/profiles isn't taken as
+    # an action.
+    debug_endpoints = settings.get(
+        'pyramid_jsonapi.debug.debug_endpoints', 'false'
+    ) == 'true'
+    DebugView.profiler = get_profiler(config)
+    if DebugView.profiler is not None and (
+        DebugView.profiler.secret or debug_endpoints
+    ):
+        config.add_route('debug_profiles', '/debug/profiles')
+        config.add_view(
+            DebugView,
+            attr='profiles',
+            route_name='debug_profiles',
+            renderer='json'
+        )
+        config.add_route('debug_profile', '/debug/profiles/{id}')
+        config.add_view(
+            DebugView,
+            attr='profile',
+            route_name='debug_profile'
+        )
+
     # Add the debug endpoints if required.
-    if settings.get('pyramid_jsonapi.debug.debug_endpoints', 'false') == 'true':
+    if debug_endpoints:
         if engine is None:
             DebugView.engine = model_list[0].metadata.bind
         else:
@@ -116,17 +163,55 @@ def create_jsonapi(
             renderer='json'
         )
 
+    # Use the cached schema if there is one for this version of the models.
+    cache_path = settings.get('pyramid_jsonapi.schema_cache')
+    schema = None
+    if cache_path:
+        cache_key = schema_cache.model_hash(model_list, settings)
+        schema = schema_cache.load(cache_path, cache_key)
+        if schema is None:
+            metrics.CACHE_MISSES.inc(1, 'schema')
+        else:
+            metrics.CACHE_HITS.inc(1, 'schema')
+
     # Loop through the models list. Create resource endpoints for these and
     # any relationships found.
     for model_class in model_list:
-        create_resource(config, model_class, get_dbsession=get_dbsession)
+        create_resource(
+            config, model_class, get_dbsession=get_dbsession,
+            schema=None if schema is None else schema.get(
+                schema_cache.model_key(model_class)
+            )
+        )
+
+    if cache_path and schema is None:
+        schema_cache.dump(
+            cache_path, cache_key,
+            [view_classes[m] for m in model_list if m in view_classes]
+        )
+
+    if settings.get('pyramid_jsonapi.generic_routes', 'false') == 'true':
+        add_generic_routes(config)
+
+    if settings.get('pyramid_jsonapi.metrics', 'false') == 'true':
+        route_name = ':'.join((
+            settings.get(
+                'pyramid_jsonapi.route_name_prefix', 'pyramid_jsonapi'
+            ),
+            'metrics'
+        ))
+        config.add_route(
+            route_name,
+            settings.get('pyramid_jsonapi.metrics.route_pattern', '/metrics')
+        )
+        config.add_view(metrics.metrics_view, route_name=route_name)
 
 create_jsonapi_using_magic_and_pixie_dust = create_jsonapi
 
 
 def create_resource(
         config, model, get_dbsession,
-        collection_name=None, expose_fields=None,
+        collection_name=None, expose_fields=None, schema=None
 ):
     '''Produce a set of resource endpoints.
 
@@ -141,28 +226,40 @@ def create_resource(
             ``collection_view_factory()``
         expose_fields: set of field names to be exposed. Passed through to
             ``collection_view_factory()``
+        schema: cached description of the model from
+            :py:mod:`pyramid_jsonapi.schema_cache`. Passed through to
+            ``collection_view_factory()``. Ignored if ``collection_name`` or
+            ``expose_fields`` is given: the cache holds neither.
     '''
+    if schema is not None and collection_name is None and \
+            expose_fields is None:
+        return create_resource_from_schema(
+            config, model, get_dbsession, schema
+        )
 
     # Find the primary key column from the model and add it as _jsonapi_id.
     try:
-        keycols = sqlalchemy.inspect(model).primary_key
+        descriptor = describe_model(model)
     except sqlalchemy.exc.NoInspectionAvailable:
         # Trying to inspect the declarative_base() raises this exception. We
         # don't want to add it to the API.
         return
     # Only deal with one primary key column.
-    if len(keycols) > 1:
+    if len(descriptor.key_columns) > 1:
         raise Exception(
             'Model {} has more than one primary key.'.format(
                 model.__name__
             )
         )
-    model._jsonapi_id = getattr(model, keycols[0].name)
+    if '_jsonapi_id' not in model.__dict__:
+        # Adding a property to a mapped class is expensive: only do it once
+        # per model, however many times the API is created.
+        model._jsonapi_id = getattr(model, descriptor.key_columns[0].name)
 
     if collection_name is None:
-        collection_name = sqlalchemy.inspect(model).tables[0].name
+        collection_name = descriptor.table_name
 
-    collection_name = inflection.pluralize(collection_name)
+    collection_name = pluralize(collection_name)
     log.debug(collection_name)
 
     # Create a view class for use in the various add_view() calls below.
@@ -170,6 +267,28 @@ def create_resource(
         config, model, get_dbsession, collection_name,
         expose_fields=expose_fields
     )
+    add_resource(config, view)
+
+
+def create_resource_from_schema(config, model, get_dbsession, schema):
+    '''Produce a set of resource endpoints from a cached schema.
+
+    Like :py:func:`create_resource` but the collection name, fields and routes
+    come from a :py:mod:`pyramid_jsonapi.schema_cache` entry rather than from
+    introspecting the model.
+    '''
+    if '_jsonapi_id' not in model.__dict__:
+        model._jsonapi_id = getattr(model, schema['key_column'])
+    view = collection_view_factory(
+        config, model, get_dbsession, schema['collection_name'],
+        schema=schema
+    )
+    add_resource(config, view)
+
+
+def add_resource(config, view):
+    '''Register a collection view class and add its routes and views.'''
+    model = view.model
     view_classes['collection_name'] = view
     view_classes[model] = view
 
@@ -178,71 +297,365 @@ def create_resource(
         int(settings.get('pyramid_jsonapi.paging.default_limit', 10))
     view.max_limit = \
         int(settings.get('pyramid_jsonapi.paging.max_limit', 100))
-
-    # individual item
-    config.add_route(view.item_route_name, view.item_route_pattern)
-    # GET
-    config.add_view(
-        view, attr='get', request_method='GET',
-        route_name=view.item_route_name, renderer='json'
-    )
-    # DELETE
-    config.add_view(
-        view, attr='delete', request_method='DELETE',
-        route_name=view.item_route_name, renderer='json'
+    view.rowcount_delete = \
+        settings.get('pyramid_jsonapi.rowcount_delete', 'false') == 'true'
+    view.upsert = \
+        settings.get('pyramid_jsonapi.upsert', 'false') == 'true'
+    view.record_timing = \
+        settings.get('pyramid_jsonapi.timing', 'false') == 'true'
+    view.query_budget = QueryBudget.from_settings(settings)
+    view.metrics = \
+        settings.get('pyramid_jsonapi.metrics', 'false') == 'true'
+    view.slow_log = get_slow_log(config)
+    view.profiler = get_profiler(config)
+    record_callback_stats = \
+        settings.get('pyramid_jsonapi.callback_stats', 'false') == 'true'
+    for chain in view.callbacks.values():
+        chain.instrument(view.collection_name, record_callback_stats)
+    view.instrumented = view.record_timing or view.metrics or \
+        view.query_budget is not None or view.slow_log is not None or \
+        view.profiler is not None
+    if settings.get('pyramid_jsonapi.concurrent_count', 'false') == 'true':
+        view.count_executor = get_count_executor(config)
+    else:
+        view.count_executor = None
+    view.count_isolation_level = settings.get(
+        'pyramid_jsonapi.concurrent_count.isolation_level'
     )
-    # PATCH
-    config.add_view(
-        view, attr='patch', request_method='PATCH',
-        route_name=view.item_route_name, renderer='json'
+    allowed_fields_cache_size = int(
+        settings.get('pyramid_jsonapi.allowed_fields_cache_size', 0)
     )
+    if allowed_fields_cache_size:
+        view.allowed_fields_cache = AllowedFieldsCache(
+            allowed_fields_cache_size
+        )
+    else:
+        view.allowed_fields_cache = None
+
+    # The view method for each route and request method.
+    view.endpoints = {
+        # individual item
+        'item': {
+            'GET': 'get',
+            'DELETE': 'delete',
+            'PATCH': 'patch',
+        },
+        # collection
+        'collection': {
+            'GET': 'collection_get',
+            'POST': 'collection_post',
+        },
+        # related
+        'related': {
+            'GET': 'related_get',
+        },
+        # relationships
+        'relationships': {
+            'GET': 'relationships_get',
+            'POST': 'relationships_post',
+            'PATCH': 'relationships_patch',
+            'DELETE': 'relationships_delete',
+        },
+    }
+    if settings.get(
+            'pyramid_jsonapi.bulk_collection_writes', 'false'
+    ) == 'true':
+        view.endpoints['collection'].update({
+            'PATCH': 'collection_patch',
+            'DELETE': 'collection_delete',
+        })
+
+    view.route_kinds = {
+        view.item_route_name: 'item',
+        view.collection_route_name: 'collection',
+        view.related_route_name: 'related',
+        view.relationships_route_name: 'relationships',
+    }
+    get_collection_view_classes(config)[view.collection_name] = view
+
+    generic = settings.get(
+        'pyramid_jsonapi.generic_routes', 'false'
+    ) == 'true'
+    for route_name, pattern in (
+            (view.item_route_name, view.item_route_pattern),
+            (view.collection_route_name, view.collection_route_pattern),
+            (view.related_route_name, view.related_route_pattern),
+            (view.relationships_route_name, view.relationships_route_pattern),
+    ):
+        if generic:
+            # Requests are matched by the generic routes added in
+            # create_jsonapi(). These are only needed for URL generation.
+            config.add_route(route_name, pattern, static=True)
+            continue
+        config.add_route(route_name, pattern)
+        if settings.get(
+                'pyramid_jsonapi.batch_views', 'false'
+        ) == 'true':
+            # One view per route which dispatches on request method: much
+            # cheaper to register than one view per method.
+            config.add_view(
+                view, attr='dispatch', route_name=route_name,
+                renderer='json'
+            )
+        else:
+            kind = view.route_kinds[route_name]
+            for method, attr in view.endpoints[kind].items():
+                config.add_view(
+                    view, attr=attr, request_method=method,
+                    route_name=route_name, renderer='json'
+                )
 
-    # collection
-    config.add_route(view.collection_route_name, view.collection_route_pattern)
-    # GET
-    config.add_view(
-        view, attr='collection_get', request_method='GET',
-        route_name=view.collection_route_name, renderer='json'
-    )
-    # POST
-    config.add_view(
-        view, attr='collection_post', request_method='POST',
-        route_name=view.collection_route_name, renderer='json'
-    )
 
-    # related
-    config.add_route(view.related_route_name, view.related_route_pattern)
-    # GET
-    config.add_view(
-        view, attr='related_get', request_method='GET',
-        route_name=view.related_route_name, renderer='json'
-    )
+def add_generic_routes(config):
+    '''Add one route per URL shape serving every collection.
 
-    # relationships
-    config.add_route(
-        view.relationships_route_name,
-        view.relationships_route_pattern
-    )
-    # GET
-    config.add_view(
-        view, attr='relationships_get', request_method='GET',
-        route_name=view.relationships_route_name, renderer='json'
-    )
-    # POST
-    config.add_view(
-        view, attr='relationships_post', request_method='POST',
-        route_name=view.relationships_route_name, renderer='json'
+    Used instead of four routes per collection when
+    ``pyramid_jsonapi.generic_routes`` is ``true``. Each route has a
+    ``{collection}`` placeholder and only matches collection names in the
+    app's :py:func:`get_collection_view_classes`, so other routes in the app
+    are unaffected.
+    Route names and URLs generated by the API are unchanged.
+
+    Arguments:
+        config: ``pyramid.config.Configurator`` object from current app.
+    '''
+    settings = config.registry.settings
+    route_name_prefix = settings.get(
+        'pyramid_jsonapi.route_name_prefix', 'pyramid_jsonapi'
     )
-    # PATCH
-    config.add_view(
-        view, attr='relationships_patch', request_method='PATCH',
-        route_name=view.relationships_route_name, renderer='json'
+    route_pattern_prefix = settings.get(
+        'pyramid_jsonapi.route_pattern_prefix', ''
     )
-    # DELETE
-    config.add_view(
-        view, attr='relationships_delete', request_method='DELETE',
-        route_name=view.relationships_route_name, renderer='json'
+    generic_route_kinds = get_generic_route_kinds(config)
+    config.add_route_predicate('jsonapi_collection', CollectionPredicate)
+    for kind, pattern in (
+            ('item', '{collection}/{id}'),
+            ('collection', '{collection}'),
+            ('related', '{collection}/{id}/{relationship}'),
+            ('relationships', '{collection}/{id}/relationships/{relationship}'),
+    ):
+        route_name = ':'.join((route_name_prefix, '{collection}', kind))
+        if route_pattern_prefix:
+            pattern = '/'.join((route_pattern_prefix, pattern))
+        generic_route_kinds[route_name] = kind
+        config.add_route(route_name, pattern, jsonapi_collection=True)
+        config.add_view(
+            dispatch_generic, route_name=route_name, renderer='json'
+        )
+
+
+class CollectionPredicate:
+    '''Route predicate matching only known collection names.'''
+
+    def __init__(self, val, config):
+        self.val = val
+        self.collection_view_classes = get_collection_view_classes(config)
+
+    def text(self):
+        return 'jsonapi_collection = {}'.format(self.val)
+
+    phash = text
+
+    def __call__(self, info, request):
+        return (
+            info['match'].get('collection') in self.collection_view_classes
+        ) == self.val
+
+
+def dispatch_generic(request):
+    '''View for the generic routes: dispatch to the collection's view class.
+
+    The view class is found with a dict lookup on the ``collection`` part of
+    the URL, so the cost does not grow with the number of collections.
+    '''
+    view_class = get_collection_view_classes(request)[
+        request.matchdict['collection']
+    ]
+    return view_class(request).dispatch()
+
+
+def warmup(app, engine=None, freeze=True):
+    '''Warm up an app in a master process before it forks workers.
+
+    GETs one page of every collection of ``app`` (including all of its
+    relationships) through it; other apps in the process are not touched.
+    This compiles and caches the SQL for the common queries, fills
+    pyramid_jsonapi's and Pyramid's own caches and exercises the renderer, so
+    that workers start with all of that already in memory shared with the
+    master. Then, unless ``freeze`` is False, all objects are moved
+    to the permanent generation with ``gc.freeze()`` (Python >= 3.7) so that
+    the garbage collector in the workers doesn't write to (and so copy) the
+    shared pages.
+
+    Arguments:
+        app: the WSGI app from ``config.make_wsgi_app()``.
+
+    Keyword Args:
+        engine: a sqlalchemy.engine.Engine. If given, it is disposed of after
+            the requests so that workers don't share the master's database
+            connections.
+        freeze (bool): whether to call ``gc.freeze()``.
+
+    Returns:
+        dict: ``statuses`` (HTTP status of the request for each collection),
+        ``seconds`` taken and ``frozen`` (number of objects frozen).
+    '''
+    start = time.perf_counter()
+    statuses = {}
+    for view in get_collection_view_classes(app).values():
+        path = '/' + view.collection_route_pattern + '?page[limit]=1'
+        if view.relationships:
+            path += '&include=' + ','.join(view.relationships)
+        statuses[view.collection_name] = \
+            Request.blank(path).get_response(app).status_code
+    if engine is not None:
+        engine.dispose()
+    gc.collect()
+    frozen = 0
+    if freeze and hasattr(gc, 'freeze'):
+        gc.freeze()
+        frozen = gc.get_freeze_count()
+    return {
+        'statuses': statuses,
+        'seconds': time.perf_counter() - start,
+        'frozen': frozen,
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def pluralize(name):
+    '''(memoised) ``inflection.pluralize``.'''
+    return inflection.pluralize(name)
+
+
+def describe_model(model):
+    '''(memoised) Introspect a model class once.
+
+    Arguments:
+        model: a model class derived from DeclarativeMeta.
+
+    Returns:
+        ModelDescriptor: namedtuple with the model's ``mapper``,
+        ``key_columns``, ``table_name``, ``columns`` (dict of mapped columns
+        by key) and ``relationships`` (dict of relationships by key).
+
+    Raises:
+        sqlalchemy.exc.NoInspectionAvailable: if model is not mapped (e.g. it
+        is a declarative base).
+    '''
+    try:
+        return model_descriptors[model]
+    except KeyError:
+        pass
+    mapper = sqlalchemy.inspect(model).mapper
+    descriptor = ModelDescriptor(
+        mapper=mapper,
+        key_columns=tuple(mapper.primary_key),
+        table_name=mapper.tables[0].name,
+        columns=dict(mapper.columns.items()),
+        relationships=dict(mapper.relationships.items()),
     )
+    model_descriptors[model] = descriptor
+    return descriptor
+
+
+def get_collection_view_classes(config):
+    '''The app's view classes by collection name.
+
+    Arguments:
+        config: the app's Configurator, or anything else with its
+            ``registry`` (the app itself, a request).
+
+    Returns:
+        dict: view classes by collection name.
+    '''
+    registry = config.registry
+    try:
+        return registry.pyramid_jsonapi_collection_view_classes
+    except AttributeError:
+        registry.pyramid_jsonapi_collection_view_classes = {}
+        return registry.pyramid_jsonapi_collection_view_classes
+
+
+def get_generic_route_kinds(config):
+    '''The kind of route (``item``, ``collection``...) by generic route name.
+
+    Empty unless ``pyramid_jsonapi.generic_routes`` is ``true``.
+
+    Arguments:
+        config: the app's Configurator, or anything else with its
+            ``registry`` (the app itself, a request).
+
+    Returns:
+        dict: route kinds by route name.
+    '''
+    registry = config.registry
+    try:
+        return registry.pyramid_jsonapi_generic_route_kinds
+    except AttributeError:
+        registry.pyramid_jsonapi_generic_route_kinds = {}
+        return registry.pyramid_jsonapi_generic_route_kinds
+
+
+def get_profiler(config):
+    '''The app's :py:class:`pyramid_jsonapi.profiling.Profiler`, if any.
+
+    One profiler (and so one ring of profiles) is shared by all the views of
+    an app. It is made on first use from the ``pyramid_jsonapi.debug.profile``
+    settings.
+
+    Returns:
+        Profiler or None: None if profiling is not configured.
+    '''
+    registry = config.registry
+    try:
+        return registry.pyramid_jsonapi_profiler
+    except AttributeError:
+        profiler = profiling.Profiler.from_settings(registry.settings)
+        registry.pyramid_jsonapi_profiler = profiler
+        return profiler
+
+
+def get_slow_log(config):
+    '''The app's :py:class:`pyramid_jsonapi.slow_log.SlowLog`, if any.
+
+    One slow log (and so one EXPLAIN thread) is shared by all the views of an
+    app. It is made on first use from the ``pyramid_jsonapi.slow_log``
+    settings.
+
+    Returns:
+        SlowLog or None: None if the slow log is not configured.
+    '''
+    registry = config.registry
+    try:
+        return registry.pyramid_jsonapi_slow_log
+    except AttributeError:
+        slow_log = SlowLog.from_settings(registry.settings)
+        registry.pyramid_jsonapi_slow_log = slow_log
+        return slow_log
+
+
+def get_count_executor(config):
+    '''The app's thread pool for collection counts.
+
+    One pool is shared by all the views of an app. It is made on first use
+    with ``pyramid_jsonapi.concurrent_count.max_workers`` (default 4)
+    threads.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor
+    '''
+    registry = config.registry
+    try:
+        return registry.pyramid_jsonapi_count_executor
+    except AttributeError:
+        executor = ThreadPoolExecutor(max_workers=int(
+            registry.settings.get(
+                'pyramid_jsonapi.concurrent_count.max_workers', 4
+            )
+        ))
+        registry.pyramid_jsonapi_count_executor = executor
+        return executor
 
 
 def collection_view_factory(
@@ -250,7 +663,8 @@ def collection_view_factory(
         model,
         get_dbsession=None,
         collection_name=None,
-        expose_fields=None
+        expose_fields=None,
+        schema=None
 ):
     '''Build a class to handle requests for model.
 
@@ -263,6 +677,9 @@ def collection_view_factory(
     Keyword Args:
         collection_name: string name of collection.
         expose_fields: set of field names to expose.
+        schema: cached description of the model from
+            :py:mod:`pyramid_jsonapi.schema_cache`. Fields and routes are
+            taken from here rather than found by introspection.
     '''
     if collection_name is None:
         collection_name = model.__tablename__
@@ -296,9 +713,31 @@ def collection_view_factory(
         )
 
     collection_view.model = model
-    collection_view.key_column = sqlalchemy.inspect(model).primary_key[0]
     collection_view.collection_name = collection_name
     collection_view.get_dbsession = get_dbsession
+    collection_view.exposed_fields = expose_fields
+    if schema is not None:
+        mapper = model.__mapper__
+        collection_view.mapper = mapper
+        collection_view.key_column = mapper.primary_key[0]
+        for kind, (name, pattern) in schema['routes'].items():
+            setattr(collection_view, kind + '_route_name', name)
+            setattr(collection_view, kind + '_route_pattern', pattern)
+        collection_view.attributes = {
+            key: mapper.columns[key] for key in schema['attributes']
+        }
+        collection_view.relationships = {
+            key: cached_relationship(mapper, key)
+            for key in schema['relationships']
+        }
+        collection_view.fields = dict(collection_view.attributes)
+        collection_view.fields.update(collection_view.relationships)
+        collection_view.callbacks = new_callbacks()
+        return collection_view
+
+    descriptor = describe_model(model)
+    collection_view.mapper = descriptor.mapper
+    collection_view.key_column = descriptor.key_columns[0]
 
     collection_view.collection_route_name = add_route_name_prefix(
         collection_name
@@ -323,10 +762,9 @@ def collection_view_factory(
         collection_view.collection_route_pattern + \
         '/{id}/relationships/{relationship}'
 
-    collection_view.exposed_fields = expose_fields
     atts = {}
     fields = {}
-    for key, col in sqlalchemy.inspect(model).mapper.columns.items():
+    for key, col in descriptor.columns.items():
         if key == collection_view.key_column.name:
             continue
         if len(col.foreign_keys) > 0:
@@ -336,73 +774,94 @@ def collection_view_factory(
             fields[key] = col
     collection_view.attributes = atts
     rels = {}
-    for key, rel in sqlalchemy.inspect(model).mapper.relationships.items():
+    for key, rel in descriptor.relationships.items():
         if expose_fields is None or key in expose_fields:
             rels[key] = rel
     collection_view.relationships = rels
     fields.update(rels)
     collection_view.fields = fields
 
-    # All callbacks have the current view as the first argument. The comments
-    # below detail subsequent args.
-    collection_view.callbacks = {
-        'after_serialise_identifier': deque(),  # args: identifier(dict)
-        'after_serialise_object': deque(),      # args: object(dict)
-        'after_get': deque(),                   # args: document(dict)
-        'before_patch': deque(),                # args: partial_object(dict)
-        'before_delete': deque(),               # args: item(sqlalchemy)
-        'after_collection_get': deque(),        # args: document(dict)
-        'before_collection_post': deque(),      # args: object(dict)
-        'after_related_get': deque(),           # args: document(dict)
-        'after_relationships_get': deque(),     # args: document(dict)
-        'before_relationships_post': deque(),   # args: object(dict)
-        'before_relationships_patch': deque(),  # args: partial_object(dict)
-        'before_relationships_delete':
-            deque(),                            # args: parent_item(sqlalchemy)
-    }
+    collection_view.callbacks = new_callbacks()
 
     return collection_view
 
 
+def cached_relationship(mapper, key):
+    '''Get a relationship of mapper named in a cached schema.
+
+    Unlike ``mapper.relationships`` this does not configure every mapper,
+    unless the relationship is a backref: those only exist once mappers are
+    configured.
+    '''
+    try:
+        return mapper.get_property(key, _configure_mappers=False)
+    except sqlalchemy.exc.InvalidRequestError:
+        return mapper.get_property(key)
+
+
+def new_callbacks():
+    '''Empty callback chains for a new collection view class.'''
+    # All callbacks have the current view as the first argument. The comments
+    # below detail subsequent args. Chains with pipe False ignore the return
+    # values of their callbacks.
+    return CallbackChains({
+        name: CallbackChain(name=name, pipe=pipe) for name, pipe in (
+            ('after_serialise_identifier', True),  # args: identifier(dict)
+            ('after_serialise_object', True),      # args: object(dict)
+            ('after_get', True),                   # args: document(dict)
+            ('before_patch', True),                # args: partial_object(dict)
+            ('before_delete', False),              # args: item(sqlalchemy)
+            ('after_collection_get', True),        # args: document(dict)
+            ('before_collection_post', True),      # args: object(dict)
+            ('before_collection_patch',
+             True),                                # args: partial_object(dict)
+            ('before_collection_delete',
+             True),                                # args: query(sqlalchemy)
+            ('after_related_get', True),           # args: document(dict)
+            ('after_relationships_get', True),     # args: document(dict)
+            ('before_relationships_post', True),   # args: object(dict)
+            ('before_relationships_patch',
+             True),                                # args: partial_object(dict)
+            ('before_relationships_delete',
+             False),                       # args: parent_item(sqlalchemy)
+        )
+    })
+
+
 def acso_after_serialise_object(view, obj):
     '''Standard callback altering object to take account of permissions.
 
     Args:
         obj (dict): the object immediately after serialisation.
 
+    Views with an ``allowed_query_filter()`` never fetch forbidden objects,
+    so ``allowed_object()`` is only called for views without one.
+
     Returns:
         dict: the object, possibly with some fields removed, or meta
         information indicating permission was denied to the whole object.
     '''
-    if view.allowed_object(obj):
-        # Remove any forbidden fields that have been added by other
-        # callbacks. Those from the model won't have been added in the first
-        # place.
+    if view.allowed_query_clause is not None or view.allowed_object(obj):
+        # Forbidden fields from the model are never serialised (see
+        # CollectionViewBase.serialise_db_item), so there is only work to do
+        # if other callbacks have added some.
+        allowed = view.cached_allowed_fields
 
         # Keep track so we can tell the caller which ones were forbidden.
         forbidden = set()
-        if 'attributes' in obj:
-            atts = {}
-            for name, val in obj['attributes'].items():
-                if name in view.allowed_fields:
-                    atts[name] = val
-                else:
-                    forbidden.add(name)
-            obj['attributes'] = atts
-        if 'relationships' in obj:
-            rels = {}
-            for name, val in obj['relationships'].items():
-                if name in view.allowed_fields:
-                    rels[name] = val
-                else:
-                    forbidden.add(name)
-            obj['relationships'] = rels
+        for member in ('attributes', 'relationships'):
+            if member not in obj:
+                continue
+            added = obj[member].keys() - allowed
+            if added:
+                forbidden |= added
+                obj[member] = {
+                    name: val for name, val in obj[member].items()
+                    if name in allowed
+                }
         # Now add all the forbidden fields from the model to the forbidden
-        # list. They don't need to be removed from the serialised object
-        # because they should not have been added in the first place.
-        for field in view.requested_field_names:
-            if field not in view.allowed_fields:
-                forbidden.add(field)
+        # list.
+        forbidden |= view.requested_field_names - allowed
         if 'meta' not in obj:
             obj['meta'] = {}
         obj['meta']['forbidden_fields'] = list(forbidden)
@@ -473,12 +932,20 @@ class DebugView:
     These are available as ``/debug/{action}`` if
     ``pyramid_jsonapi.debug.debug_endpoints == 'true'``.
 
+    Profiles (see :py:mod:`pyramid_jsonapi.profiling`) are available as
+    ``/debug/profiles`` and ``/debug/profiles/{id}`` if
+    ``pyramid_jsonapi.debug.profile.secret`` or
+    ``pyramid_jsonapi.debug.profile.sample`` is set.
+
     Attributes:
         engine: sqlalchemy engine with connection to the db.
         metadata: sqlalchemy model metadata
         test_data: module with an ``add_to_db()`` method which will populate
             the database
+        profiler: the app's :py:class:`pyramid_jsonapi.profiling.Profiler`.
     '''
+    profiler = None
+
     def __init__(self, request):
         self.request = request
 
@@ -490,16 +957,62 @@ class DebugView:
 
     def populate(self):
         '''Create tables and populate with test data.
+
+        With a ``scale`` parameter, add that many synthetic rows to every table
+        instead (see :py:mod:`pyramid_jsonapi.synthetic`).
         '''
         # Create or update tables and schema. Safe if tables already exist.
         self.metadata.create_all(self.engine)
+        scale = self.request.params.get('scale')
+        if scale is not None:
+            try:
+                scale = int(scale)
+                if scale < 1:
+                    raise ValueError(scale)
+            except ValueError:
+                raise HTTPBadRequest(
+                    'scale must be a positive integer, not {}.'.format(scale)
+                )
+            return {
+                'populated': synthetic.populate(
+                    self.engine, self.metadata, scale
+                )
+            }
         # Add test data. Safe if test data already exists.
         self.test_data.add_to_db()
         return 'populated'
 
     def reset(self):
-        '''The same as 'drop' and then 'populate'.
+        '''The same as 'drop' and then 'populate' (with any ``scale``).
         '''
         self.drop()
         self.populate()
         return "reset"
+
+    def profiles(self):
+        '''List the stored profiles (newest last).
+        '''
+        profiling.check_allowed(self.profiler, self.request)
+        return {'profiles': self.profiler.list()}
+
+    def profile(self):
+        '''Download a stored profile.
+
+        The ``format`` parameter is ``pstats`` (the default), ``collapsed``
+        or ``text``.
+        '''
+        profiling.check_allowed(self.profiler, self.request)
+        profile_id = self.request.matchdict['id']
+        stored = self.profiler.get(profile_id)
+        if stored is None:
+            raise HTTPNotFound('No profile {}.'.format(profile_id))
+        return profiling.profile_response(
+            stored, self.request.params.get('format', 'pstats')
+        )
+
+
+metrics.add_lru_cache('pluralize', pluralize)
+metrics.add_lru_cache(
+    'collection_query_info',
+    CollectionViewBase.collection_query_info.__func__
+)
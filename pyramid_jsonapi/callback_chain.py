@@ -0,0 +1,152 @@
+'''Callback deques which know how to run themselves.
+
+Each entry of a view class's ``callbacks`` dictionary is a
+:py:class:`CallbackChain`: a ``collections.deque`` with a
+:py:meth:`CallbackChain.run` method calling every callback in turn. An empty
+chain returns straight away, so there is no cost to chains nobody uses.
+
+The dictionary itself is a :py:class:`CallbackChains`: assigning a plain deque
+(or any iterable of callbacks) to one of its names wraps it in a
+:py:class:`CallbackChain` like the one it replaces.
+
+With ``pyramid_jsonapi.callback_stats = true`` chains also count each
+callback's calls and time spent in it, in the
+``pyramid_jsonapi_callback_calls_total`` and
+``pyramid_jsonapi_callback_seconds_total`` metrics (labelled by collection,
+chain and callback). :py:meth:`CollectionViewBase.callback_stats()
+<pyramid_jsonapi.collection_view_base.CollectionViewBase.callback_stats>`
+reports them for one view class. With request timing on (see
+:py:mod:`pyramid_jsonapi.timing`) the time spent in callbacks is the
+``callbacks`` phase.
+'''
+from collections import deque
+import time
+
+from pyramid_jsonapi import metrics, timing
+
+
+def callback_name(callback):
+    '''Name of a callback for reporting.'''
+    name = getattr(callback, '__qualname__', None)
+    if name is None:
+        return repr(callback)
+    return '{}.{}'.format(getattr(callback, '__module__', '?'), name)
+
+
+class CallbackChain(deque):
+    '''A deque of callbacks with a :py:meth:`run` method.
+
+    Arguments:
+        iterable: initial callbacks.
+
+    Keyword Args:
+        name (str): name of the chain (e.g. ``after_get``).
+        pipe (bool): whether each callback's return value is passed to the
+            next (and returned by :py:meth:`run`). If False, callbacks are
+            called for their side effects and return values are ignored.
+
+    Attributes:
+        collection (str): collection name used to label stats.
+        record_stats (bool): whether :py:meth:`run` records stats.
+    '''
+
+    def __init__(self, iterable=(), maxlen=None, *, name=None, pipe=True):
+        super().__init__(iterable, maxlen)
+        self.name = name
+        self.pipe = pipe
+        self.collection = None
+        self.record_stats = False
+
+    def __copy__(self):
+        chain = type(self)(self, self.maxlen, name=self.name, pipe=self.pipe)
+        chain.instrument(self.collection, self.record_stats)
+        return chain
+
+    copy = __copy__
+
+    def __reduce__(self):
+        return (
+            _rebuild, (list(self), self.maxlen, self.name, self.pipe),
+            {
+                'collection': self.collection,
+                'record_stats': self.record_stats,
+            }
+        )
+
+    def __setstate__(self, state):
+        self.instrument(state['collection'], state['record_stats'])
+
+    def instrument(self, collection, record_stats):
+        '''Set the collection name and whether to record stats.'''
+        self.collection = collection
+        self.record_stats = record_stats
+
+    def run(self, view, value):
+        '''Call each callback in turn with ``(view, value)``.
+
+        Returns:
+            the value returned by the last callback if the chain pipes,
+            otherwise (or if there are no callbacks) value.
+        '''
+        if not self:
+            return value
+        request_timing = timing.current.get()
+        if request_timing is None:
+            return self.run_callbacks(view, value)
+        started = request_timing.start('callbacks')
+        try:
+            return self.run_callbacks(view, value)
+        finally:
+            request_timing.stop('callbacks', started)
+
+    def run_callbacks(self, view, value):
+        ''':py:meth:`run` for a chain with callbacks.'''
+        if self.record_stats:
+            return self.run_recording_stats(view, value)
+        if self.pipe:
+            for callback in self:
+                value = callback(view, value)
+        else:
+            for callback in self:
+                callback(view, value)
+        return value
+
+    def run_recording_stats(self, view, value):
+        ''':py:meth:`run`, counting and timing each callback.'''
+        for callback in self:
+            labels = (self.collection, self.name, callback_name(callback))
+            started = time.perf_counter()
+            result = callback(view, value)
+            metrics.CALLBACK_SECONDS.inc(
+                time.perf_counter() - started, *labels
+            )
+            metrics.CALLBACK_CALLS.inc(1, *labels)
+            if self.pipe:
+                value = result
+        return value
+
+
+class CallbackChains(dict):
+    '''A view class's :py:class:`CallbackChain` objects by name.
+
+    Assigning anything other than a CallbackChain (a plain deque, say) to a
+    name wraps it in a new chain with the pipe setting and instrumentation of
+    the chain it replaces. Modify ``callbacks[name]`` after that, not the
+    object assigned.
+    '''
+
+    def __setitem__(self, name, callbacks):
+        if not isinstance(callbacks, CallbackChain):
+            old = self.get(name)
+            chain = CallbackChain(
+                callbacks, getattr(callbacks, 'maxlen', None), name=name,
+                pipe=True if old is None else old.pipe
+            )
+            if old is not None:
+                chain.instrument(old.collection, old.record_stats)
+            callbacks = chain
+        super().__setitem__(name, callbacks)
+
+
+def _rebuild(callbacks, maxlen, name, pipe):
+    return CallbackChain(callbacks, maxlen, name=name, pipe=pipe)
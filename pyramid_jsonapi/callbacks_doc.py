@@ -94,6 +94,36 @@ def before_collection_post(view_instance, obj):
     '''
 
 
+def before_collection_patch(view_instance, partial_object):
+    '''Called before enacting view_instance.collection_patch().
+
+    Args:
+        view_instance (pyramid_jsonapi.CollectionViewBase): the current view
+            instance.
+
+        partial_object (dict): JSON-API patch object to be applied to every
+            matching item.
+
+    Returns:
+        dict: altered patch object.
+    '''
+
+
+def before_collection_delete(view_instance, query):
+    '''Called before enacting view_instance.collection_delete().
+
+    Args:
+        view_instance (pyramid_jsonapi.CollectionViewBase): the current view
+            instance.
+
+        query (sqlalchemy.orm.query.Query): query selecting the items to be
+            deleted.
+
+    Returns:
+        sqlalchemy.orm.query.Query: altered (probably further filtered) query.
+    '''
+
+
 def after_related_get(view_instance, document):
     '''Called before view_instance.related_get() returns.
 
@@ -4,14 +4,126 @@
  #  collection_view_base
 """
 import pyramid_jsonapi as jsapi
+from pyramid_jsonapi import metrics, profiling, timing
+import cProfile
 import re
 import functools
+import importlib
+import inspect
+import concurrent.futures
+import contextvars
+import threading
+import time
+from collections import OrderedDict
 from pyramid.httpexceptions import HTTPUnsupportedMediaType, HTTPNotAcceptable, HTTPBadRequest, HTTPNotFound, \
     HTTPConflict, HTTPFailedDependency, HTTPForbidden, HTTPError
 import sqlalchemy
-from sqlalchemy.orm import load_only, RelationshipProperty
+import sqlalchemy.pool
+from sqlalchemy.orm import load_only, RelationshipProperty, scoped_session
 from sqlalchemy.orm.exc import NoResultFound
 
+try:
+    from zope.sqlalchemy import datamanager as zope_datamanager
+except ImportError:
+    zope_datamanager = None
+
+
+def mark_changed(session):
+    '''Tell zope.sqlalchemy (if it manages session) that data has changed.
+
+    zope.sqlalchemy commits a session at the end of the transaction only if
+    the ORM has written through it: anything written with
+    ``session.execute()`` would otherwise be rolled back.
+
+    Args:
+        session: sqlalchemy session or scoped_session.
+    '''
+    if zope_datamanager is None:
+        return
+    if isinstance(session, scoped_session):
+        session = session()
+    # Only sessions which have joined a zope transaction are in
+    # _SESSION_STATE: marking any other would join it to one.
+    if session in zope_datamanager._SESSION_STATE:
+        zope_datamanager.mark_changed(session)
+
+
+# Session.execute() takes bind_arguments from SQLAlchemy 1.4, which deprecates
+# passing mapper directly.
+BIND_ARGUMENTS = 'bind_arguments' in inspect.signature(
+    sqlalchemy.orm.Session.execute
+).parameters
+
+
+def execute_for_model(session, statement, params=None, model=None):
+    '''session.execute() on the bind for model (whatever the version).
+
+    Args:
+        session: sqlalchemy session or scoped_session.
+        statement: core statement to execute.
+        params: parameters (a list for executemany).
+        model: mapped class used to find the bind.
+
+    Returns:
+        the result of ``session.execute()``.
+    '''
+    if BIND_ARGUMENTS:
+        return session.execute(
+            statement, params, bind_arguments={'mapper': model}
+        )
+    return session.execute(statement, params, mapper=model)
+
+
+class AllowedFieldsCache:
+    '''Bounded LRU cache of views' allowed fields, by allowed_fields_key().
+
+    Shared by all requests to one view class. Provides ``cache_info()`` and
+    ``cache_clear()`` like a ``functools.lru_cache`` function.
+
+    Arguments:
+        maxsize (int): maximum number of keys kept.
+    '''
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, view):
+        '''The allowed fields of view, computed once per key.
+
+        Returns:
+            frozenset: allowed field names.
+        '''
+        key = view.allowed_fields_key()
+        with self.lock:
+            fields = self.items.get(key)
+            if fields is not None:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return fields
+        # Computed outside the lock: allowed_fields may be slow.
+        fields = frozenset(view.allowed_fields)
+        with self.lock:
+            self.misses += 1
+            self.items[key] = fields
+            if len(self.items) > self.maxsize:
+                self.items.popitem(last=False)
+        return fields
+
+    def cache_info(self):
+        return functools._CacheInfo(
+            self.hits, self.misses, self.maxsize, len(self.items)
+        )
+
+    def cache_clear(self):
+        with self.lock:
+            self.items.clear()
+            self.hits = 0
+            self.misses = 0
+
 
 class CollectionViewBase:
     '''Base class for all view classes.
@@ -19,15 +131,21 @@ class CollectionViewBase:
     Arguments:
         request (pyramid.request): passed by framework.
     '''
+    allowed_fields_cache = None
+
     def __init__(self, request):
         self.request = request
-        self.get_dbsession = self.request.db if self.get_dbsession is None else self.get_dbsession
+        self.get_dbsession = self.request.db if self.get_dbsession is None else self.get_dbsession()
         self.views = {}
 
     def jsonapi_view(f):
         '''Decorator for view functions. Adds jsonapi boilerplate.'''
         @functools.wraps(f)
         def new_f(self, *args):
+            request_timing = timing.current.get()
+            if request_timing is not None:
+                parse_started = request_timing.start('parse')
+
             # Spec says to reject (with 415) any request with media type
             # params.
             cth = self.request.headers.get('content-type', '').split(';')
@@ -65,6 +183,9 @@ class CollectionViewBase:
                     )
                 )
 
+            if request_timing is not None:
+                request_timing.stop('parse', parse_started)
+
             # Spec says set Content-Type to application/vnd.api+json.
             self.request.response.content_type = 'application/vnd.api+json'
 
@@ -103,7 +224,103 @@ class CollectionViewBase:
                 ret['meta'].update({'debug': debug})
 
             return ret
-        return new_f
+
+        @functools.wraps(f)
+        def timed_f(self, *args):
+            if not self.instrumented or timing.current.get() is not None:
+                return new_f(self, *args)
+            request_timing = timing.RequestTiming()
+            self.request.jsonapi_timing = request_timing
+            bind = self.get_dbsession.get_bind(mapper=self.mapper)
+            timing.instrument(bind)
+            request_timing.context = self.collection_name
+            token = timing.current.set(request_timing)
+            started = request_timing.start('total')
+            # Response callbacks so that error responses are covered too.
+            if self.record_timing:
+                self.request.add_response_callback(request_timing.add_header)
+            if self.metrics:
+                self.request.add_response_callback(metrics.record_response(
+                    self.collection_name, f.__name__, started,
+                    time.perf_counter
+                ))
+            profile = None
+            if self.profiler is not None and self.profiler.wants(self.request):
+                profile = cProfile.Profile()
+                self.request.add_response_callback(profiling.add_header)
+            error = None
+            try:
+                if profile is None:
+                    ret = new_f(self, *args)
+                else:
+                    ret = profile.runcall(new_f, self, *args)
+            except Exception as e:
+                error = e
+                raise
+            finally:
+                request_timing.stop('total', started)
+                if profile is not None:
+                    self.request.jsonapi_profile_id = self.profiler.store(
+                        profile, profiling.request_info(
+                            self.request, request_timing.phases['total']
+                        )
+                    )
+                timing.current.reset(token)
+                if self.metrics:
+                    metrics.DB_STATEMENTS.inc(
+                        request_timing.db_count,
+                        self.collection_name, f.__name__
+                    )
+                # Failed requests are logged too.
+                if self.slow_log is not None:
+                    self.slow_log.check(request_timing, self, bind, error)
+            if self.query_budget is not None:
+                self.query_budget.check(request_timing, self)
+            debug = ret.get('meta', {}).get('debug')
+            if debug is not None and self.record_timing:
+                debug['timing'] = request_timing.as_dict()
+            return ret
+        return timed_f
+
+    def dispatch(self):
+        '''Call the view method for the matched route and request method.
+
+        Used as the single view for each route when views are batched
+        (``pyramid_jsonapi.batch_views``) and by the generic
+        routes (``pyramid_jsonapi.generic_routes``). The method is looked up
+        in ``self.endpoints`` by kind of route and request method.
+
+        Raises:
+            HTTPNotFound: if there is no view method for the request method
+            (as Pyramid does when no view's ``request_method`` matches).
+        '''
+        method = self.request.method
+        if method == 'HEAD':
+            method = 'GET'
+        route_name = self.request.matched_route.name
+        kind = self.route_kinds.get(route_name) or \
+            jsapi.get_generic_route_kinds(self.request).get(route_name)
+        try:
+            attr = self.endpoints[kind][method]
+        except KeyError:
+            raise HTTPNotFound(
+                'Method {} not supported for {}'.format(
+                    self.request.method, self.request.path
+                )
+            )
+        return getattr(self, attr)()
+
+    def route_name(self):
+        '''Name of the per collection route matched by this request.
+
+        With generic routes the matched route is shared by all collections:
+        this returns the name of the equivalent per collection route.
+        '''
+        name = self.request.matched_route.name
+        kind = jsapi.get_generic_route_kinds(self.request).get(name)
+        if kind is None:
+            return name
+        return getattr(self, kind + '_route_name')
 
     @jsonapi_view
     def get(self):
@@ -140,15 +357,24 @@ class CollectionViewBase:
 
                 http GET http://localhost:6543/people/1
         '''
-        ret = self.single_return(
-            self.single_item_query,
-            'No id {} in collection {}'.format(
-                self.request.matchdict['id'],
-                self.collection_name
+        obj_id = self.request.matchdict['id']
+        try:
+            ret = self.single_return(
+                self.single_item_query,
+                'No id {} in collection {}'.format(
+                    obj_id,
+                    self.collection_name
+                )
             )
-        )
-        for callback in self.callbacks['after_get']:
-            ret = callback(self, ret)
+        except HTTPNotFound:
+            # Excluded by allowed_query_filter() or really not there?
+            if self.allowed_query_clause is not None and \
+                    self.object_exists(obj_id):
+                raise HTTPForbidden('No permission to view {}/{}.'.format(
+                    self.collection_name, obj_id
+                ))
+            raise
+        ret = self.callbacks['after_get'].run(self, ret)
         return ret
 
     @jsonapi_view
@@ -231,6 +457,7 @@ class CollectionViewBase:
                     self.collection_name, self.request.matchdict['id']
                 )
             )
+        self.check_write_allowed(self.request.matchdict['id'])
 
         db_session = self.get_dbsession
         data = self.request.json_body['data']
@@ -248,8 +475,7 @@ class CollectionViewBase:
                     data_id, req_id
                 )
             )
-        for callback in self.callbacks['before_patch']:
-            data = callback(self, data)
+        data = self.callbacks['before_patch'].run(self, data)
         atts = data.get('attributes', {})
         atts[self.key_column.name] = req_id
         item = db_session.merge(self.model(**atts))
@@ -339,6 +565,9 @@ class CollectionViewBase:
 
                 http DELETE http://localhost:6543/people/1
         '''
+        if self.rowcount_delete and not self.delete_needs_orm:
+            return self.delete_by_rowcount()
+        self.check_write_allowed(self.request.matchdict['id'])
         db_session = self.get_dbsession
         item = db_session.query(
             self.model
@@ -348,8 +577,7 @@ class CollectionViewBase:
             self.request.matchdict['id']
         )
         if item:
-            for callback in self.callbacks['before_delete']:
-                callback(self, item)
+            self.callbacks['before_delete'].run(self, item)
             try:
                 db_session.delete(item)
                 db_session.flush()
@@ -363,6 +591,66 @@ class CollectionViewBase:
         else:
             return {'data': None}
 
+    def delete_by_rowcount(self):
+        '''Delete the item referenced by the request without loading it.
+
+        Issues ``DELETE FROM <table> WHERE <key_column> = :id`` directly and
+        uses the number of rows affected to decide what to return. Used by
+        :py:func:`delete` when ``rowcount_delete`` is set on the view class and
+        :py:attr:`delete_needs_orm` is ``False``.
+
+        Returns:
+            dict: Resource Identifier for deleted object, or ``{'data': None}``
+            if there was no such object.
+
+        Raises:
+            HTTPFailedDependency: if deleting would break a database constraint.
+
+            HTTPForbidden: if :py:func:`allowed_query_filter` excludes the
+            item.
+        '''
+        db_session = self.get_dbsession
+        obj_id = self.request.matchdict['id']
+        try:
+            rowcount = self.query_add_allowed_filter(
+                db_session.query(self.model)
+            ).filter(
+                self.model._jsonapi_id == obj_id
+            ).delete(synchronize_session=False)
+        except sqlalchemy.exc.IntegrityError as e:
+            raise HTTPFailedDependency(str(e))
+        if rowcount:
+            return {
+                'data': self.serialise_resource_identifier(obj_id)
+            }
+        self.check_write_allowed(obj_id)
+        return {'data': None}
+
+    @property
+    def delete_needs_orm(self):
+        '''Whether a DELETE must go through the ORM (load then delete).
+
+        The ORM path is required if there are any ``before_delete`` callbacks
+        (they are passed the loaded item) or if the ORM would have to visit
+        related rows when the item is deleted: relationships with a ``delete``
+        cascade and TOMANY relationships without ``passive_deletes`` (the ORM
+        nulls foreign keys or removes association rows for those).
+
+        Returns:
+            bool: True if the load-free delete cannot be used.
+        '''
+        if self.callbacks['before_delete']:
+            return True
+        mapper = sqlalchemy.inspect(self.model).mapper
+        for rel in mapper.relationships:
+            if rel.viewonly:
+                continue
+            if rel.cascade.delete:
+                return True
+            if rel.direction is not jsapi.MANYTOONE and not rel.passive_deletes:
+                return True
+        return False
+
     @jsonapi_view
     def collection_get(self):
         '''Handle GET requests for the collection.
@@ -424,25 +712,39 @@ class CollectionViewBase:
         ).options(
             load_only(*self.allowed_requested_query_columns.keys())
         )
+        q = self.query_add_allowed_filter(q)
         q = self.query_add_sorting(q)
         q = self.query_add_filtering(q)
         qinfo = self.collection_query_info(self.request)
-        try:
-            count = q.count()
-        except sqlalchemy.exc.ProgrammingError as e:
-            raise HTTPBadRequest(
-                "Could not use operator '{}' with field '{}'".format(
-                    op, prop.name
-                )
+        count_bind = None
+        if self.count_executor is not None:
+            count_bind = self.concurrent_count_bind()
+        if count_bind is not None:
+            # Count on another connection while the page is fetched and
+            # serialised. collection_return() waits for the result. The
+            # request's context goes too, so that timing (and so metrics and
+            # query budgets) record the count statement.
+            count = self.count_executor.submit(
+                contextvars.copy_context().run,
+                self.separate_count, q, count_bind
             )
+        else:
+            try:
+                with timing.phase('query'):
+                    count = self.count_query(q)
+            except sqlalchemy.exc.ProgrammingError as e:
+                raise HTTPBadRequest(
+                    "Could not use operator '{}' with field '{}'".format(
+                        op, prop.name
+                    )
+                )
         q = q.offset(qinfo['page[offset]'])
         q = q.limit(qinfo['page[limit]'])
 
         ret = self.collection_return(q, count=count)
 
         # Alter return dict with any callbacks.
-        for callback in self.callbacks['after_collection_get']:
-            ret = callback(self, ret)
+        ret = self.callbacks['after_collection_get'].run(self, ret)
         return ret
 
     @jsonapi_view
@@ -487,7 +789,15 @@ class CollectionViewBase:
 
             HTTPConflict: if creating the object would break a database
             constraint (most commonly if an id is supplied by the client and
-            an item with that id already exists).
+            an item with that id already exists and upsert mode is off).
+
+            HTTPBadRequest: if a list of resource objects is supplied and
+            upsert mode is off, or if any of them lacks an id.
+
+        In upsert mode (``pyramid_jsonapi.upsert = true`` together with
+        ``pyramid_jsonapi.allow_client_ids = true``), resource objects with an
+        id are created or updated as appropriate by
+        :py:func:`upsert_objects` and ``data`` may also be a list of them.
 
         Examples:
             Create a new person with name 'monty' and let the server pick the
@@ -506,9 +816,55 @@ class CollectionViewBase:
         db_session = self.get_dbsession
         data = self.request.json_body['data']
 
+        if isinstance(data, list):
+            if not self.upsert:
+                raise HTTPBadRequest(
+                    'A list of resource objects can only be POSTed in ' +
+                    'upsert mode.'
+                )
+            objects = [self.checked_post_object(obj) for obj in data]
+            if not all('id' in obj for obj in objects):
+                raise HTTPBadRequest(
+                    'Every resource object in an upsert must have an id.'
+                )
+            return self.upsert_objects(objects, single=False)
+        data = self.checked_post_object(data)
+        if self.upsert and 'id' in data:
+            return self.upsert_objects([data], single=True)
+
+        item = self.item_from_resource_object(data)
+        try:
+            db_session.add(item)
+            db_session.flush()
+        except sqlalchemy.exc.IntegrityError as e:
+            raise HTTPConflict(e.args[0])
+        self.request.response.status_code = 201
+        self.request.response.headers['Location'] = self.request.route_url(
+            self.item_route_name,
+            **{'id': item._jsonapi_id}
+        )
+        return {
+            'data': self.serialise_db_item(item, {})
+        }
+
+    def checked_post_object(self, data):
+        '''Run callbacks on and check a resource object which is to be created.
+
+        Args:
+            data (dict): resource object from the request body.
+
+        Returns:
+            dict: resource object after ``before_collection_post`` callbacks.
+
+        Raises:
+            HTTPForbidden: if an id is presented and client ids are not
+            supported.
+
+            HTTPConflict: if type is not present or is different from the
+            collection name.
+        '''
         # Alter data with any callbacks.
-        for callback in self.callbacks['before_collection_post']:
-            data = callback(self, data)
+        data = self.callbacks['before_collection_post'].run(self, data)
 
         # Check to see if we're allowing client ids
         if self.request.registry.settings.get(
@@ -519,10 +875,33 @@ class CollectionViewBase:
         datatype = data.get('type')
         if datatype != self.collection_name:
             raise HTTPConflict("Unsupported type '{}'".format(datatype))
-        atts = data['attributes']
+        return data
+
+    def item_from_resource_object(self, data, merge=False):
+        '''Build a model instance from a resource object.
+
+        Args:
+            data (dict): resource object, already passed through
+                :py:func:`checked_post_object`.
+
+        Keyword Args:
+            merge (bool): merge the attributes into the session (updating any
+                existing item with the same id) before setting relationships.
+
+        Returns:
+            instance of ``self.model`` with attributes and relationships set:
+            transient unless ``merge`` is True.
+
+        Raises:
+            HTTPNotFound: if a non existent relationship is referenced.
+        '''
+        db_session = self.get_dbsession
+        atts = data.get('attributes', {})
         if 'id' in data:
-            atts['id'] = data['id']
+            atts[self.key_column.name] = data['id']
         item = self.model(**atts)
+        if merge:
+            item = db_session.merge(item)
         mapper = sqlalchemy.inspect(self.model).mapper
         with db_session.no_autoflush:
             for relname, reldata in data.get('relationships', {}).items():
@@ -553,19 +932,408 @@ class CollectionViewBase:
                         db_session.query(rel_class).get(
                             reldata['data']['id'])
                     )
+        return item
+
+    def upsert_objects(self, objects, single=True):
+        '''Create or update items from resource objects with client ids.
+
+        On PostgreSQL and SQLite (where the installed SQLAlchemy supports it)
+        all objects without relationships are written with ``INSERT ... ON
+        CONFLICT (<key_column>) DO UPDATE``, one statement per distinct set of
+        attributes. Otherwise each object is ``merge()``'d into the session.
+
+        Args:
+            objects (list): resource objects, each with an id, already passed
+                through :py:func:`checked_post_object`.
+
+        Keyword Args:
+            single (bool): return one resource object rather than a list.
+
+        Returns:
+            dict: ``{"data": resource object(s)}`` where each resource object
+            has ``meta.upserted`` set to ``"created"`` or ``"updated"``.
+
+        Raises:
+            HTTPBadRequest: if an unknown attribute is supplied.
+
+            HTTPConflict: if writing would break a database constraint.
+
+            HTTPForbidden: if :py:func:`allowed_query_filter` excludes an
+            existing item.
+        '''
+        db_session = self.get_dbsession
+        ids = [obj['id'] for obj in objects]
+        existing_query = db_session.query(
+            self.model._jsonapi_id
+        ).filter(
+            self.model._jsonapi_id.in_(ids)
+        )
+        existing = {str(row[0]) for row in existing_query}
+        clause = self.allowed_query_clause
+        if clause is not None and existing:
+            forbidden = existing - {
+                str(row[0]) for row in existing_query.filter(clause)
+            }
+            if forbidden:
+                raise HTTPForbidden('No permission to update {}/{}.'.format(
+                    self.collection_name, ','.join(sorted(forbidden))
+                ))
+        insert = self.upsert_insert()
         try:
-            db_session.add(item)
-            db_session.flush()
+            if insert is None or any(
+                    obj.get('relationships') for obj in objects
+            ):
+                for obj in objects:
+                    self.item_from_resource_object(obj, merge=True)
+                db_session.flush()
+            else:
+                # Group rows by the columns they set so that each group can
+                # be sent as one executemany.
+                groups = {}
+                for obj in objects:
+                    row = {self.key_column.name: obj['id']}
+                    for key, val in obj.get('attributes', {}).items():
+                        try:
+                            row[self.attributes[key].name] = val
+                        except KeyError:
+                            raise HTTPBadRequest(
+                                'Collection {} has no attribute {}'.format(
+                                    self.collection_name, key
+                                )
+                            )
+                    groups.setdefault(frozenset(row), []).append(row)
+                for cols, rows in groups.items():
+                    stmt = insert(self.key_column.table)
+                    update = {
+                        col: getattr(stmt.excluded, col) for col in cols
+                        if col != self.key_column.name
+                    }
+                    if update:
+                        # Don't update rows which became forbidden since
+                        # they were checked.
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[self.key_column],
+                            set_=update,
+                            where=clause
+                        )
+                    else:
+                        stmt = stmt.on_conflict_do_nothing(
+                            index_elements=[self.key_column]
+                        )
+                    execute_for_model(db_session, stmt, rows, self.model)
+                mark_changed(db_session)
         except sqlalchemy.exc.IntegrityError as e:
             raise HTTPConflict(e.args[0])
-        self.request.response.status_code = 201
-        self.request.response.headers['Location'] = self.request.route_url(
-            self.item_route_name,
-            **{'id': item._jsonapi_id}
+
+        items = {
+            str(item._jsonapi_id): item
+            for item in db_session.query(
+                self.model
+            ).options(
+                load_only(*self.allowed_requested_query_columns.keys())
+            ).populate_existing().filter(
+                self.model._jsonapi_id.in_(ids)
+            )
+        }
+        data = []
+        for obj_id in ids:
+            ret = self.serialise_db_item(items[str(obj_id)], {})
+            ret.setdefault('meta', {})['upserted'] = \
+                'updated' if str(obj_id) in existing else 'created'
+            data.append(ret)
+
+        if len(existing) < len(set(str(obj_id) for obj_id in ids)):
+            self.request.response.status_code = 201
+            if single:
+                self.request.response.headers['Location'] = \
+                    self.request.route_url(
+                        self.item_route_name,
+                        **{'id': ids[0]}
+                    )
+        if single:
+            return {'data': data[0]}
+        return {'data': data}
+
+    def upsert_insert(self):
+        '''Find a dialect specific insert() supporting ON CONFLICT.
+
+        Returns:
+            callable or None: ``insert`` from ``sqlalchemy.dialects.<name>``
+            if the bound database is PostgreSQL or SQLite and that dialect
+            supports ``on_conflict_do_update``, otherwise None.
+        '''
+        dialect = self.get_dbsession.get_bind(mapper=self.model).dialect.name
+        if dialect not in ('postgresql', 'sqlite'):
+            return None
+        insert = getattr(
+            importlib.import_module('sqlalchemy.dialects.' + dialect),
+            'insert',
+            None
         )
-        return {
-            'data': self.serialise_db_item(item, {})
+        if insert is None or not hasattr(
+                insert(self.key_column.table), 'on_conflict_do_update'
+        ):
+            return None
+        return insert
+
+    @jsonapi_view
+    def collection_patch(self):
+        '''Handle PATCH requests for the collection.
+
+        Update the attributes of every item matching the filter parameters
+        with a single set based ``UPDATE``. Only available if
+        ``pyramid_jsonapi.bulk_collection_writes`` is ``true``.
+
+        **Query Parameters**
+
+            **filter[<attribute>:<op>]:** filter operation (at least one
+            required).
+
+            **ids:** if ``true``, return identifiers of the affected items.
+
+        **Request Body**
+
+            **Partial resource object** (*json*) in the form:
+
+            .. parsed-literal::
+
+                {
+                    "data": {
+                        "type": <collection>,
+                        "attributes": { <attribute_name>: <value>, ... }
+                    }
+                }
+
+        Returns:
+            dict: dict in the form:
+
+            .. parsed-literal::
+
+                {
+                    "data": [ resource identifiers ] (only if ids=true),
+                    "meta": {
+                        "results": { "affected": <number of items> },
+                        "updated": { "attributes": [ <attribute_name>, ... ] }
+                    }
+                }
+
+        Raises:
+            HTTPBadRequest: if there are no filters or an attribute is unknown.
+
+            HTTPConflict: if type is different from the collection name.
+
+            HTTPForbidden: if an attribute is not in ``allowed_fields`` or
+            ``allowed_bulk_action`` returns False.
+
+            HTTPFailedDependency: if a database constraint would be broken.
+
+        Example:
+            Retitle all posts published before 2015-01-03:
+
+            .. parsed-literal::
+
+                http PATCH http://localhost:6543/posts?filter[published_at:lt]=2015-01-03 data:='
+                {
+                    "type":"posts",
+                    "attributes": {
+                        "title": "archived"
+                    }
+                }' Content-Type:application/vnd.api+json
+        '''
+        data = self.request.json_body['data']
+        if self.collection_name != data.get('type'):
+            raise HTTPConflict(
+                'JSON type ({}) does not match URL type ({}).'.format(
+                    data.get('type'), self.collection_name
+                )
+            )
+        data = self.callbacks['before_collection_patch'].run(self, data)
+        atts = data.get('attributes', {})
+        for att in atts:
+            if att not in self.attributes:
+                raise HTTPBadRequest(
+                    'Collection {} has no attribute {}'.format(
+                        self.collection_name, att
+                    )
+                )
+            if att not in self.cached_allowed_fields:
+                raise HTTPForbidden(
+                    'No permission to update {}.{}'.format(
+                        self.collection_name, att
+                    )
+                )
+        q = self.bulk_query()
+        count, ret = self.bulk_execute(q, atts)
+        ret['meta'] = {
+            'results': {'affected': count},
+            'updated': {'attributes': list(atts)}
         }
+        return ret
+
+    @jsonapi_view
+    def collection_delete(self):
+        '''Handle DELETE requests for the collection.
+
+        Delete every item matching the filter parameters with a single set
+        based ``DELETE``. ``before_delete`` callbacks and ORM cascades are not
+        run. Only available if ``pyramid_jsonapi.bulk_collection_writes`` is
+        ``true``.
+
+        **Query Parameters**
+
+            **filter[<attribute>:<op>]:** filter operation (at least one
+            required).
+
+            **ids:** if ``true``, return identifiers of the affected items.
+
+        Returns:
+            dict: dict in the form:
+
+            .. parsed-literal::
+
+                {
+                    "data": [ resource identifiers ] (only if ids=true),
+                    "meta": {
+                        "results": { "affected": <number of items> }
+                    }
+                }
+
+        Raises:
+            HTTPBadRequest: if there are no filters.
+
+            HTTPForbidden: if ``allowed_bulk_action`` returns False.
+
+            HTTPFailedDependency: if a database constraint would be broken.
+
+        Example:
+            Delete all comments by people/2:
+
+            .. parsed-literal::
+
+                http DELETE http://localhost:6543/comments?filter[author_id:eq]=2
+        '''
+        q = self.bulk_query()
+        q = self.callbacks['before_collection_delete'].run(self, q)
+        count, ret = self.bulk_execute(q)
+        ret['meta'] = {'results': {'affected': count}}
+        return ret
+
+    def bulk_query(self):
+        '''A query representing the items targeted by a bulk PATCH or DELETE.
+
+        Returns:
+            sqlalchemy.orm.query.Query: query filtered as specified by the
+            ``filter`` query parameters and by
+            :py:func:`allowed_query_filter`.
+
+        Raises:
+            HTTPBadRequest: if there are no filters (bulk actions on a whole
+            collection are not allowed).
+
+            HTTPForbidden: if ``allowed_bulk_action`` returns False.
+        '''
+        qinfo = self.collection_query_info(self.request)
+        if not qinfo['_filters']:
+            raise HTTPBadRequest(
+                'At least one filter is required for bulk {}.'.format(
+                    self.request.method
+                )
+            )
+        q = self.query_add_allowed_filter(
+            self.query_add_filtering(self.get_dbsession.query(self.model))
+        )
+        if not self.allowed_bulk_action(q):
+            raise HTTPForbidden(
+                'No permission to {} {} in bulk.'.format(
+                    self.request.method, self.collection_name
+                )
+            )
+        return q
+
+    def bulk_execute(self, q, values=None):
+        '''Run a bulk UPDATE (given values) or DELETE of the items in q.
+
+        **Query Parameters**
+
+            **ids:** if ``true``, also find identifiers of the affected items.
+
+        Where the database supports ``UPDATE`` and ``DELETE`` with
+        ``RETURNING`` (PostgreSQL) the identifiers are returned by the
+        statement itself, so they are exactly the items changed. Otherwise
+        they are selected (``FOR UPDATE``, where supported) before the write:
+        the selected items cannot change in between, but items created
+        meanwhile which match the filters may be written without being
+        reported (and SQLite has no ``FOR UPDATE``).
+
+        Args:
+            q (sqlalchemy.orm.query.Query): query from :py:func:`bulk_query`.
+
+        Keyword Args:
+            values (dict): new values by attribute name for an UPDATE, or None
+                for a DELETE.
+
+        Returns:
+            tuple: the number of items affected and a dict,
+            ``{"data": [ resource identifiers ]}`` if requested or else empty.
+
+        Raises:
+            HTTPBadRequest: if the database rejects a filter value.
+
+            HTTPFailedDependency: if a database constraint would be broken.
+        '''
+        ids = self.request.params.get('ids', 'false') == 'true'
+        db_session = self.get_dbsession
+        try:
+            if ids and self.bulk_returning():
+                table = self.key_column.table
+                if values is None:
+                    stmt = sqlalchemy.delete(table)
+                else:
+                    stmt = sqlalchemy.update(table).values({
+                        self.attributes[key]: val
+                        for key, val in values.items()
+                    })
+                rows = execute_for_model(
+                    db_session,
+                    stmt.where(q.whereclause).returning(self.key_column),
+                    model=self.model
+                ).fetchall()
+                mark_changed(db_session)
+                item_ids = [row[0] for row in rows]
+                count = len(item_ids)
+            else:
+                item_ids = None
+                if ids:
+                    item_ids = [
+                        row[0] for row in q.with_entities(
+                            self.model._jsonapi_id
+                        ).with_for_update()
+                    ]
+                if values is None:
+                    count = q.delete(synchronize_session=False)
+                else:
+                    count = q.update(values, synchronize_session=False)
+        except sqlalchemy.exc.IntegrityError as e:
+            raise HTTPFailedDependency(str(e))
+        except (sqlalchemy.exc.DataError, sqlalchemy.exc.ProgrammingError) as e:
+            raise HTTPBadRequest(str(e))
+        if item_ids is None:
+            return count, {}
+        return count, {
+            'data': [
+                self.serialise_resource_identifier(item_id)
+                for item_id in item_ids
+            ]
+        }
+
+    def bulk_returning(self):
+        '''Whether bulk UPDATE and DELETE can return identifiers.
+
+        Returns:
+            bool: True if the bound database is PostgreSQL.
+        '''
+        bind = self.get_dbsession.get_bind(mapper=self.model)
+        return bind.dialect.name == 'postgresql'
 
     @jsonapi_view
     def related_get(self):
@@ -652,7 +1420,8 @@ class CollectionViewBase:
             q = rel_view.query_add_filtering(q)
             qinfo = rel_view.collection_query_info(self.request)
             try:
-                count = q.count()
+                with timing.phase('query'):
+                    count = self.count_query(q)
             except sqlalchemy.exc.ProgrammingError as e:
                 raise HTTPBadRequest(
                     "Could not use operator '{}' with field '{}'".format(
@@ -666,8 +1435,7 @@ class CollectionViewBase:
             ret = rel_view.single_return(q)
 
         # Alter return dict with any callbacks.
-        for callback in self.callbacks['after_related_get']:
-            ret = callback(self, ret)
+        ret = self.callbacks['after_related_get'].run(self, ret)
         return ret
 
     @jsonapi_view
@@ -753,7 +1521,8 @@ class CollectionViewBase:
             q = rel_view.query_add_filtering(q)
             qinfo = rel_view.collection_query_info(self.request)
             try:
-                count = q.count()
+                with timing.phase('query'):
+                    count = self.count_query(q)
             except sqlalchemy.exc.ProgrammingError as e:
                 raise HTTPBadRequest(
                     "Could not use operator '{}' with field '{}'".format(
@@ -771,8 +1540,7 @@ class CollectionViewBase:
             ret = rel_view.single_return(q, identifier=True)
 
         # Alter return dict with any callbacks.
-        for callback in self.callbacks['after_relationships_get']:
-            ret = callback(self, ret)
+        ret = self.callbacks['after_relationships_get'].run(self, ret)
         return ret
 
     @jsonapi_view
@@ -846,11 +1614,11 @@ class CollectionViewBase:
 
         # Alter data with any callbacks
         data = self.request.json_body['data']
-        for callback in self.callbacks['before_relationships_post']:
-            data = callback(self, data)
+        data = self.callbacks['before_relationships_post'].run(self, data)
 
         rel_class = rel.mapper.class_
         rel_view = self.view_instance(rel_class)
+        self.check_write_allowed(obj_id)
         obj = db_session.query(self.model).get(obj_id)
         items = []
         for resid in data:
@@ -947,11 +1715,11 @@ class CollectionViewBase:
 
         # Alter data with any callbacks
         data = self.request.json_body['data']
-        for callback in self.callbacks['before_relationships_patch']:
-            data = callback(self, data)
+        data = self.callbacks['before_relationships_patch'].run(self, data)
 
         rel_class = rel.mapper.class_
         rel_view = self.view_instance(rel_class)
+        self.check_write_allowed(obj_id)
         obj = db_session.query(self.model).get(obj_id)
         if rel.direction is jsapi.MANYTOONE:
             resid = data
@@ -1060,11 +1828,11 @@ class CollectionViewBase:
             raise HTTPNotFound('Cannot DELETE to TOONE relationship link.')
         rel_class = rel.mapper.class_
         rel_view = self.view_instance(rel_class)
+        self.check_write_allowed(obj_id)
         obj = db_session.query(self.model).get(obj_id)
 
         # Call callbacks
-        for callback in self.callbacks['before_relationships_delete']:
-            callback(self, obj)
+        self.callbacks['before_relationships_delete'].run(self, obj)
 
         for resid in self.request.json_body['data']:
             if resid['type'] != rel_view.collection_name:
@@ -1109,7 +1877,7 @@ class CollectionViewBase:
         ).filter(
             self.model._jsonapi_id == self.request.matchdict['id']
         )
-        return q
+        return self.query_add_allowed_filter(q)
 
     def single_return(self, q, not_found_message=None, identifier=False):
         '''Populate return dictionary for a single item.
@@ -1150,7 +1918,8 @@ class CollectionViewBase:
         included = {}
         ret = {}
         try:
-            item = q.one()
+            with timing.phase('query'):
+                item = q.one()
         except NoResultFound:
             if not_found_message:
                 raise HTTPNotFound(not_found_message)
@@ -1159,6 +1928,7 @@ class CollectionViewBase:
         if identifier:
             ret['data'] = self.serialise_resource_identifier(item._jsonapi_id)
         else:
+            self.prefetch_related([item])
             ret['data'] = self.serialise_db_item(item, included)
             if self.requested_include_names():
                 ret['included'] = [obj for obj in included.values()]
@@ -1172,7 +1942,8 @@ class CollectionViewBase:
             items.
 
         Keyword Arguments:
-            count(int): Number of items the query will return (if known).
+            count(int or concurrent.futures.Future): Number of items the query
+                will return (if known), or a Future which will provide it.
 
             identifiers(bool): return identifiers if True, objects if false.
 
@@ -1206,41 +1977,135 @@ class CollectionViewBase:
 
         if count is None:
             try:
-                count = q.count()
+                with timing.phase('query'):
+                    count = self.count_query(q)
             except sqlalchemy.exc.ProgrammingError as e:
                 raise HTTPBadRequest(
                     "Could not use operator '{}' with field '{}'".format(
                         op, prop.name
                     )
                 )
-        ret['meta']['results']['available'] = count
-
-        # Pagination links
-        ret['links'] = self.pagination_links(
-            count=ret['meta']['results']['available']
-        )
-        ret['meta']['results']['limit'] = qinfo['page[limit]']
-        ret['meta']['results']['offset'] = qinfo['page[offset]']
 
         # Primary data
+        with timing.phase('query'):
+            items = q.all()
         if identifiers:
             ret['data'] = [
                 self.serialise_resource_identifier(dbitem._jsonapi_id)
-                for dbitem in q.all()
+                for dbitem in items
                 ]
         else:
             included = {}
+            self.prefetch_related(items)
             ret['data'] = [
                 self.serialise_db_item(dbitem, included)
-                for dbitem in q.all()
+                for dbitem in items
                 ]
             # Included objects
             if self.requested_include_names():
                 ret['included'] = [obj for obj in included.values()]
 
+        if isinstance(count, concurrent.futures.Future):
+            try:
+                with timing.phase('query'):
+                    count = count.result()
+            except sqlalchemy.exc.ProgrammingError as e:
+                raise HTTPBadRequest(
+                    'Could not count results: {}'.format(e.orig)
+                )
+        ret['meta']['results']['available'] = count
+
+        # Pagination links
+        ret['links'] = self.pagination_links(
+            count=ret['meta']['results']['available']
+        )
+        ret['meta']['results']['limit'] = qinfo['page[limit]']
+        ret['meta']['results']['offset'] = qinfo['page[offset]']
+
         ret['meta']['results']['returned'] = len(ret['data'])
         return ret
 
+    def concurrent_count_bind(self):
+        '''The engine to count a collection on with another connection.
+
+        None if the request's session has unflushed changes (they would not be
+        visible to another connection), is bound to a single connection, or
+        uses a pool which hands every thread the same connection (such as
+        SQLite in memory).
+
+        Called in the request's thread: the session (often a thread local
+        scoped_session) must not be touched from the count's thread.
+
+        Returns:
+            sqlalchemy.engine.Engine or None:
+        '''
+        db_session = self.get_dbsession
+        if db_session.new or db_session.dirty or db_session.deleted:
+            return None
+        bind = db_session.get_bind(mapper=self.model)
+        if not isinstance(bind, sqlalchemy.engine.Engine):
+            return None
+        if isinstance(
+            bind.pool,
+            (sqlalchemy.pool.StaticPool, sqlalchemy.pool.SingletonThreadPool)
+        ):
+            return None
+        return bind
+
+    def count_query(self, q):
+        '''Return the number of results of q, timed if metrics are on.
+
+        Args:
+            q (sqlalchemy.orm.query.Query): query to count.
+
+        Returns:
+            int: number of results.
+        '''
+        # Count rows of just the key columns, unordered, rather than
+        # selecting every column (load_only is ignored by count()).
+        entity = q.column_descriptions[0]['entity']
+        q = q.with_entities(
+            *sqlalchemy.inspect(entity).primary_key
+        ).order_by(None)
+        if not self.metrics:
+            return q.count()
+        started = time.perf_counter()
+        try:
+            return q.count()
+        finally:
+            metrics.COUNT_SECONDS.observe(
+                time.perf_counter() - started, self.collection_name
+            )
+
+    def separate_count(self, q, bind):
+        '''Count the results of q using a new session on its own connection.
+
+        Runs in a ``count_executor`` thread. The connection is checked out of
+        the engine's pool and returned as soon as the count is done. If
+        ``pyramid_jsonapi.concurrent_count.isolation_level`` is set then the
+        connection uses that isolation level (``READ COMMITTED`` is enough
+        for a count of a read only request and avoids holding a snapshot).
+
+        Args:
+            q (sqlalchemy.orm.query.Query): filtered query (without limit or
+                offset) bound to the request's session.
+            bind (sqlalchemy.engine.Engine): engine to count on, from
+                :py:func:`concurrent_count_bind`.
+
+        Returns:
+            int: number of results.
+        '''
+        with bind.connect() as conn:
+            if self.count_isolation_level:
+                conn = conn.execution_options(
+                    isolation_level=self.count_isolation_level
+                )
+            session = sqlalchemy.orm.Session(bind=conn)
+            try:
+                return self.count_query(q.with_session(session))
+            finally:
+                session.close()
+
     def query_add_sorting(self, q):
         '''Add sorting to query.
 
@@ -1397,6 +2262,24 @@ class CollectionViewBase:
 
         return q
 
+    def query_add_allowed_filter(self, q):
+        '''Restrict query to the items the current action is allowed on.
+
+        Adds the clause from :py:func:`allowed_query_filter` (if any) to the
+        query, so that forbidden items are never fetched, counted or
+        serialised.
+
+        Parameters:
+            q (sqlalchemy.orm.query.Query): query on this view's model.
+
+        Returns:
+            sqlalchemy.orm.query.Query: filtered query.
+        '''
+        clause = self.allowed_query_clause
+        if clause is not None:
+            q = q.filter(clause)
+        return q
+
     def related_limit(self, relationship):
         '''Paging limit for related resources.
 
@@ -1471,7 +2354,143 @@ class CollectionViewBase:
                 rel.direction.name
             ))
 
-        return q
+        return rel_view.query_add_allowed_filter(q)
+
+    def related_results(self, obj_id, relationship, full_object):
+        '''Fetch the items related to an item (as serialise_db_item() needs).
+
+        Uses the results fetched by :py:func:`prefetch_related`, if any.
+
+        Parameters:
+            obj_id (str): id of an item in this view's collection.
+
+            relationship (sqlalchemy.orm.relationships.RelationshipProperty):
+                the relationship to get related objects from.
+
+            full_object (bool): as for :py:func:`related_query`.
+
+        Returns:
+            tuple: ``(available, items)``. For TOMANY relationships the number
+            of related items and a list of up to ``related_limit()`` of them;
+            for TOONE relationships None and a list of zero or one items.
+        '''
+        prefetcher = getattr(self.request, 'jsonapi_prefetcher', None)
+        if prefetcher is not None:
+            key = (
+                self.collection_name, str(obj_id), relationship.key,
+                full_object
+            )
+            if key in prefetcher.results:
+                return prefetcher.results[key]
+        return self.fetch_related(
+            self.related_query(obj_id, relationship, full_object=full_object),
+            relationship
+        )
+
+    def fetch_related(self, q, relationship, session=None):
+        '''Run a :py:func:`related_query` for :py:func:`related_results`.
+
+        Parameters:
+            q (sqlalchemy.orm.query.Query): query from related_query().
+            relationship (sqlalchemy.orm.relationships.RelationshipProperty):
+                the relationship q is for.
+            session (sqlalchemy.orm.session.Session): session to run q with
+                instead of the one it was made with.
+
+        Returns:
+            tuple: ``(available, items)`` as for related_results().
+        '''
+        if session is not None:
+            q = q.with_session(session)
+        if relationship.direction is jsapi.ONETOMANY or \
+                relationship.direction is jsapi.MANYTOMANY:
+            available = self.count_query(q)
+            return available, q.limit(self.related_limit(relationship)).all()
+        try:
+            return None, [q.one()]
+        except NoResultFound:
+            return None, []
+
+    def related_jobs(self, items, include_path):
+        '''The related_query()s serialise_db_item() would run for items.
+
+        Arguments:
+            items (list): items of this view's collection.
+            include_path (list): include path of the items.
+
+        Returns:
+            dict: :py:func:`fetch_related` of each query (awaiting a
+            ``session`` argument) by :py:func:`related_results` key.
+        '''
+        jobs = {}
+        allowed_fields = self.cached_allowed_fields
+        include_names = self.requested_include_names()
+        for key, rel in self.relationships.items():
+            if key not in allowed_fields:
+                continue
+            rel_path_str = '.'.join(include_path + [key])
+            if key not in self.requested_relationships and \
+                    rel_path_str not in include_names:
+                continue
+            is_included = rel_path_str in include_names
+            if rel.direction is jsapi.MANYTOONE and not is_included:
+                # Serialised from the item's own foreign key.
+                continue
+            for item in items:
+                jobs[(
+                    self.collection_name, str(item._jsonapi_id), key,
+                    is_included
+                )] = functools.partial(
+                    self.fetch_related,
+                    self.related_query(
+                        item._jsonapi_id, rel, full_object=is_included
+                    ),
+                    rel
+                )
+        return jobs
+
+    def prefetch_related(self, items):
+        '''Fetch everything serialise_db_item() would query for items.
+
+        Only if the request can run queries concurrently: that is, if
+        :py:class:`pyramid_jsonapi.asgi.AsyncReadApp` has set
+        ``request.jsonapi_prefetcher``. The related items (and counts) of
+        every item through every requested relationship are then fetched
+        concurrently, one level of includes at a time, for
+        :py:func:`related_results`. Otherwise (the usual sync path) they are
+        fetched one at a time during serialisation.
+
+        Arguments:
+            items (list): items of this view's collection about to be
+                serialised.
+        '''
+        prefetcher = getattr(self.request, 'jsonapi_prefetcher', None)
+        if prefetcher is None:
+            return
+        level = [(self, items, [])]
+        while level:
+            jobs = {}
+            origins = {}
+            for view, view_items, include_path in level:
+                for key, job in view.related_jobs(
+                        view_items, include_path
+                ).items():
+                    if key not in prefetcher.results:
+                        jobs[key] = job
+                        origins[key] = (view, include_path)
+            prefetcher.results.update(prefetcher.run(jobs))
+            # Included items are serialised in turn: fetch for them next.
+            next_items = {}
+            for key, (view, include_path) in origins.items():
+                if not key[3]:
+                    continue
+                rel = view.relationships[key[2]]
+                rel_view = view.view_instance(rel.mapper.class_)
+                rel_path = include_path + [rel.key]
+                next_items.setdefault(
+                    '.'.join(rel_path), (rel_view, [], rel_path)
+                )[1].extend(prefetcher.results[key][1])
+            level = list(next_items.values())
 
     def object_exists(self, obj_id):
         '''Test if object with id obj_id exists.
@@ -1493,6 +2512,32 @@ class CollectionViewBase:
         else:
             return False
 
+    def check_write_allowed(self, obj_id):
+        '''Raise HTTPForbidden if allowed_query_filter excludes item obj_id.
+
+        Used by the single item write views, which find their item by key
+        rather than through :py:func:`query_add_allowed_filter`.
+
+        Args:
+            obj_id (str): object id
+
+        Raises:
+            HTTPForbidden: if the item exists but is excluded.
+        '''
+        clause = self.allowed_query_clause
+        if clause is None:
+            return
+        allowed = self.get_dbsession.query(
+            self.model._jsonapi_id
+        ).filter(
+            self.model._jsonapi_id == obj_id
+        ).filter(clause).first()
+        if allowed is None and self.object_exists(obj_id):
+            raise HTTPForbidden('No permission to {} {}/{}.'.format(
+                self.request.method, self.collection_name, obj_id
+            ))
+
+    @timing.timed('serialise')
     def serialise_resource_identifier(self, obj_id):
         '''Return a resource identifier dictionary for id "obj_id"
 
@@ -1502,11 +2547,11 @@ class CollectionViewBase:
             'id': str(obj_id)
         }
 
-        for callback in self.callbacks['after_serialise_identifier']:
-            ret = callback(self, ret)
+        ret = self.callbacks['after_serialise_identifier'].run(self, ret)
 
         return ret
 
+    @timing.timed('serialise')
     def serialise_db_item(
             self, item,
             included, include_path=None,
@@ -1532,6 +2577,11 @@ class CollectionViewBase:
         # Required for some introspection.
         mapper = sqlalchemy.inspect(model).mapper
         ispector = self.request.registry.introspector
+        request_timing = timing.current.get()
+        if request_timing is not None:
+            outer_context = request_timing.context
+        if self.metrics:
+            metrics.ITEMS_SERIALISED.inc(1, self.collection_name)
 
         # Item's id and type are required at the top level of json-api
         # objects.
@@ -1544,13 +2594,18 @@ class CollectionViewBase:
             **{'id': item._jsonapi_id}
         )
 
+        # Forbidden attributes are not loaded (see
+        # allowed_requested_query_columns) so must not be touched here.
         atts = {
             key: getattr(item, key)
-            for key in self.requested_attributes.keys()
+            for key in self.allowed_requested_attributes
             }
 
+        allowed_fields = self.cached_allowed_fields
         rels = {}
         for key, rel in self.relationships.items():
+            if key not in allowed_fields:
+                continue
             rel_path_str = '.'.join(include_path + [key])
             if key not in self.requested_relationships and \
                             rel_path_str not in self.requested_include_names():
@@ -1570,17 +2625,23 @@ class CollectionViewBase:
             is_included = False
             if rel_path_str in self.requested_include_names():
                 is_included = True
-            q = self.related_query(
-                item._jsonapi_id, rel, full_object=is_included
-            )
+            if request_timing is not None:
+                request_timing.context = '{}.{}'.format(
+                    self.collection_name, key
+                )
+                if is_included:
+                    request_timing.context += ' (include {})'.format(
+                        rel_path_str
+                    )
             if rel.direction is jsapi.ONETOMANY or rel.direction is jsapi.MANYTOMANY:
-                qinfo = self.collection_query_info(self.request)
-                limit = self.related_limit(rel)
-                rel_dict['meta']['results']['limit'] = limit
-                rel_dict['meta']['results']['available'] = q.count()
-                q = q.limit(limit)
+                available, ritems = self.related_results(
+                    item._jsonapi_id, rel, is_included
+                )
+                rel_dict['meta']['results']['limit'] = \
+                    self.related_limit(rel)
+                rel_dict['meta']['results']['available'] = available
                 rel_dict['data'] = []
-                for ritem in q.all():
+                for ritem in ritems:
                     rel_dict['data'].append(
                         rel_view.serialise_resource_identifier(
                             ritem._jsonapi_id
@@ -1597,12 +2658,12 @@ class CollectionViewBase:
                     len(rel_dict['data'])
             else:
                 if is_included:
-                    ritem = None
-                    try:
-                        ritem = q.one()
-                    except sqlalchemy.orm.exc.NoResultFound:
+                    _, ritems = self.related_results(
+                        item._jsonapi_id, rel, is_included
+                    )
+                    if not ritems:
                         rel_dict['data'] = None
-                    if ritem:
+                    for ritem in ritems:
                         included[
                             (rel_view.collection_name, ritem._jsonapi_id)
                         ] = rel_view.serialise_db_item(
@@ -1625,6 +2686,8 @@ class CollectionViewBase:
                         )
             if key in self.requested_relationships:
                 rels[key] = rel_dict
+        if request_timing is not None:
+            request_timing.context = outer_context
 
         ret = {
             'id': str(item_id),
@@ -1636,8 +2699,7 @@ class CollectionViewBase:
             'relationships': rels
         }
 
-        for callback in self.callbacks['after_serialise_object']:
-            ret = callback(self, ret)
+        ret = self.callbacks['after_serialise_object'].run(self, ret)
 
         return ret
 
@@ -1809,14 +2871,97 @@ class CollectionViewBase:
     def allowed_fields(self):
         '''Set of fields to which current action is allowed.
 
+        Read through :py:func:`cached_allowed_fields`, so computed at most once
+        per view instance (or once per :py:func:`allowed_fields_key` with
+        ``pyramid_jsonapi.allowed_fields_cache_size`` set).
+
         Returns:
             set: set of allowed field names.
         '''
         return set(self.fields)
 
+    def allowed_fields_key(self):
+        '''Key under which allowed_fields is shared between requests.
+
+        :py:func:`allowed_fields` is assumed to depend on nothing else. The
+        default is the request method and the authenticated user id: override
+        this if it also depends on, say, roles which can change during a
+        login.
+
+        Returns:
+            hashable key.
+        '''
+        return (self.request.method, self.request.authenticated_userid)
+
+    @property
+    def cached_allowed_fields(self):
+        ''':py:func:`allowed_fields` computed once per view instance.
+
+        If ``pyramid_jsonapi.allowed_fields_cache_size`` is set, the value is
+        also shared between requests with the same
+        :py:func:`allowed_fields_key`, in a bounded LRU cache.
+
+        Returns:
+            frozenset: allowed field names.
+        '''
+        try:
+            return self._cached_allowed_fields
+        except AttributeError:
+            pass
+        if self.allowed_fields_cache is None:
+            fields = frozenset(self.allowed_fields)
+        else:
+            fields = self.allowed_fields_cache.get(self)
+        self._cached_allowed_fields = fields
+        return fields
+
     def allowed_object(self, obj):
         '''Whether or not current action is allowed on object.
 
+        Only consulted (by the ``access_control_serialised_objects`` callback
+        set) for views without an :py:func:`allowed_query_filter`.
+
+        Returns:
+            bool:
+        '''
+        return True
+
+    def allowed_query_filter(self):
+        '''SQL clause selecting the items the current action is allowed on.
+
+        Override to filter forbidden items out in the database: the clause is
+        added to the queries for collections, single items, related items and
+        their counts (so ``meta.results.available`` only counts allowed
+        items), and to bulk PATCH and DELETE. A GET, PATCH or DELETE of a
+        single forbidden item, a write to one of its relationships or an
+        upsert of it is answered with 403.
+
+        Returns:
+            A sqlalchemy clause on ``self.model`` (for example
+            ``self.model.owner_id == self.request.authenticated_userid``) or
+            None (the default) for no filter, in which case
+            :py:func:`allowed_object` is used after serialisation.
+        '''
+        return None
+
+    @property
+    def allowed_query_clause(self):
+        '''The result of :py:func:`allowed_query_filter`, once per view.'''
+        try:
+            return self._allowed_query_clause
+        except AttributeError:
+            self._allowed_query_clause = self.allowed_query_filter()
+            return self._allowed_query_clause
+
+    def allowed_bulk_action(self, q):
+        '''Whether or not current bulk action is allowed on the items in q.
+
+        Bulk PATCH and DELETE never load or serialise the affected items, so
+        :py:func:`allowed_object` cannot be used for them.
+
+        Args:
+            q (sqlalchemy.orm.query.Query): query selecting affected items.
+
         Returns:
             bool:
         '''
@@ -1931,7 +3076,8 @@ class CollectionViewBase:
             pair[0].name: pair[0]
             for k, rel in self.requested_relationships.items()
             for pair in rel.local_remote_pairs
-            if rel.direction is jsapi.MANYTOONE and k in self.allowed_fields
+            if rel.direction is jsapi.MANYTOONE and
+            k in self.cached_allowed_fields
             }
 
     @property
@@ -1943,15 +3089,25 @@ class CollectionViewBase:
             dict: Union of allowed requested_attributes and
             allowed_requested_relationships_local_columns
         '''
-        ret = {
-            k: v for k, v in self.requested_attributes.items()
-            if k in self.allowed_fields
-            }
+        ret = dict(self.allowed_requested_attributes)
         ret.update(
             self.allowed_requested_relationships_local_columns
         )
         return ret
 
+    @property
+    def allowed_requested_attributes(self):
+        '''Requested attributes which are also allowed.
+
+        Returns:
+            dict: columns indexed by attribute name.
+        '''
+        allowed_fields = self.cached_allowed_fields
+        return {
+            k: v for k, v in self.requested_attributes.items()
+            if k in allowed_fields
+            }
+
     @functools.lru_cache(maxsize=128)
     def requested_include_names(self):
         '''Parse any 'include' param in http request.
@@ -2031,3 +3187,25 @@ class CollectionViewBase:
         '''
         for cb_name, callback in jsapi.callback_sets[set_name].items():
             cls.callbacks[cb_name].append(callback)
+
+    @classmethod
+    def callback_stats(cls):
+        '''Calls to and time spent in each callback of this view class.
+
+        Only recorded with ``pyramid_jsonapi.callback_stats = true``.
+
+        Returns:
+            dict: by chain name, a dict by callback name of ``calls`` and
+            ``seconds``.
+        '''
+        calls = metrics.CALLBACK_CALLS.collect()
+        seconds = metrics.CALLBACK_SECONDS.collect()
+        stats = {}
+        for (collection, chain, callback), count in calls.items():
+            if collection != cls.collection_name:
+                continue
+            stats.setdefault(chain, {})[callback] = {
+                'calls': count,
+                'seconds': seconds.get((collection, chain, callback), 0),
+            }
+        return stats
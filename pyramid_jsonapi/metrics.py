@@ -0,0 +1,301 @@
+'''In-process metrics, exposed in Prometheus text format.
+
+Switched on with ``pyramid_jsonapi.metrics = true``. JSON-API requests then
+record:
+
+* ``pyramid_jsonapi_request_seconds``: latency histogram (including rendering)
+  by collection, endpoint (view method) and request method;
+* ``pyramid_jsonapi_response_bytes``: histogram of response body sizes, with
+  the same labels;
+* ``pyramid_jsonapi_db_statements_total``: statements executed, by
+  collection and endpoint;
+* ``pyramid_jsonapi_items_serialised_total``: resource objects serialised,
+  by collection;
+* ``pyramid_jsonapi_count_seconds``: latency histogram of count queries, by
+  collection;
+* ``pyramid_jsonapi_cache_hits_total`` and
+  ``pyramid_jsonapi_cache_misses_total`` for pyramid_jsonapi's caches, by
+  cache.
+
+With ``pyramid_jsonapi.callback_stats = true``,
+``pyramid_jsonapi_callback_calls_total`` and
+``pyramid_jsonapi_callback_seconds_total`` count calls to and time spent in
+each view callback (see :py:mod:`pyramid_jsonapi.callback_chain`).
+
+The metrics are served from ``/metrics`` (or
+``pyramid_jsonapi.metrics.route_pattern``). Each process keeps its own
+metrics: with several worker processes, scrape each of them (or use the
+registry's :py:meth:`MetricsRegistry.render` from a multiprocess exporter).
+
+Recording takes no locks: every thread updates its own dictionary of values
+and the dictionaries are only added up when the metrics are rendered.
+'''
+import bisect
+import threading
+
+from pyramid.response import Response
+
+#: Default latency buckets, in seconds.
+SECONDS_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+#: Default size buckets, in bytes.
+BYTES_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216
+)
+
+
+class Metric:
+    '''Base class for metric families.
+
+    Arguments:
+        name (str): metric name.
+        help (str): description.
+        labels (tuple): label names.
+    '''
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.local = threading.local()
+        self.shards = []
+        self.shards_lock = threading.Lock()
+        self.sources = []
+
+    def shard(self):
+        '''This thread's dictionary of values by label values.'''
+        try:
+            return self.local.values
+        except AttributeError:
+            values = self.local.values = {}
+            with self.shards_lock:
+                self.shards.append(values)
+            return values
+
+    def add_source(self, source):
+        '''Add a callable returning extra values at render time.
+
+        Used for values kept elsewhere (e.g. ``functools.lru_cache``
+        statistics). ``source()`` must return a dict of values by tuples of
+        label values.
+        '''
+        self.sources.append(source)
+
+    def label_string(self, label_values, extra=()):
+        pairs = list(zip(self.labels, label_values)) + list(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(
+            '{}="{}"'.format(
+                name,
+                str(value).replace('\\', '\\\\').replace('"', '\\"')
+            )
+            for name, value in pairs
+        ) + '}'
+
+    def render(self):
+        '''Lines of Prometheus text format for this family.'''
+        lines = [
+            '# HELP {} {}'.format(self.name, self.help),
+            '# TYPE {} {}'.format(self.name, self.type),
+        ]
+        for label_values, value in sorted(self.collect().items()):
+            lines.extend(self.render_value(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    '''A monotonically increasing count.'''
+    type = 'counter'
+
+    def inc(self, amount, *label_values):
+        '''Add amount to the count for label_values.'''
+        values = self.shard()
+        values[label_values] = values.get(label_values, 0) + amount
+
+    def collect(self):
+        '''Total values by label values, over all threads and sources.'''
+        totals = {}
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for label_values, value in shard.copy().items():
+                totals[label_values] = totals.get(label_values, 0) + value
+        for source in self.sources:
+            for label_values, value in source().items():
+                totals[label_values] = totals.get(label_values, 0) + value
+        return totals
+
+    def render_value(self, label_values, value):
+        return [
+            '{}{} {}'.format(self.name, self.label_string(label_values), value)
+        ]
+
+
+class Histogram(Metric):
+    '''Counts of observations in buckets, plus their sum.
+
+    Arguments:
+        buckets (tuple): upper bounds of the buckets, in increasing order.
+    '''
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        '''Record an observation of value for label_values.'''
+        values = self.shard()
+        counts = values.get(label_values)
+        if counts is None:
+            # One count per bucket, one for +Inf, then the sum.
+            counts = values[label_values] = [0] * (len(self.buckets) + 1)
+            counts.append(0)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def collect(self):
+        '''Bucket counts and sums by label values, over all threads.'''
+        totals = {}
+        with self.shards_lock:
+            shards = list(self.shards)
+        for shard in shards:
+            for label_values, counts in shard.copy().items():
+                total = totals.setdefault(
+                    label_values, [0] * (len(self.buckets) + 2)
+                )
+                for i, count in enumerate(list(counts)):
+                    total[i] += count
+        return totals
+
+    def render_value(self, label_values, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + ('+Inf',), counts):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                self.name,
+                self.label_string(label_values, [('le', bound)]),
+                cumulative
+            ))
+        labels = self.label_string(label_values)
+        lines.append('{}_sum{} {}'.format(self.name, labels, counts[-1]))
+        lines.append('{}_count{} {}'.format(self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    '''A collection of metric families.'''
+
+    def __init__(self):
+        self.metrics = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        '''Make and register a :py:class:`Counter`.'''
+        return self.add(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        '''Make and register a :py:class:`Histogram`.'''
+        return self.add(Histogram(name, help, labels, buckets))
+
+    def render(self):
+        '''All metrics in Prometheus text exposition format.'''
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+REQUEST_SECONDS = registry.histogram(
+    'pyramid_jsonapi_request_seconds',
+    'Time taken to handle and render JSON-API requests.',
+    ('collection', 'endpoint', 'method')
+)
+RESPONSE_BYTES = registry.histogram(
+    'pyramid_jsonapi_response_bytes',
+    'Size of JSON-API response bodies.',
+    ('collection', 'endpoint', 'method'),
+    buckets=BYTES_BUCKETS
+)
+DB_STATEMENTS = registry.counter(
+    'pyramid_jsonapi_db_statements_total',
+    'SQL statements executed by JSON-API requests.',
+    ('collection', 'endpoint')
+)
+ITEMS_SERIALISED = registry.counter(
+    'pyramid_jsonapi_items_serialised_total',
+    'Resource objects serialised.',
+    ('collection',)
+)
+COUNT_SECONDS = registry.histogram(
+    'pyramid_jsonapi_count_seconds',
+    'Time taken by count queries.',
+    ('collection',)
+)
+CACHE_HITS = registry.counter(
+    'pyramid_jsonapi_cache_hits_total',
+    'Cache hits.',
+    ('cache',)
+)
+CACHE_MISSES = registry.counter(
+    'pyramid_jsonapi_cache_misses_total',
+    'Cache misses.',
+    ('cache',)
+)
+CALLBACK_CALLS = registry.counter(
+    'pyramid_jsonapi_callback_calls_total',
+    'Calls to view callbacks.',
+    ('collection', 'chain', 'callback')
+)
+CALLBACK_SECONDS = registry.counter(
+    'pyramid_jsonapi_callback_seconds_total',
+    'Time spent in view callbacks.',
+    ('collection', 'chain', 'callback')
+)
+
+
+def add_lru_cache(name, cached_function):
+    '''Report the hits and misses of a ``functools.lru_cache`` function.'''
+    CACHE_HITS.add_source(
+        lambda: {(name,): cached_function.cache_info().hits}
+    )
+    CACHE_MISSES.add_source(
+        lambda: {(name,): cached_function.cache_info().misses}
+    )
+
+
+def record_response(collection, endpoint, started, timer):
+    '''Make a response callback recording latency and size of a response.
+
+    Arguments:
+        collection (str): collection name.
+        endpoint (str): name of the view method.
+        started (float): start time from ``timer``.
+        timer (callable): clock, e.g. ``time.perf_counter``.
+    '''
+    def callback(request, response):
+        labels = (collection, endpoint, request.method)
+        REQUEST_SECONDS.observe(timer() - started, *labels)
+        RESPONSE_BYTES.observe(len(response.body), *labels)
+    return callback
+
+
+def metrics_view(request):
+    '''View serving :py:data:`registry` in Prometheus text format.'''
+    response = Response(
+        registry.render(),
+        content_type='text/plain; version=0.0.4',
+        charset='utf-8'
+    )
+    response.cache_control = 'no-store'
+    return response
@@ -0,0 +1,259 @@
+'''Profile selected JSON-API requests with cProfile.
+
+Configured in the ini file:
+
+.. code-block:: ini
+
+  # Profile requests with a valid signed X-JSONAPI-Profile header...
+  pyramid_jsonapi.debug.profile.secret = some long random string
+  # ...and/or one in every N requests.
+  pyramid_jsonapi.debug.profile.sample = 1000
+  # How many profiles to keep in memory (oldest are dropped first).
+  pyramid_jsonapi.debug.profile.ring_size = 20
+  # How long (seconds) a signed header stays valid.
+  pyramid_jsonapi.debug.profile.max_age = 300
+
+A signed header value is ``<unix time>:<hex HMAC-SHA256 of the time>``, made
+with :py:meth:`Profiler.sign` (or any HMAC implementation). Profiled responses
+carry an ``X-JSONAPI-Profile-Id`` header. Profiles are listed at
+``/debug/profiles`` and downloaded from ``/debug/profiles/{id}`` with
+``?format=`` one of:
+
+* ``pstats`` (the default): marshalled stats, loadable with
+  ``pstats.Stats(filename)`` or viewers such as snakeviz;
+* ``collapsed``: collapsed stacks (``a;b;c <microseconds>`` per line) for
+  flamegraph.pl or speedscope;
+* ``text``: ``pstats`` output sorted by cumulative time.
+
+The profile views are only added if a secret is set, in which case they also
+require a valid signed header, or if
+``pyramid_jsonapi.debug.debug_endpoints = true``. Without either, sampled
+profiles are kept but not served.
+'''
+import collections
+import datetime
+import hashlib
+import hmac
+import io
+import itertools
+import marshal
+import pstats
+import secrets
+import threading
+import time
+
+from pyramid.httpexceptions import HTTPBadRequest, HTTPForbidden
+from pyramid.response import Response
+
+HEADER = 'X-JSONAPI-Profile'
+
+StoredProfile = collections.namedtuple(
+    'StoredProfile', ['id', 'info', 'stats']
+)
+
+
+class Profiler:
+    '''Decides which requests to profile and keeps their profiles.
+
+    Keyword Args:
+        secret (str): key for signed headers (None to disable them).
+        sample (int): profile one in every sample requests (0 to disable).
+        ring_size (int): number of profiles kept.
+        max_age (int): seconds a signed header stays valid.
+    '''
+
+    def __init__(self, secret=None, sample=0, ring_size=20, max_age=300):
+        self.secret = secret
+        self.sample = sample
+        self.max_age = max_age
+        self.counter = itertools.count(1)
+        self.profiles = collections.OrderedDict()
+        self.ring_size = ring_size
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''Make a Profiler from app settings.
+
+        Returns:
+            Profiler or None: None if neither a secret nor sampling is set.
+        '''
+        prefix = 'pyramid_jsonapi.debug.profile.'
+        secret = settings.get(prefix + 'secret')
+        sample = int(settings.get(prefix + 'sample', 0))
+        if not secret and not sample:
+            return None
+        return cls(
+            secret=secret, sample=sample,
+            ring_size=int(settings.get(prefix + 'ring_size', 20)),
+            max_age=int(settings.get(prefix + 'max_age', 300)),
+        )
+
+    def signature(self, timestamp):
+        '''Hex HMAC-SHA256 of timestamp (a string).'''
+        return hmac.new(
+            self.secret.encode('utf8'), timestamp.encode('utf8'),
+            hashlib.sha256
+        ).hexdigest()
+
+    def sign(self, timestamp=None):
+        '''A value for the ``X-JSONAPI-Profile`` header.'''
+        timestamp = str(int(time.time() if timestamp is None else timestamp))
+        return '{}:{}'.format(timestamp, self.signature(timestamp))
+
+    def valid_header(self, request):
+        '''Whether request has a valid, unexpired, signed header.'''
+        value = request.headers.get(HEADER)
+        if not value or not self.secret:
+            return False
+        timestamp, _, signature = value.partition(':')
+        try:
+            age = time.time() - int(timestamp)
+        except ValueError:
+            return False
+        if abs(age) > self.max_age:
+            return False
+        return hmac.compare_digest(signature, self.signature(timestamp))
+
+    def wants(self, request):
+        '''Whether request should be profiled.'''
+        if self.valid_header(request):
+            return True
+        return bool(self.sample) and next(self.counter) % self.sample == 0
+
+    def store(self, profile, info):
+        '''Keep the stats of profile, dropping the oldest if the ring is full.
+
+        Args:
+            profile (cProfile.Profile): finished profile.
+            info (dict): description of the request.
+
+        Returns:
+            str: id of the stored profile.
+        '''
+        profile_id = secrets.token_hex(8)
+        stored = StoredProfile(profile_id, info, pstats.Stats(profile))
+        with self.lock:
+            self.profiles[profile_id] = stored
+            while len(self.profiles) > self.ring_size:
+                self.profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        '''The StoredProfile with id profile_id, or None.'''
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def list(self):
+        '''Ids and request descriptions of the stored profiles.'''
+        with self.lock:
+            stored = list(self.profiles.values())
+        return [dict(profile.info, id=profile.id) for profile in stored]
+
+
+def request_info(request, seconds):
+    '''Description of a profiled request.'''
+    return {
+        'time': datetime.datetime.utcnow().isoformat() + 'Z',
+        'method': request.method,
+        'url': request.url,
+        'ms': round(seconds * 1000, 3),
+    }
+
+
+def add_header(request, response):
+    '''Response callback adding the ``X-JSONAPI-Profile-Id`` header.'''
+    profile_id = getattr(request, 'jsonapi_profile_id', None)
+    if profile_id is not None:
+        response.headers['X-JSONAPI-Profile-Id'] = profile_id
+
+
+def func_name(func):
+    '''Readable name of a pstats function key.'''
+    filename, line, name = func
+    if filename == '~':
+        # Built in.
+        return name
+    return '{}:{}({})'.format(filename, line, name)
+
+
+def collapsed(stats, max_depth=64):
+    '''Collapsed stack lines (``a;b;c <microseconds>``) from stats.
+
+    cProfile only records callers one level up, so stacks are rebuilt by
+    walking down from functions with no callers and sharing each function's
+    own time between its callers in proportion to the cumulative time spent
+    on each call edge.
+    '''
+    callees = collections.defaultdict(list)
+    roots = []
+    for func, (cc, nc, tt, ct, callers) in stats.stats.items():
+        if not callers:
+            roots.append(func)
+        for caller, edge in callers.items():
+            # edge is (cc, nc, tt, ct) for that call site.
+            callees[caller].append((func, edge[3]))
+    totals = collections.Counter()
+
+    def walk(func, path, fraction):
+        cc, nc, tt, ct, callers = stats.stats[func]
+        path = path + (func_name(func),)
+        if tt * fraction > 0:
+            totals[';'.join(path)] += tt * fraction
+        if len(path) >= max_depth:
+            return
+        for callee, edge_ct in callees.get(func, ()):
+            callee_ct = stats.stats[callee][3]
+            if callee_ct <= 0 or func_name(callee) in path:
+                continue
+            walk(callee, path, fraction * min(1, edge_ct / callee_ct))
+
+    for root in roots:
+        walk(root, (), 1.0)
+    return '\n'.join(
+        '{} {}'.format(stack, int(seconds * 1e6))
+        for stack, seconds in sorted(totals.items())
+        if int(seconds * 1e6) > 0
+    ) + '\n'
+
+
+def check_allowed(profiler, request):
+    '''Raise HTTPForbidden if profiler needs a signed header request lacks.'''
+    if profiler.secret and not profiler.valid_header(request):
+        raise HTTPForbidden(
+            'A signed {} header is required.'.format(HEADER)
+        )
+
+
+def profile_response(stored, fmt):
+    '''A response with a stored profile in format fmt.
+
+    Args:
+        stored (StoredProfile): the profile.
+        fmt (str): ``pstats``, ``collapsed`` or ``text``.
+
+    Raises:
+        HTTPBadRequest: if fmt is not known.
+    '''
+    if fmt == 'pstats':
+        response = Response(
+            marshal.dumps(stored.stats.stats),
+            content_type='application/octet-stream'
+        )
+        response.content_disposition = \
+            'attachment; filename=profile-{}.pstats'.format(stored.id)
+        return response
+    if fmt == 'collapsed':
+        text = collapsed(stored.stats)
+    elif fmt == 'text':
+        out = io.StringIO()
+        stats = pstats.Stats(stream=out)
+        stats.add(stored.stats)
+        stats.sort_stats('cumulative').print_stats(100)
+        text = out.getvalue()
+    else:
+        raise HTTPBadRequest(
+            'Unknown profile format {}: use pstats, collapsed or '
+            'text.'.format(fmt)
+        )
+    return Response(text, content_type='text/plain', charset='utf-8')
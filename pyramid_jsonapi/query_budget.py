@@ -0,0 +1,161 @@
+'''Detect N+1 queries and requests which run too many statements.
+
+Configured in the ini file:
+
+.. code-block:: ini
+
+  # Complain if any statement (ignoring literal values) runs more than 10
+  # times in one request...
+  pyramid_jsonapi.query_budget.repeat = 10
+  # ...or if a request runs more than 50 statements in total...
+  pyramid_jsonapi.query_budget.total = 50
+  # ...or more than the budget given for its route.
+  pyramid_jsonapi.query_budget.routes =
+    pyramid_jsonapi:people 20
+    pyramid_jsonapi:people:item 5
+  # 'warn' (the default) to log a warning, 'raise' to raise
+  # QueryBudgetExceeded (for test suites).
+  pyramid_jsonapi.query_budget.action = raise
+
+Statements are recorded with :py:mod:`pyramid_jsonapi.timing`, whose context
+for each statement names the view and relationship (and include path) it was
+run for.
+'''
+import collections
+import json
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+FINGERPRINT_SUBS = [
+    # String literals.
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    # Bound parameter placeholders: %(name)s, :name, $1.
+    (re.compile(r'%\(\w+\)s|(?<!:):\w+|\$\d+'), '?'),
+    # Numbers.
+    (re.compile(r'\b\d+(?:\.\d+)?\b'), '?'),
+    # Lists of values, e.g. IN (?, ?, ?).
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(?)'),
+    (re.compile(r'\s+'), ' '),
+]
+
+
+class QueryBudgetExceeded(Exception):
+    '''Raised by :py:meth:`QueryBudget.check` when the action is ``raise``.
+
+    Attributes:
+        report (dict): see :py:meth:`QueryBudget.check`.
+    '''
+
+    def __init__(self, report):
+        super().__init__(json.dumps(report, indent=2))
+        self.report = report
+
+
+def fingerprint(statement):
+    '''Normalise an SQL statement so that runs with different values match.'''
+    for regex, replacement in FINGERPRINT_SUBS:
+        statement = regex.sub(replacement, statement)
+    return statement.strip()
+
+
+class QueryBudget:
+    '''Statement limits for requests.
+
+    Keyword Args:
+        repeat (int): most times one fingerprint may run in a request.
+        total (int): most statements a request may run.
+        routes (dict): total budgets overriding ``total`` by route name.
+        action (str): ``warn`` or ``raise``.
+    '''
+
+    def __init__(self, repeat=None, total=None, routes=None, action='warn'):
+        self.repeat = repeat
+        self.total = total
+        self.routes = routes or {}
+        self.action = action
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''Make a QueryBudget from app settings.
+
+        Returns:
+            QueryBudget or None: None if no limits are set.
+        '''
+        def int_setting(name):
+            value = settings.get('pyramid_jsonapi.query_budget.' + name)
+            return None if value is None else int(value)
+
+        routes = {}
+        for line in settings.get(
+                'pyramid_jsonapi.query_budget.routes', ''
+        ).splitlines():
+            if line.strip():
+                route_name, budget = line.rsplit(None, 1)
+                routes[route_name.strip()] = int(budget)
+        repeat = int_setting('repeat')
+        total = int_setting('total')
+        if repeat is None and total is None and not routes:
+            return None
+        return cls(
+            repeat=repeat, total=total, routes=routes,
+            action=settings.get('pyramid_jsonapi.query_budget.action', 'warn')
+        )
+
+    def check(self, request_timing, view):
+        '''Check the statements run for a request against the budget.
+
+        Args:
+            request_timing (pyramid_jsonapi.timing.RequestTiming): statements
+                run by the request.
+            view: the view instance which handled the request.
+
+        Returns:
+            dict or None: None if the request was within budget, otherwise a
+            report with the ``route``, ``view`` (collection name), ``method``,
+            ``url``, ``include`` parameter, number of ``statements``, the
+            ``budget`` and ``repeated``: a list of statement fingerprints which
+            ran more than ``repeat`` times, with their ``count`` and the
+            ``contexts`` they ran in.
+
+        Raises:
+            QueryBudgetExceeded: if there is a report and the action is
+            ``raise``.
+        '''
+        route_name = view.route_name()
+        budget = self.routes.get(route_name, self.total)
+        statements = request_timing.statements
+        repeated = []
+        if self.repeat is not None:
+            counts = collections.Counter()
+            contexts = collections.defaultdict(set)
+            for statement in statements:
+                fp = fingerprint(statement.sql)
+                counts[fp] += 1
+                contexts[fp].add(statement.context)
+            repeated = [
+                {
+                    'fingerprint': fp,
+                    'count': count,
+                    'contexts': sorted(str(c) for c in contexts[fp]),
+                }
+                for fp, count in counts.most_common()
+                if count > self.repeat
+            ]
+        if not repeated and (budget is None or len(statements) <= budget):
+            return None
+        report = {
+            'route': route_name,
+            'view': view.collection_name,
+            'method': view.request.method,
+            'url': view.request.url,
+            'include': view.request.params.get('include'),
+            'statements': len(statements),
+            'budget': budget,
+            'repeated': repeated,
+        }
+        if self.action == 'raise':
+            raise QueryBudgetExceeded(report)
+        log.warning('Query budget exceeded: {}'.format(json.dumps(report)))
+        return report
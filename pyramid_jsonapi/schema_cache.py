@@ -0,0 +1,176 @@
+'''Cache the schema computed by create_jsonapi() on disk.
+
+With ``pyramid_jsonapi.schema_cache = /path/to/file.json`` in the ini file,
+:py:func:`pyramid_jsonapi.create_jsonapi` writes what it learned about each
+model (collection name, key column, attribute and relationship names,
+relationship targets and route names/patterns) to that file. Later boots with
+the same code read the file instead of walking every mapper's columns and
+relationships.
+
+The file is keyed by :py:func:`model_hash`, a digest of the source files
+defining the models, the columns of their tables, the versions of
+pyramid_jsonapi and SQLAlchemy, the cache format version and the settings
+which affect routes. If the key does not
+match (or the file is missing or unreadable) models are introspected as usual
+and the file is rewritten.
+'''
+import hashlib
+import inspect
+import json
+import logging
+import os
+import sys
+import tempfile
+
+import sqlalchemy
+
+#: Bumped whenever the layout of the cache file changes.
+CACHE_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+
+def model_key(model):
+    '''Name a model class in the cache: ``module:qualname``.'''
+    return '{}:{}'.format(model.__module__, model.__qualname__)
+
+
+def model_hash(models, settings):
+    '''Digest of everything which determines the cached schema.
+
+    Hashing the source of the modules defining the models (and their bases) is
+    much cheaper than introspecting the mappers, which is what the cache is
+    there to avoid. A model's ``__table__`` may be defined elsewhere (or
+    reflected), so the table's columns are hashed too (see
+    :py:func:`table_signature`).
+
+    Args:
+        models: iterable of model classes.
+        settings (dict): app settings.
+
+    Returns:
+        str: hex digest.
+    '''
+    import pyramid_jsonapi
+    digest = hashlib.sha256()
+    for item in (
+            CACHE_VERSION, pyramid_jsonapi.__version__, sqlalchemy.__version__,
+            settings.get(
+                'pyramid_jsonapi.route_name_prefix', 'pyramid_jsonapi'
+            ),
+            settings.get('pyramid_jsonapi.route_pattern_prefix', ''),
+    ):
+        digest.update(repr(item).encode('utf8'))
+    filenames = set()
+    for model in models:
+        digest.update(model_key(model).encode('utf8'))
+        table = getattr(model, '__table__', None)
+        if table is not None:
+            digest.update(table_signature(table).encode('utf8'))
+        for cls in model.__mro__:
+            module = sys.modules.get(cls.__module__)
+            try:
+                filenames.add(inspect.getsourcefile(module))
+            except TypeError:
+                # Built in module.
+                continue
+    for filename in sorted(f for f in filenames if f):
+        with open(filename, 'rb') as f:
+            digest.update(hashlib.sha256(f.read()).digest())
+    return digest.hexdigest()
+
+
+def table_signature(table):
+    '''Describe the columns of a table (without configuring any mappers).
+
+    Returns:
+        str: table name and each column's key, type, primary key flag and
+        foreign key targets.
+    '''
+    return repr((table.fullname, [
+        (
+            column.key, repr(column.type), column.primary_key,
+            sorted(fk.target_fullname for fk in column.foreign_keys)
+        )
+        for column in table.columns
+    ]))
+
+
+def load(path, key):
+    '''Read the cached schema from path.
+
+    Args:
+        path (str): cache file.
+        key (str): expected :py:func:`model_hash`.
+
+    Returns:
+        dict or None: cached entries by :py:func:`model_key`, or None if the
+        file is missing, unreadable or for a different key.
+    '''
+    try:
+        with open(path) as f:
+            cache = json.load(f)
+    except (OSError, ValueError) as e:
+        log.info('Schema cache {} not used: {}'.format(path, e))
+        return None
+    if cache.get('version') != CACHE_VERSION or cache.get('key') != key:
+        log.info('Schema cache {} is stale.'.format(path))
+        return None
+    return cache['models']
+
+
+def view_entry(view):
+    '''The cache entry describing a collection view class.'''
+    import pyramid_jsonapi
+    return {
+        'collection_name': view.collection_name,
+        'key_column': view.key_column.name,
+        'attributes': list(view.attributes),
+        'relationships': {
+            name: {
+                'direction': rel.direction.name,
+                'target': model_key(rel.mapper.class_),
+                'collection': getattr(
+                    pyramid_jsonapi.view_classes.get(rel.mapper.class_),
+                    'collection_name', None
+                ),
+            }
+            for name, rel in view.relationships.items()
+        },
+        'routes': {
+            kind: [
+                getattr(view, kind + '_route_name'),
+                getattr(view, kind + '_route_pattern'),
+            ]
+            for kind in ('collection', 'item', 'related', 'relationships')
+        },
+    }
+
+
+def dump(path, key, views):
+    '''Write the schema of views to path.
+
+    The file is replaced atomically so that concurrently booting workers never
+    read a partial file.
+
+    Args:
+        path (str): cache file.
+        key (str): :py:func:`model_hash` of the models.
+        views: iterable of collection view classes.
+    '''
+    cache = {
+        'version': CACHE_VERSION,
+        'key': key,
+        'models': {model_key(view.model): view_entry(view) for view in views},
+    }
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+    except OSError as e:
+        log.warning('Could not write schema cache {}: {}'.format(path, e))
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
@@ -0,0 +1,262 @@
+'''Log slow JSON-API requests, with their SQL, as JSON lines.
+
+Configured in the ini file:
+
+.. code-block:: ini
+
+  # Log requests taking longer than this (ms)...
+  pyramid_jsonapi.slow_log.threshold_ms = 500
+  # ...to this file, one JSON object per line.
+  pyramid_jsonapi.slow_log.path = %(here)s/jsonapi_slow.jsonl
+  # Rotate the file at this size (bytes, default 10MB), keeping this many
+  # old files (default 5).
+  pyramid_jsonapi.slow_log.max_bytes = 10485760
+  pyramid_jsonapi.slow_log.backup_count = 5
+  # Also EXPLAIN the slowest SELECT (on a separate connection, in a
+  # background thread)...
+  pyramid_jsonapi.slow_log.explain = true
+  # ...for at most this many records at a time (default 10). Records of
+  # slow requests beyond that are written without a plan.
+  pyramid_jsonapi.slow_log.explain_max_pending = 10
+
+Each record has the ``time``, ``method``, ``url``, ``route``, ``view``
+(collection name), ``status``, ``duration_ms``, the parsed ``query`` (sort,
+filters, page, include and fields), every ``statements`` with its ``sql``,
+``ms`` and ``context`` (see :py:mod:`pyramid_jsonapi.timing`) and, if
+enabled, ``explain``: the ``sql`` and query ``plan`` of the slowest SELECT.
+Requests which fail are logged too (if slow), with their ``error``.
+
+With ``explain`` on, the EXPLAIN runs after the response has been sent, so
+records are written a little after the request they describe.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import json
+import logging
+import logging.handlers
+import re
+import threading
+
+log = logging.getLogger(__name__)
+
+# One logger (with a rotating file handler) per file.
+file_loggers = {}
+
+EXPLAIN_PREFIXES = {
+    'sqlite': 'EXPLAIN QUERY PLAN ',
+}
+
+
+def file_logger(path, max_bytes, backup_count):
+    '''The logger writing to path, created on first use.'''
+    try:
+        return file_loggers[path]
+    except KeyError:
+        pass
+    logger = logging.getLogger('{}.{}'.format(__name__, len(file_loggers)))
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=max_bytes, backupCount=backup_count
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    file_loggers[path] = logger
+    return logger
+
+
+def explain(bind, statement):
+    '''EXPLAIN statement on a new connection from bind's engine.
+
+    Args:
+        bind: a sqlalchemy Engine or Connection.
+        statement (pyramid_jsonapi.timing.Statement): the statement.
+
+    Returns:
+        list: rows of the plan, as lists of strings.
+    '''
+    engine = getattr(bind, 'engine', bind)
+    prefix = EXPLAIN_PREFIXES.get(engine.dialect.name, 'EXPLAIN ')
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute(prefix + statement.sql, statement.parameters)
+            return [[str(col) for col in row] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    finally:
+        connection.close()
+
+
+class SlowLog:
+    '''Writes records of slow requests.
+
+    Arguments:
+        threshold (float): seconds after which a request is slow.
+        logger (logging.Logger): where to write records.
+
+    Keyword Args:
+        explain (bool): whether to EXPLAIN the slowest SELECT.
+        explain_max_pending (int): maximum number of records waiting for
+            their EXPLAIN.
+    '''
+
+    def __init__(
+            self, threshold, logger, explain=False, explain_max_pending=10
+    ):
+        self.threshold = threshold
+        self.logger = logger
+        self.explain = explain
+        self.explain_slots = threading.BoundedSemaphore(explain_max_pending)
+        # One thread: never more than one EXPLAIN at a time on the database.
+        self.executor = ThreadPoolExecutor(max_workers=1) if explain else None
+
+    @classmethod
+    def from_settings(cls, settings):
+        '''Make a SlowLog from app settings.
+
+        Returns:
+            SlowLog or None: None if no threshold or path is set.
+        '''
+        threshold = settings.get('pyramid_jsonapi.slow_log.threshold_ms')
+        path = settings.get('pyramid_jsonapi.slow_log.path')
+        if threshold is None or path is None:
+            return None
+        return cls(
+            float(threshold) / 1000,
+            file_logger(
+                path,
+                int(settings.get(
+                    'pyramid_jsonapi.slow_log.max_bytes', 10 * 1024 * 1024
+                )),
+                int(settings.get('pyramid_jsonapi.slow_log.backup_count', 5))
+            ),
+            explain=settings.get(
+                'pyramid_jsonapi.slow_log.explain', 'false'
+            ) == 'true',
+            explain_max_pending=int(settings.get(
+                'pyramid_jsonapi.slow_log.explain_max_pending', 10
+            ))
+        )
+
+    def check(self, request_timing, view, bind, error=None):
+        '''Write a record if the request was slow.
+
+        Args:
+            request_timing (pyramid_jsonapi.timing.RequestTiming): timings of
+                the request.
+            view: the view instance which handled the request.
+            bind: the engine or connection the statements ran on.
+            error (Exception): the exception the view raised, if any.
+
+        Returns:
+            dict or None: the record, if any. With ``explain`` on it may not
+            have been written (or have its ``explain``) yet.
+        '''
+        duration = request_timing.phases.get('total', 0)
+        if duration < self.threshold:
+            return None
+        if error is None:
+            status = view.request.response.status_int
+        else:
+            status = getattr(error, 'code', 500)
+        record = {
+            'time': datetime.datetime.utcnow().isoformat() + 'Z',
+            'method': view.request.method,
+            'url': view.request.url,
+            'route': view.route_name(),
+            'view': view.collection_name,
+            'status': status,
+            'duration_ms': round(duration * 1000, 3),
+            'query': self.query_info(view),
+            'statements': [
+                {
+                    'sql': statement.sql,
+                    'ms': round(statement.seconds * 1000, 3),
+                    'context': statement.context,
+                }
+                for statement in request_timing.statements
+            ],
+        }
+        if error is not None:
+            record['error'] = '{}: {}'.format(type(error).__name__, error)
+        if self.explain:
+            slowest = self.slowest_select(request_timing)
+            if slowest is None:
+                record['explain'] = None
+            elif self.explain_slots.acquire(blocking=False):
+                self.executor.submit(
+                    self.explain_and_write, record, slowest, bind
+                )
+                return record
+            else:
+                record['explain'] = {
+                    'sql': slowest.sql,
+                    'error': 'too many EXPLAINs pending',
+                }
+        self.write(record)
+        return record
+
+    def write(self, record):
+        '''Write record as a JSON line.'''
+        self.logger.info(json.dumps(record, default=str))
+
+    def explain_and_write(self, record, statement, bind):
+        '''EXPLAIN statement into record, then write it (in the executor).'''
+        try:
+            record['explain'] = self.explain_statement(statement, bind)
+            self.write(record)
+        finally:
+            self.explain_slots.release()
+
+    def flush(self):
+        '''Wait until records waiting for their EXPLAIN have been written.'''
+        if self.executor is not None:
+            self.executor.submit(lambda: None).result()
+
+    @staticmethod
+    def query_info(view):
+        '''Sort, filters, paging, includes and sparse fields of a request.'''
+        qinfo = view.collection_query_info(view.request)
+        fields = {}
+        for param, value in view.request.params.items():
+            match = re.match(r'fields\[(.*?)\]$', param)
+            if match:
+                fields[match.group(1)] = value.split(',')
+        return {
+            'sort': qinfo['_sort'],
+            'filters': list(qinfo['_filters'].values()),
+            'page': {
+                'limit': qinfo['page[limit]'],
+                'offset': qinfo['page[offset]'],
+            },
+            'include': sorted(view.requested_include_names()),
+            'fields': fields,
+        }
+
+    @staticmethod
+    def slowest_select(request_timing):
+        '''The slowest single SELECT of a request, or None.'''
+        selects = [
+            statement for statement in request_timing.statements
+            if not statement.executemany and
+            statement.sql.lstrip().upper().startswith('SELECT')
+        ]
+        if not selects:
+            return None
+        return max(selects, key=lambda statement: statement.seconds)
+
+    @staticmethod
+    def explain_statement(statement, bind):
+        '''EXPLAIN a statement for a record.
+
+        Returns:
+            dict: ``sql`` and ``plan`` (or ``error``).
+        '''
+        try:
+            return {'sql': statement.sql, 'plan': explain(bind, statement)}
+        except Exception as e:
+            # The record is still useful without a plan.
+            log.warning('Could not EXPLAIN {}: {}'.format(statement.sql, e))
+            return {'sql': statement.sql, 'error': str(e)}
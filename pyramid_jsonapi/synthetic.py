@@ -0,0 +1,225 @@
+'''Generate synthetic rows in bulk for every table of a schema.
+
+Used by ``/debug/populate?scale=N`` to fill a database quickly for local
+performance work. N rows are added to each table in ``metadata`` (including
+association tables), in foreign key dependency order, with Core ``insert()``
+executemany in chunks: no ORM objects, no per row queries and no per row
+sequence calls.
+
+Values are a pure function of the column and the row's position, so that
+foreign keys can be computed rather than looked up:
+
+* integer primary keys count up from one more than the table's current
+  maximum (so repeated runs add rows rather than clash), and on PostgreSQL
+  the key's sequence is moved past the new rows afterwards;
+* the first foreign key column of a table refers to the row in the same
+  position of the referenced table, so its value is unique in each batch
+  (which satisfies association tables' composite keys); other foreign keys
+  are spread over the referenced rows; a table referring to itself refers to
+  an earlier row;
+* other columns get values of their type (``'<column><n>'`` strings,
+  numbers, times counting up from 2000-01-01, enum values in turn) where n is
+  the row's new integer key (or, in tables without one, the key its first
+  foreign key refers to), so that unique columns stay unique across runs.
+  Columns of other types are left to their defaults (or NULL).
+'''
+import datetime
+import decimal
+import itertools
+
+import sqlalchemy
+from sqlalchemy import func, types
+
+#: Rows sent to each executemany().
+CHUNK_SIZE = 10000
+
+BASE_TIME = datetime.datetime(2000, 1, 1)
+
+# Multiplier spreading foreign keys after the first over the referenced rows.
+SPREAD = 7919
+
+
+def is_integer_key(table):
+    '''The table's primary key column if it is a single integer, else None.'''
+    key = list(table.primary_key.columns)
+    if len(key) == 1 and isinstance(key[0].type, types.Integer):
+        return key[0]
+    return None
+
+
+def type_function(column):
+    '''A function of row number giving values of column's type.
+
+    Returns:
+        callable: the function, or None if the column's type is unknown.
+    '''
+    type_ = column.type
+    if isinstance(type_, types.TypeDecorator):
+        type_ = type_.impl
+    if isinstance(type_, types.Boolean):
+        return lambda i: i % 2 == 0
+    if isinstance(type_, types.Integer):
+        return int
+    if isinstance(type_, types.Float):
+        return float
+    if isinstance(type_, types.Numeric):
+        return decimal.Decimal
+    if isinstance(type_, types.DateTime):
+        return lambda i: BASE_TIME + datetime.timedelta(minutes=i)
+    if isinstance(type_, types.Date):
+        base = BASE_TIME.date()
+        return lambda i: base + datetime.timedelta(days=i % 36500)
+    if isinstance(type_, types.Time):
+        return lambda i: datetime.time(i // 60 % 24, i % 60)
+    if isinstance(type_, types.Interval):
+        return lambda i: datetime.timedelta(seconds=i)
+    if isinstance(type_, types.Enum):
+        enums = type_.enums
+        return lambda i: enums[i % len(enums)]
+    if isinstance(type_, types.String):
+        template = column.name + '{}'
+        if type_.length:
+            # Keep the (distinct) end of long values.
+            length = type_.length
+            return lambda i: template.format(i)[-length:]
+        return template.format
+    if isinstance(type_, types.LargeBinary):
+        return lambda i: str(i).encode()
+    if isinstance(type_, types.JSON):
+        return lambda i: {}
+    return None
+
+
+class SyntheticData:
+    '''Values for the synthetic rows of the tables in some metadata.
+
+    Arguments:
+        scale (int): number of rows per table.
+        first_ids (dict): first integer id to use, by table name (default 1).
+    '''
+
+    def __init__(self, scale, first_ids=None):
+        self.scale = scale
+        self.first_ids = first_ids or {}
+
+    def value_function(self, column):
+        '''A function of row number (from 0) giving column's value.
+
+        Returns:
+            callable: the function, or None if the column should be left to
+            its default.
+        '''
+        if column.foreign_keys:
+            return self.reference_function(column)
+        if column is is_integer_key(column.table):
+            first = self.first_ids.get(column.table.name, 1)
+            return lambda i: first + i
+        function = type_function(column)
+        if function is None:
+            return None
+        number = self.number_function(column.table)
+        return lambda i: function(number(i))
+
+    def number_function(self, table):
+        '''A function of row number giving a number unique to each new row.
+
+        The row's integer key if table has one, else the integer key its
+        first foreign key refers to, else the row number itself.
+        '''
+        key = is_integer_key(table)
+        if key is not None:
+            return self.value_function(key)
+        fk_columns = [c for c in table.columns if c.foreign_keys]
+        if fk_columns:
+            target = next(iter(fk_columns[0].foreign_keys)).column
+            if target.table is not table and \
+                    target is is_integer_key(target.table):
+                return self.value_function(fk_columns[0])
+        return lambda i: i
+
+    def reference_function(self, column):
+        '''Values of foreign key column: the keys of other rows.'''
+        target = next(iter(column.foreign_keys)).column
+        target_value = self.value_function(target)
+        if target.table is column.table:
+            return lambda i: target_value(i // 2)
+        fk_columns = [c for c in column.table.columns if c.foreign_keys]
+        position = fk_columns.index(column)
+        if position == 0:
+            return target_value
+        scale = self.scale
+        return lambda i: target_value((i * SPREAD + position) % scale)
+
+    def rows(self, table):
+        '''Generate the rows (dicts) for table.'''
+        functions = []
+        for column in table.columns:
+            function = self.value_function(column)
+            if function is not None:
+                functions.append((column.key, function))
+        for i in range(self.scale):
+            yield {key: function(i) for key, function in functions}
+
+
+def first_ids(connection, metadata):
+    '''One more than the maximum integer id in each table, by table name.'''
+    ids = {}
+    for table in metadata.sorted_tables:
+        key = is_integer_key(table)
+        if key is not None:
+            current = connection.execute(
+                sqlalchemy.select([func.max(key)])
+            ).scalar()
+            ids[table.name] = (current or 0) + 1
+    return ids
+
+
+def insert_chunked(connection, table, rows, chunk_size=CHUNK_SIZE):
+    '''Insert rows (an iterable of dicts) chunk_size at a time.'''
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            return
+        connection.execute(table.insert(), chunk)
+
+
+def reset_sequence(connection, table, last_id):
+    '''Make table's key sequence (PostgreSQL) continue after last_id.'''
+    if connection.dialect.name != 'postgresql':
+        return
+    key = is_integer_key(table)
+    connection.execute(
+        sqlalchemy.text(
+            'SELECT setval(pg_get_serial_sequence(:table, :column), :value)'
+        ),
+        {'table': table.fullname, 'column': key.name, 'value': last_id}
+    )
+
+
+def populate(engine, metadata, scale, chunk_size=CHUNK_SIZE):
+    '''Add scale synthetic rows to every table in metadata.
+
+    All tables are filled in one transaction.
+
+    Args:
+        engine: sqlalchemy engine.
+        metadata: sqlalchemy MetaData describing the tables (which must
+            exist).
+        scale (int): number of rows per table.
+        chunk_size (int): rows per executemany().
+
+    Returns:
+        dict: rows added by table name.
+    '''
+    added = {}
+    with engine.begin() as connection:
+        data = SyntheticData(scale, first_ids(connection, metadata))
+        for table in metadata.sorted_tables:
+            insert_chunked(connection, table, data.rows(table), chunk_size)
+            added[table.name] = scale
+            if table.name in data.first_ids:
+                reset_sequence(
+                    connection, table, data.first_ids[table.name] + scale - 1
+                )
+    return added
@@ -0,0 +1,198 @@
+'''Per-request counts and timings of SQL statements and view phases.
+
+Switched on with ``pyramid_jsonapi.timing = true``. For each request handled by
+a JSON-API view a :py:class:`RequestTiming` is made current (in a context
+variable, so it follows the request across threads and into
+``AsyncSession.run_sync()``). Cursor execute listeners on the session's engine
+record each statement (including failed ones) and how long it took and the
+view records how long each phase took:
+
+* ``parse``: header and include checks;
+* ``query``: fetching the requested items and counting them;
+* ``serialise``: turning items into resource objects, including the queries
+  for their relationships and includes;
+* ``callbacks``: running callback chains (some of which run while
+  serialising);
+* ``total``: the whole view.
+
+The results are sent in a ``Server-Timing`` header and, with
+``pyramid_jsonapi.debug.meta = true``, in ``meta.debug.timing``.
+'''
+import contextlib
+import contextvars
+import functools
+from collections import namedtuple
+import time
+import weakref
+
+from sqlalchemy import event
+
+#: The RequestTiming of the request being handled, if any.
+current = contextvars.ContextVar('pyramid_jsonapi_timing', default=None)
+
+instrumented_engines = weakref.WeakSet()
+
+Statement = namedtuple(
+    'Statement', ['sql', 'seconds', 'context', 'parameters', 'executemany']
+)
+
+
+class RequestTiming:
+    '''Statements and phase timings for one request.
+
+    Attributes:
+        statements (list): a :py:class:`Statement` (``sql``, ``seconds``,
+            ``context``, ``parameters`` and ``executemany``) for each SQL
+            statement executed.
+        phases (dict): total seconds spent in each named phase. Nested entries
+            into the same phase are only counted once.
+        context (str): what the view is doing, recorded with each statement
+            (e.g. ``people.posts`` while fetching the posts of a person).
+    '''
+
+    def __init__(self):
+        self.statements = []
+        self.phases = {}
+        self.open_phases = set()
+        self.context = None
+
+    @property
+    def db_count(self):
+        '''Number of statements executed.'''
+        return len(self.statements)
+
+    @property
+    def db_seconds(self):
+        '''Total time spent executing statements.'''
+        return sum(statement.seconds for statement in self.statements)
+
+    def start(self, phase):
+        '''Start timing phase.
+
+        Returns:
+            float or None: start time, or None if phase was already open.
+        '''
+        if phase in self.open_phases:
+            return None
+        self.open_phases.add(phase)
+        return time.perf_counter()
+
+    def stop(self, phase, started):
+        '''Stop timing a phase started with :py:meth:`start`.'''
+        if started is None:
+            return
+        self.open_phases.discard(phase)
+        self.phases[phase] = \
+            self.phases.get(phase, 0) + time.perf_counter() - started
+
+    def server_timing(self):
+        '''Value for a ``Server-Timing`` header (durations in ms).'''
+        entries = [
+            'db;dur={:.2f};desc="{} statements"'.format(
+                self.db_seconds * 1000, self.db_count
+            )
+        ]
+        for phase, seconds in self.phases.items():
+            entries.append('{};dur={:.2f}'.format(phase, seconds * 1000))
+        return ', '.join(entries)
+
+    def add_header(self, request, response):
+        '''Response callback adding the ``Server-Timing`` header.'''
+        response.headers['Server-Timing'] = self.server_timing()
+
+    def as_dict(self):
+        '''Counts and timings (in ms) as a dictionary.'''
+        return {
+            'db_count': self.db_count,
+            'db_ms': round(self.db_seconds * 1000, 3),
+            'phases_ms': {
+                phase: round(seconds * 1000, 3)
+                for phase, seconds in self.phases.items()
+            },
+        }
+
+
+def timed(phase):
+    '''Decorator timing a view method as phase of the current request.'''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            timing = current.get()
+            if timing is None:
+                return f(*args, **kwargs)
+            started = timing.start(phase)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                timing.stop(phase, started)
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def phase(name):
+    '''Context manager timing its body as phase name of the current request.'''
+    timing = current.get()
+    if timing is None:
+        yield
+        return
+    started = timing.start(name)
+    try:
+        yield
+    finally:
+        timing.stop(name, started)
+
+
+def before_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+):
+    if current.get() is not None:
+        conn.info.setdefault('pyramid_jsonapi_started', []).append(
+            time.perf_counter()
+        )
+
+
+def after_cursor_execute(
+        conn, cursor, statement, parameters, context, executemany
+):
+    record(conn, statement, parameters, executemany)
+
+
+def handle_error(exception_context):
+    '''Record a failed statement (and forget when it started).'''
+    conn = exception_context.connection
+    if conn is None:
+        return
+    record(
+        conn, exception_context.statement, exception_context.parameters,
+        getattr(exception_context.execution_context, 'executemany', False)
+    )
+
+
+def record(conn, statement, parameters, executemany):
+    '''Record a statement started in before_cursor_execute().'''
+    started = conn.info.get('pyramid_jsonapi_started')
+    if not started:
+        return
+    seconds = time.perf_counter() - started.pop()
+    timing = current.get()
+    if timing is None:
+        return
+    timing.statements.append(Statement(
+        statement, seconds, timing.context, parameters, executemany
+    ))
+
+
+def instrument(bind):
+    '''Add the statement timing listeners to the engine of bind (once).
+
+    Args:
+        bind: a sqlalchemy Engine or Connection.
+    '''
+    engine = getattr(bind, 'engine', bind)
+    if engine in instrumented_engines:
+        return
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+    event.listen(engine, 'handle_error', handle_error)
+    instrumented_engines.add(engine)
@@ -19,9 +19,17 @@ from sqlalchemy.orm import (
     backref
     )
 
-from zope.sqlalchemy import ZopeTransactionExtension
-
-DBSession = scoped_session(sessionmaker(extension=ZopeTransactionExtension()))
+try:
+    from zope.sqlalchemy import register
+except ImportError:
+    # zope.sqlalchemy < 1.2
+    from zope.sqlalchemy import ZopeTransactionExtension
+    DBSession = scoped_session(
+        sessionmaker(extension=ZopeTransactionExtension())
+    )
+else:
+    DBSession = scoped_session(sessionmaker())
+    register(DBSession)
 Base = declarative_base()
 
 IdType = BigInteger
@@ -0,0 +1,160 @@
+'''Tests of serving reads from asyncio with pyramid_jsonapi.asgi.
+
+Each GET is sent both to the WSGI app and to the
+:py:class:`pyramid_jsonapi.asgi.AsyncReadApp` wrapping it, using a SQLite
+database file (so that the sync and async engines see the same data), and the
+documents compared. They need SQLAlchemy >= 1.4 and aiosqlite, and are skipped
+otherwise::
+
+    python -m unittest test_project.test_async
+'''
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import sqlalchemy
+import webtest
+from pyramid.config import Configurator
+from pyramid.renderers import JSON
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+import pyramid_jsonapi
+import test_project
+from test_project import models
+from test_project.test_query_counts import populate
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+try:
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+except ImportError:
+    AsyncSession = None
+else:
+    import pyramid_jsonapi.asgi
+
+
+def make_app(engine):
+    '''The test project's models served with request.db as the session.'''
+    # zope.sqlalchemy >= 1.2, as needed by SQLAlchemy >= 1.4.
+    from zope.sqlalchemy import register
+    Session = scoped_session(sessionmaker(bind=engine))
+    register(Session)
+    config = Configurator(settings={
+        'pyramid_jsonapi.allow_client_ids': 'true',
+    })
+    config.include('pyramid_tm')
+
+    def db(request):
+        request.add_finished_callback(lambda request: Session.remove())
+        return Session
+    config.add_request_method(db, 'db', reify=True)
+    renderer = JSON()
+    renderer.add_adapter(datetime.date, test_project.datetime_adapter)
+    config.add_renderer('json', renderer)
+    pyramid_jsonapi.create_jsonapi(config, models, engine=engine)
+    return config.make_wsgi_app()
+
+
+@unittest.skipIf(
+    AsyncSession is None or aiosqlite is None,
+    'needs SQLAlchemy >= 1.4 and aiosqlite'
+)
+class TestAsyncReadApp(unittest.TestCase):
+    '''Compare documents from AsyncReadApp with those from the WSGI app.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        path = os.path.join(cls.tmpdir, 'test.sqlite')
+        cls.engine = sqlalchemy.create_engine('sqlite:///' + path)
+        populate(cls.engine)
+        cls.wsgi_app = make_app(cls.engine)
+        cls.test_app = webtest.TestApp(cls.wsgi_app)
+        cls.async_engine = create_async_engine('sqlite+aiosqlite:///' + path)
+        cls.app = pyramid_jsonapi.asgi.AsyncReadApp(
+            cls.wsgi_app,
+            sessionmaker(cls.async_engine, class_=AsyncSession)
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run(cls.async_engine.dispose())
+        cls.engine.dispose()
+        shutil.rmtree(cls.tmpdir)
+
+    def request(self, path, method='GET'):
+        '''Send a request to the ASGI app.
+
+        Returns:
+            tuple: ``(status, headers, body)``.
+        '''
+        path, _, query = path.partition('?')
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode(),
+            'headers': [(b'host', b'localhost:80')],
+        }
+        sent = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, receive, send))
+        return sent[0]['status'], dict(sent[0]['headers']), sent[1]['body']
+
+    def assertSameDocument(self, path):
+        '''Assert that both apps respond to a GET of path alike.'''
+        status, headers, body = self.request(path)
+        expected = self.test_app.get(path, expect_errors=True)
+        self.assertEqual(status, expected.status_int, path)
+        self.assertEqual(
+            headers[b'content-type'].decode(), expected.content_type, path
+        )
+        self.assertEqual(json.loads(body), expected.json, path)
+
+    def test_get_same_as_sync(self):
+        '''Should serve the same documents as the sync views.'''
+        with mock.patch.object(
+                pyramid_jsonapi.asgi.Prefetcher, 'run', autospec=True,
+                side_effect=pyramid_jsonapi.asgi.Prefetcher.run
+        ) as run:
+            for path in (
+                    '/people?page[limit]=5&include=posts.comments',
+                    '/posts?page[limit]=5&include=author,blog',
+                    '/people/1?include=blogs.posts.author',
+                    '/blogs/1/posts?page[limit]=5',
+                    '/posts/1/relationships/author',
+                    '/people/1/relationships/posts',
+            ):
+                with self.subTest(path=path):
+                    self.assertSameDocument(path)
+        # Related queries went through the prefetcher, not the view's session.
+        self.assertTrue(run.called)
+
+    def test_get_errors_same_as_sync(self):
+        '''Should serve the same error documents as the sync views.'''
+        for path in (
+                '/people/100000',
+                '/people?include=nosuchrel',
+        ):
+            with self.subTest(path=path):
+                self.assertSameDocument(path)
+
+    def test_non_get_passed_to_wsgi(self):
+        '''Should hand anything but JSON-API GETs to the WSGI app.'''
+        status, headers, body = self.request('/comments/1', method='DELETE')
+        self.assertEqual(status, 200)
+        self.test_app.get('/comments/1', status=404)
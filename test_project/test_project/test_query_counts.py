@@ -0,0 +1,290 @@
+'''Query count regression tests, against an in-memory SQLite database.
+
+These check how the number of SQL statements run by each shape of request
+grows with the page size and the number of resources in a request, so that
+changes to ``serialise_db_item``, ``related_query`` or the write paths which
+add queries per item are caught. Unlike ``tests.py`` they need no database
+server::
+
+    python -m unittest test_project.test_query_counts
+
+Where pyramid_jsonapi does not scale as it should yet (the number of
+statements should not depend on the page size, say) the test pins the
+current count for each size with :py:meth:`QueryCountTestBase.assertAtMost`,
+so that things can only get better. When a fix lands, lower the counts or
+switch the test to :py:meth:`QueryCountTestBase.assertSameCount`.
+'''
+import datetime
+import json
+import unittest
+import warnings
+
+import transaction
+import webtest
+from sqlalchemy import BigInteger, event, func, select
+from sqlalchemy.exc import SAWarning
+from sqlalchemy.ext.compiler import compiles
+
+import test_project
+from test_project.models import (
+    DBSession,
+    Base,
+    Person,
+    Blog,
+    Post,
+    Comment,
+)
+
+
+@compiles(BigInteger, 'sqlite')
+def compile_big_int_sqlite(type_, compiler, **kw):
+    '''Make BigInteger primary keys autoincrement in SQLite.'''
+    return 'INTEGER'
+
+
+SETTINGS = {
+    'sqlalchemy.url': 'sqlite://',
+    'pyramid.includes': 'pyramid_tm',
+    'pyramid_jsonapi.allow_client_ids': 'true',
+    'pyramid_jsonapi.paging.max_limit': '1000',
+}
+
+PEOPLE = 250
+POSTS_PER_PERSON = 2
+COMMENTS_PER_POST = 2
+
+
+def populate(engine):
+    '''Create tables and add PEOPLE people with blogs, posts and comments.
+
+    Every post is in blog 1, so that it has a long list of posts.
+    '''
+    Base.metadata.create_all(engine)
+    published = datetime.datetime(2015, 1, 1)
+    n_posts = PEOPLE * POSTS_PER_PERSON
+    # Not with DBSession.execute(): zope.sqlalchemy rolls back sessions which
+    # the ORM (or mark_changed()) has not marked as changed.
+    with engine.begin() as connection:
+        connection.execute(Person.__table__.insert(), [
+            {'id': i, 'name': 'person{}'.format(i)}
+            for i in range(1, PEOPLE + 1)
+        ])
+        connection.execute(Blog.__table__.insert(), [
+            {'id': i, 'title': 'blog{}'.format(i), 'owner_id': i}
+            for i in range(1, PEOPLE + 1)
+        ])
+        connection.execute(Post.__table__.insert(), [
+            {
+                'id': i,
+                'title': 'post{}'.format(i),
+                'published_at': published,
+                'blog_id': 1,
+                'author_id': (i - 1) // POSTS_PER_PERSON + 1,
+            }
+            for i in range(1, n_posts + 1)
+        ])
+        connection.execute(Comment.__table__.insert(), [
+            {
+                'comments_id': i,
+                'content': 'comment{}'.format(i),
+                'author_id': i % PEOPLE + 1,
+                'post_id': (i - 1) // COMMENTS_PER_POST + 1,
+            }
+            for i in range(1, n_posts * COMMENTS_PER_POST + 1)
+        ])
+
+
+def identifiers(collection, n):
+    '''Resource identifiers for ids 1 to n of collection.'''
+    return [{'type': collection, 'id': str(i)} for i in range(1, n + 1)]
+
+
+class QueryCountTestBase(unittest.TestCase):
+    '''Builds the test project app on SQLite and counts statements.'''
+
+    @classmethod
+    def setUpClass(cls):
+        DBSession.remove()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=SAWarning)
+            app = test_project.main({}, **SETTINGS)
+        cls.test_app = webtest.TestApp(app)
+        cls.engine = Base.metadata.bind
+        cls.statements = 0
+        event.listen(cls.engine, 'before_cursor_execute', cls.count)
+
+    @classmethod
+    def tearDownClass(cls):
+        event.remove(cls.engine, 'before_cursor_execute', cls.count)
+        DBSession.remove()
+
+    @classmethod
+    def count(cls, *args):
+        cls.statements += 1
+
+    def setUp(self):
+        populate(self.engine)
+        n_posts = PEOPLE * POSTS_PER_PERSON
+        for model, rows in (
+                (Person, PEOPLE),
+                (Blog, PEOPLE),
+                (Post, n_posts),
+                (Comment, n_posts * COMMENTS_PER_POST),
+        ):
+            self.assertEqual(
+                self.engine.execute(
+                    select([func.count()]).select_from(model.__table__)
+                ).scalar(),
+                rows,
+                'Fixture rows missing from {}'.format(model.__tablename__)
+            )
+
+    def tearDown(self):
+        transaction.abort()
+        DBSession.remove()
+        Base.metadata.drop_all(self.engine)
+
+    def count_statements(self, path, method='GET', data=None):
+        '''Number of statements run to handle a request (which must succeed).
+
+        Args:
+            path (str): URL path and query.
+            method (str): HTTP method.
+            data: value of the ``data`` member of the request document, if
+                any.
+        '''
+        kwargs = {}
+        if data is not None:
+            kwargs = {
+                'body': json.dumps({'data': data}).encode(),
+                'content_type': 'application/vnd.api+json',
+            }
+        type(self).statements = 0
+        self.test_app.request(path, method=method, status='2*', **kwargs)
+        return type(self).statements
+
+    def assertSameCount(self, path_template, sizes=(10, 100)):
+        '''Assert that the statement count is the same for each size.'''
+        counts = self.page_counts(path_template, sizes)
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            'Statements by size for {}: {}'.format(path_template, counts)
+        )
+
+    def assertAtMost(self, counts, limits, description):
+        '''Assert that no count (by size) is more than its limit.'''
+        for size, limit in limits.items():
+            self.assertLessEqual(
+                counts[size], limit,
+                'Statements by size for {}: {}'.format(description, counts)
+            )
+
+    def page_counts(self, path_template, sizes=(10, 100)):
+        '''Statement counts of GETs of path_template by page size.'''
+        return {
+            size: self.count_statements(path_template.format(size))
+            for size in sizes
+        }
+
+
+class TestQueryCountsRead(QueryCountTestBase):
+    '''Statement counts of GET requests.'''
+
+    def test_item(self):
+        '''GET of one item should take a handful of statements.'''
+        self.assertLessEqual(self.count_statements('/posts/1'), 3)
+
+    def test_sparse_fields_page_size(self):
+        '''Attributes-only pages should not query per item.'''
+        self.assertSameCount('/posts?fields[posts]=title&page[limit]={}')
+
+    def test_relationships_page_size(self):
+        '''Relationship (identifier) pages should not query per item.'''
+        self.assertSameCount('/blogs/1/relationships/posts?page[limit]={}')
+
+    def test_collection_page_size(self):
+        '''Pages with relationships should not query per item.
+
+        They take two statements per item for now.
+        '''
+        path = '/posts?page[limit]={}'
+        self.assertAtMost(
+            self.page_counts(path), {10: 22, 100: 202}, path
+        )
+
+    def test_related_page_size(self):
+        '''Related pages should not query per item.
+
+        They take two statements per item for now.
+        '''
+        path = '/blogs/1/posts?page[limit]={}'
+        self.assertAtMost(
+            self.page_counts(path), {10: 23, 100: 203}, path
+        )
+
+    def test_include_page_size(self):
+        '''Includes should be fetched per relationship, not per item.
+
+        They take two statements per item and included item for now (each
+        person includes 2 posts with 2 comments each).
+        '''
+        path = '/people?include=posts.comments&page[limit]={}'
+        self.assertAtMost(
+            self.page_counts(path), {10: 142, 100: 1402}, path
+        )
+
+
+class TestQueryCountsWrite(QueryCountTestBase):
+    '''Statement counts of writes.'''
+
+    def test_patch_item(self):
+        '''PATCH of one item should take a handful of statements.'''
+        self.assertLessEqual(
+            self.count_statements('/posts/1', 'PATCH', {
+                'type': 'posts', 'id': '1', 'attributes': {'title': 'new'}
+            }),
+            3
+        )
+
+    def relationships_counts(self, method, sizes=(1, 500)):
+        return {
+            size: self.count_statements(
+                '/blogs/{}/relationships/posts'.format(i + 2), method,
+                identifiers('posts', size)
+            )
+            for i, size in enumerate(sizes)
+        }
+
+    def test_relationships_patch_constant(self):
+        '''Replacing a to-many relationship should take O(1) statements.
+
+        It takes one statement per id for now.
+        '''
+        self.assertAtMost(
+            self.relationships_counts('PATCH'), {1: 4, 500: 503},
+            'relationships PATCH'
+        )
+
+    def test_relationships_post_constant(self):
+        '''Adding to a to-many relationship should take O(1) statements.
+
+        It takes one statement per id for now.
+        '''
+        self.assertAtMost(
+            self.relationships_counts('POST'), {1: 4, 500: 503},
+            'relationships POST'
+        )
+
+    def test_relationships_delete_constant(self):
+        '''Removing from a to-many relationship should take O(1) statements.
+
+        It takes two statements per id for now.
+        '''
+        self.assertAtMost(
+            self.relationships_counts('DELETE'), {1: 4, 500: 1001},
+            'relationships DELETE'
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,232 @@
+'''Query plan snapshot tests, against an in-memory SQLite database.
+
+For each standard shape of query that pyramid_jsonapi builds (single items,
+related items for each direction of relationship, sorting joins and each
+filter operator) the output of SQLite's ``EXPLAIN QUERY PLAN`` is compared
+with a snapshot in ``query_plans.json``, with indexes on the foreign key and
+commonly filtered columns (``INDEXES``). A test fails if a plan scans a table
+which its snapshot does not, so that a change in how queries are built which
+stops an index being used is caught::
+
+    python -m unittest test_project.test_query_plans
+
+Other differences from the snapshots (which vary with the SQLite version) are
+ignored. After a deliberate change, or to add a shape, rewrite the snapshots
+with::
+
+    UPDATE_QUERY_PLANS=1 python -m unittest test_project.test_query_plans
+'''
+import json
+import os
+import re
+import unittest
+import warnings
+
+from pyramid.interfaces import IRoutesMapper
+from pyramid.request import Request
+from sqlalchemy.exc import SAWarning
+
+import pyramid_jsonapi
+import test_project
+from test_project.models import (
+    DBSession,
+    Base,
+    Person,
+    Blog,
+    Post,
+    ArticleByAssoc,
+)
+from test_project.test_query_counts import SETTINGS
+
+SNAPSHOTS = os.path.join(os.path.dirname(__file__), 'query_plans.json')
+
+# Indexes a real deployment would have: foreign keys and filtered columns.
+INDEXES = {
+    'ix_blogs_owner_id': ('blogs', 'owner_id'),
+    'ix_posts_blog_id': ('posts', 'blog_id'),
+    'ix_posts_author_id': ('posts', 'author_id'),
+    'ix_posts_published_at': ('posts', 'published_at'),
+    'ix_comments_author_id': ('comments', 'author_id'),
+    'ix_comments_post_id': ('comments', 'post_id'),
+    'ix_people_name': ('people', 'name'),
+    'ix_authors_articles_assoc_article_id': (
+        'authors_articles_assoc', 'article_id'
+    ),
+}
+
+SCAN = re.compile(r'^\s*SCAN (?:TABLE )?(\w+)')
+
+FILTER_OPS = (
+    'eq', 'ne', 'lt', 'gt', 'le', 'ge',
+    'startswith', 'endswith', 'contains', 'like', 'ilike',
+)
+
+
+def plan_lines(rows):
+    '''Normalised, indented lines of EXPLAIN QUERY PLAN output.'''
+    depth = {0: -1}
+    lines = []
+    for row in rows:
+        node, parent, detail = row[0], row[1], row[-1]
+        depth[node] = depth.get(parent, -1) + 1
+        # Older SQLite says "SCAN TABLE x", newer just "SCAN x".
+        detail = re.sub(r'^(SCAN|SEARCH) TABLE ', r'\1 ', detail)
+        lines.append('  ' * depth[node] + detail)
+    return lines
+
+
+def scanned(lines):
+    '''Names of tables scanned in full according to plan lines.'''
+    return {
+        match.group(1) for match in map(SCAN.match, lines) if match
+    }
+
+
+class TestQueryPlans(unittest.TestCase):
+    '''Query plans of the queries built by the views.'''
+
+    update = bool(os.environ.get('UPDATE_QUERY_PLANS'))
+
+    @classmethod
+    def setUpClass(cls):
+        DBSession.remove()
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=SAWarning)
+            cls.app = test_project.main({}, **SETTINGS)
+        cls.engine = Base.metadata.bind
+        Base.metadata.create_all(cls.engine)
+        cls.connection = cls.engine.raw_connection()
+        for name, (table, column) in INDEXES.items():
+            cls.connection.cursor().execute(
+                'CREATE INDEX {} ON {} ({})'.format(name, table, column)
+            )
+        try:
+            with open(SNAPSHOTS) as f:
+                cls.snapshots = json.load(f)
+        except FileNotFoundError:
+            cls.snapshots = {}
+        cls.plans = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        DBSession.remove()
+        cls.connection.close()
+        Base.metadata.drop_all(cls.engine)
+        if cls.update:
+            with open(SNAPSHOTS, 'w') as f:
+                json.dump(
+                    dict(cls.snapshots, **cls.plans), f,
+                    indent=2, sort_keys=True
+                )
+                f.write('\n')
+
+    def view(self, model, path):
+        '''An instance of model's view for a request for path (not sent).'''
+        request = Request.blank(path)
+        request.registry = self.app.registry
+        info = self.app.registry.getUtility(IRoutesMapper)(request)
+        request.matchdict = info['match']
+        request.matched_route = info['route']
+        # The view gets its session from test_project's get_dbsession.
+        return pyramid_jsonapi.view_classes[model](request)
+
+    def explain(self, query):
+        '''Plan lines of query.'''
+        sql = str(query.statement.compile(
+            dialect=self.engine.dialect,
+            compile_kwargs={'literal_binds': True},
+        ))
+        cursor = self.connection.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return plan_lines(cursor.fetchall())
+
+    def assertPlan(self, name, query):
+        '''Assert that query scans no table its snapshot does not.'''
+        lines = self.explain(query)
+        self.plans[name] = lines
+        if self.update:
+            return
+        if name not in self.snapshots:
+            self.fail(
+                'No snapshot of the plan for {}: rerun with '
+                'UPDATE_QUERY_PLANS=1 to add one.'.format(name)
+            )
+        new_scans = scanned(lines) - scanned(self.snapshots[name])
+        self.assertFalse(
+            new_scans,
+            'Plan for {} now scans {}.\nSnapshot:\n{}\nNow:\n{}'.format(
+                name, ', '.join(sorted(new_scans)),
+                '\n'.join(self.snapshots[name]), '\n'.join(lines)
+            )
+        )
+
+    def test_single_item_query(self):
+        for model, path in (
+                (Person, '/people/1'),
+                (Post, '/posts/1'),
+                (Post, '/posts/1?fields[posts]=title'),
+        ):
+            with self.subTest(path=path):
+                self.assertPlan(
+                    'single_item_query {}'.format(path),
+                    self.view(model, path).single_item_query
+                )
+
+    def test_related_query(self):
+        for model, collection, rel_name in (
+                # ONETOMANY
+                (Person, 'people', 'posts'),
+                (Post, 'posts', 'comments'),
+                # MANYTOONE
+                (Post, 'posts', 'author'),
+                (Blog, 'blogs', 'owner'),
+                # MANYTOMANY, from both ends.
+                (Person, 'people', 'articles_by_assoc'),
+                (ArticleByAssoc, 'articles_by_assoc', 'authors'),
+        ):
+            path = '/{}/1/{}'.format(collection, rel_name)
+            view = self.view(model, path)
+            rel = view.relationships[rel_name]
+            for full_object in (True, False):
+                with self.subTest(path=path, full_object=full_object):
+                    self.assertPlan(
+                        'related_query {} {} full_object={}'.format(
+                            path, rel.direction.name, full_object
+                        ),
+                        view.related_query('1', rel, full_object)
+                    )
+
+    def test_query_add_sorting(self):
+        for model, path in (
+                (Post, '/posts?sort=title'),
+                (Post, '/posts?sort=-published_at'),
+                (Post, '/posts?sort=author.name'),
+                (Post, '/posts?sort=-blog.title'),
+                (Post, '/posts?sort=author'),
+                (Blog, '/blogs?sort=owner.name'),
+        ):
+            with self.subTest(path=path):
+                view = self.view(model, path)
+                self.assertPlan(
+                    'query_add_sorting {}'.format(path),
+                    view.query_add_sorting(DBSession.query(model))
+                )
+
+    def test_query_add_filtering(self):
+        for op in FILTER_OPS:
+            for model, path in (
+                    (Person, '/people?filter[name:{}]=alice'),
+                    (Post, '/posts?filter[published_at:{}]=2015-01-03'),
+                    (Post, '/posts?filter[author_id:{}]=1'),
+            ):
+                path = path.format(op)
+                with self.subTest(path=path):
+                    view = self.view(model, path)
+                    self.assertPlan(
+                        'query_add_filtering {}'.format(path),
+                        view.query_add_filtering(DBSession.query(model))
+                    )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,25 @@
 import unittest
+import unittest.mock
+import collections
+import threading
 import transaction
 import testing.postgresql
 import webtest
+import sqlalchemy
+import sqlalchemy.ext.declarative
 import datetime
-from pyramid.paster import get_app
-from sqlalchemy import create_engine
+from pyramid.config import Configurator
+from pyramid.paster import get_app, get_appsettings
+from sqlalchemy import create_engine, event
 from sqlalchemy.exc import SAWarning
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import SingletonThreadPool, StaticPool
 import test_project
+import pyramid_jsonapi
 import inspect
 import os
+import json
+import tempfile
 import urllib
 import warnings
 
@@ -27,6 +38,18 @@ cur_dir = os.path.dirname(
 parent_dir = os.path.dirname(cur_dir)
 
 
+def make_app(options):
+    '''Make a test app with some settings overridden.
+
+    ``get_app()``'s ``options`` are only used for ``%(var)s`` substitution
+    (they actually remove matching settings from the app section) so build
+    the app from the ini file's settings updated with options.
+    '''
+    settings = get_appsettings('{}/testing.ini'.format(parent_dir))
+    settings.update(options)
+    return test_project.main({}, **settings)
+
+
 def setUpModule():
     '''Create a test DB and import data.'''
     # Create a new database somewhere in /tmp
@@ -46,6 +69,9 @@ def tearDownModule():
 
 class DBTestBase(unittest.TestCase):
 
+    # Settings overriding those in testing.ini.
+    app_options = None
+
     @classmethod
     def setUpClass(cls):
         '''Create a test app.'''
@@ -56,7 +82,10 @@ class DBTestBase(unittest.TestCase):
                 "ignore",
                 category=SAWarning
             )
-            cls.app = get_app('{}/testing.ini'.format(parent_dir))
+            if cls.app_options:
+                cls.app = make_app(cls.app_options)
+            else:
+                cls.app = get_app('{}/testing.ini'.format(parent_dir))
         cls.test_app = webtest.TestApp(cls.app)
 
     def setUp(self):
@@ -1865,6 +1894,14 @@ class TestSpec(DBTestBase):
         # Check that comments/5 no longer exists.
         self.test_app.get('/comments/5', status=404)
 
+    def test_spec_delete_collection_disabled(self):
+        '''Should not allow DELETE of a collection by default.
+
+        Bulk writes need pyramid_jsonapi.bulk_collection_writes.
+        '''
+        self.test_app.delete('/comments?filter[author_id:eq]=1', status=404)
+        self.test_app.get('/comments/1')
+
     def test_spec_delete_relationships_onetomany(self):
         '''Should remove a comment from a post.
 
@@ -2040,6 +2077,1102 @@ class TestSpec(DBTestBase):
         self.assertEqual(found_ids, {'2'})
 
 
+class TestRowcountDelete(DBTestBase):
+    '''Test the load-free DELETE path.'''
+
+    app_options = {'pyramid_jsonapi.rowcount_delete': 'true'}
+
+    def test_rowcount_delete_orm_fallback(self):
+        '''Should use the ORM for collections with TOMANY relationships.
+
+        Deleting blogs/1 directly would violate the foreign keys from its
+        posts: the ORM nulls those first.
+        '''
+        self.test_app.delete('/blogs/1')
+        self.test_app.get('/blogs/1', status=404)
+        r = self.test_app.get('/posts/1')
+        self.assertIsNone(r.json['data']['relationships']['blog']['data'])
+
+    def test_rowcount_delete_item(self):
+        '''Should delete comments/5 and return its identifier.'''
+        r = self.test_app.delete('/comments/5')
+        self.assertEqual(r.json['data'], {'type': 'comments', 'id': '5'})
+        self.test_app.get('/comments/5', status=404)
+
+    def test_rowcount_delete_nonexistent(self):
+        '''Should return null data for an item which does not exist.'''
+        r = self.test_app.delete('/comments/99999')
+        self.assertIsNone(r.json['data'])
+
+
+class TestBulkWrites(DBTestBase):
+    '''Test filter scoped PATCH and DELETE on collection URLs.'''
+
+    app_options = {'pyramid_jsonapi.bulk_collection_writes': 'true'}
+
+    def test_bulk_patch(self):
+        '''Should update every matching item and report how many.'''
+        r = self.test_app.patch_json(
+            '/posts?filter[author_id:eq]=1&ids=true',
+            {
+                'data': {
+                    'type': 'posts',
+                    'attributes': {'content': 'bulk'}
+                }
+            },
+            headers={'Content-Type': 'application/vnd.api+json'}
+        )
+        ids = {item['id'] for item in r.json['data']}
+        self.assertEqual(r.json['meta']['results']['affected'], len(ids))
+        contents = {
+            post['id']: post['attributes']['content']
+            for post in self.test_app.get(
+                '/posts?filter[author_id:eq]=1&fields[posts]=content'
+            ).json['data']
+        }
+        self.assertEqual(set(contents), ids)
+        self.assertEqual(set(contents.values()), {'bulk'})
+
+    def test_bulk_patch_unknown_attribute(self):
+        '''Should refuse to update an attribute which does not exist.'''
+        self.test_app.patch_json(
+            '/posts?filter[author_id:eq]=1',
+            {
+                'data': {
+                    'type': 'posts',
+                    'attributes': {'frog': 'ribbit'}
+                }
+            },
+            headers={'Content-Type': 'application/vnd.api+json'},
+            status=400
+        )
+
+    def test_bulk_delete(self):
+        '''Should delete every matching item.'''
+        r = self.test_app.delete('/comments?filter[author_id:eq]=1')
+        self.assertGreater(r.json['meta']['results']['affected'], 0)
+        r = self.test_app.get('/comments?filter[author_id:eq]=1')
+        self.assertEqual(r.json['data'], [])
+
+    def test_bulk_delete_ids(self):
+        '''Should return the identifiers of the deleted items.'''
+        expected = {
+            item['id'] for item in self.test_app.get(
+                '/comments?filter[author_id:eq]=1'
+            ).json['data']
+        }
+        r = self.test_app.delete('/comments?filter[author_id:eq]=1&ids=true')
+        self.assertEqual({item['id'] for item in r.json['data']}, expected)
+        self.assertEqual(r.json['meta']['results']['affected'], len(expected))
+        r = self.test_app.get('/comments?filter[author_id:eq]=1')
+        self.assertEqual(r.json['data'], [])
+
+    def test_bulk_ids_without_returning(self):
+        '''Should select the identifiers first without RETURNING.'''
+        view_class = pyramid_jsonapi.view_classes[test_project.models.Comment]
+        view_class.bulk_returning = lambda self: False
+        try:
+            self.test_bulk_delete_ids()
+        finally:
+            del view_class.bulk_returning
+
+    def test_bulk_bad_filter_value(self):
+        '''Should return 400 if the database rejects a filter value.'''
+        for ids in ('true', 'false'):
+            with self.subTest(ids=ids):
+                self.test_app.delete(
+                    '/posts?filter[published_at:lt]=notadate&ids=' + ids,
+                    status=400
+                )
+
+    def test_bulk_requires_filter(self):
+        '''Should refuse to act on a whole collection.'''
+        self.test_app.delete('/comments', status=400)
+
+
+class TestUpsert(DBTestBase):
+    '''Test POST with client ids in upsert mode.'''
+
+    app_options = {'pyramid_jsonapi.upsert': 'true'}
+
+    def test_upsert_existing(self):
+        '''Should update people/1 rather than 409.'''
+        r = self.test_app.post_json(
+            '/people',
+            {
+                'data': {
+                    'id': '1',
+                    'type': 'people',
+                    'attributes': {
+                        'name': 'alicia'
+                    }
+                }
+            },
+            headers={'Content-Type': 'application/vnd.api+json'},
+            status=200
+        )
+        self.assertEqual(r.json['data']['meta']['upserted'], 'updated')
+        self.assertEqual(
+            self.test_app.get('/people/1').json['data']['attributes']['name'],
+            'alicia'
+        )
+
+    def test_upsert_bulk(self):
+        '''Should create and update in one request, reporting which is which.'''
+        r = self.test_app.post_json(
+            '/people',
+            {
+                'data': [
+                    {
+                        'id': '1',
+                        'type': 'people',
+                        'attributes': {'name': 'alicia'}
+                    },
+                    {
+                        'id': '1000',
+                        'type': 'people',
+                        'attributes': {'name': 'newbie'}
+                    },
+                ]
+            },
+            headers={'Content-Type': 'application/vnd.api+json'},
+            status=201
+        )
+        self.assertEqual(
+            {item['id']: item['meta']['upserted'] for item in r.json['data']},
+            {'1': 'updated', '1000': 'created'}
+        )
+        self.test_app.get('/people/1000')
+
+    def test_upsert_key_not_id(self):
+        '''Should upsert comments, whose key column is comments_id.
+
+        With relationships (merged through the ORM) and without (ON CONFLICT
+        on PostgreSQL).
+        '''
+        self.test_app.post_json(
+            '/comments',
+            {
+                'data': {
+                    'id': '1',
+                    'type': 'comments',
+                    'attributes': {'content': 'merged'},
+                    'relationships': {
+                        'author': {'data': {'type': 'people', 'id': '2'}}
+                    }
+                }
+            },
+            headers={'Content-Type': 'application/vnd.api+json'},
+        )
+        r = self.test_app.get('/comments/1')
+        self.assertEqual(r.json['data']['attributes']['content'], 'merged')
+        self.assertEqual(
+            r.json['data']['relationships']['author']['data']['id'], '2'
+        )
+        r = self.test_app.post_json(
+            '/comments',
+            {
+                'data': [
+                    {
+                        'id': '1',
+                        'type': 'comments',
+                        'attributes': {'content': 'upserted'}
+                    },
+                    {
+                        'id': '1000',
+                        'type': 'comments',
+                        'attributes': {'content': 'new'}
+                    },
+                ]
+            },
+            headers={'Content-Type': 'application/vnd.api+json'},
+            status=201
+        )
+        self.assertEqual(
+            {item['id']: item['meta']['upserted'] for item in r.json['data']},
+            {'1': 'updated', '1000': 'created'}
+        )
+        r = self.test_app.get('/comments/1')
+        self.assertEqual(r.json['data']['attributes']['content'], 'upserted')
+        self.test_app.get('/comments/1000')
+
+    def test_upsert_bulk_needs_ids(self):
+        '''Should 400 if any resource object in a bulk upsert has no id.'''
+        self.test_app.post_json(
+            '/people',
+            {
+                'data': [
+                    {'type': 'people', 'attributes': {'name': 'anon'}},
+                ]
+            },
+            headers={'Content-Type': 'application/vnd.api+json'},
+            status=400
+        )
+
+
+class TestConcurrentCount(DBTestBase):
+    '''Test counting collections on another connection.'''
+
+    app_options = {
+        'pyramid_jsonapi.concurrent_count': 'true',
+        'pyramid_jsonapi.concurrent_count.max_workers': '2',
+        'pyramid_jsonapi.concurrent_count.isolation_level': 'READ COMMITTED',
+    }
+
+    def count_threads(self):
+        '''Record the isolation level of statements run in other threads.'''
+        levels = []
+
+        def before_cursor_execute(conn, *args):
+            if threading.current_thread() is not threading.main_thread():
+                levels.append(conn.get_execution_options().get(
+                    'isolation_level'
+                ))
+        # The app's engine, not this module's.
+        bind = DBSession.get_bind()
+        event.listen(bind, 'before_cursor_execute', before_cursor_execute)
+        self.addCleanup(
+            event.remove,
+            bind, 'before_cursor_execute', before_cursor_execute
+        )
+        return levels
+
+    def view(self, bind):
+        '''A posts view using a new session bound to bind.'''
+        view_class = pyramid_jsonapi.view_classes[test_project.models.Post]
+        view = view_class(webtest.TestRequest.blank('/posts'))
+        view.get_dbsession = Session(bind=bind)
+        self.addCleanup(view.get_dbsession.close)
+        return view
+
+    def test_concurrent_count_matches_serial(self):
+        '''Should count the same as a count on the request's session.'''
+        levels = self.count_threads()
+        posts = DBSession.query(test_project.models.Post)
+        for path, q in (
+                ('/posts', posts),
+                (
+                    '/posts?filter[published_at:gt]=2015-01-03',
+                    posts.filter(
+                        test_project.models.Post.published_at >
+                        datetime.datetime(2015, 1, 3)
+                    )
+                ),
+                ('/posts?filter[title:eq]=frog', posts.filter_by(title='frog')),
+        ):
+            with self.subTest(path=path):
+                r = self.test_app.get(path)
+                self.assertEqual(
+                    r.json['meta']['results']['available'], q.count()
+                )
+        self.assertEqual(levels, ['READ COMMITTED'] * 3)
+
+    def test_concurrent_count_bind(self):
+        '''Should count on the session's engine if it has a real pool.'''
+        self.assertIs(self.view(engine).concurrent_count_bind(), engine)
+
+    def test_concurrent_count_shared_connection(self):
+        '''Should count inline with pools sharing a connection.'''
+        for poolclass in (StaticPool, SingletonThreadPool):
+            with self.subTest(poolclass=poolclass):
+                bind = create_engine(postgresql.url(), poolclass=poolclass)
+                self.addCleanup(bind.dispose)
+                self.assertIsNone(self.view(bind).concurrent_count_bind())
+
+    def test_concurrent_count_unflushed(self):
+        '''Should count inline if the session has unflushed changes.'''
+        view = self.view(engine)
+        view.get_dbsession.add(test_project.models.Post(title='unflushed'))
+        self.assertIsNone(view.concurrent_count_bind())
+
+    def test_concurrent_count_executor_per_app(self):
+        '''Should give each app its own pool with its own max_workers.'''
+        view_class = pyramid_jsonapi.view_classes[test_project.models.Post]
+        self.assertIs(
+            view_class.count_executor,
+            self.app.registry.pyramid_jsonapi_count_executor
+        )
+        self.assertEqual(view_class.count_executor._max_workers, 2)
+        config = Configurator(settings={
+            'pyramid_jsonapi.concurrent_count.max_workers': '3'
+        })
+        executor = pyramid_jsonapi.get_count_executor(config)
+        self.addCleanup(executor.shutdown)
+        self.assertIsNot(executor, view_class.count_executor)
+        self.assertEqual(executor._max_workers, 3)
+        self.assertIs(pyramid_jsonapi.get_count_executor(config), executor)
+
+
+class TestConcurrentCountTiming(DBTestBase):
+    '''Test that counts in the count executor are timed with the request.'''
+
+    app_options = {
+        'pyramid_jsonapi.concurrent_count': 'true',
+        'pyramid_jsonapi.timing': 'true',
+        'pyramid_jsonapi.debug.meta': 'true',
+    }
+
+    def test_concurrent_count_timed(self):
+        '''Should include the count statement in the request's timing.'''
+        threads = []
+
+        def before_cursor_execute(conn, *args):
+            threads.append(threading.current_thread())
+        bind = DBSession.get_bind()
+        event.listen(bind, 'before_cursor_execute', before_cursor_execute)
+        self.addCleanup(
+            event.remove,
+            bind, 'before_cursor_execute', before_cursor_execute
+        )
+        r = self.test_app.get('/posts?fields[posts]=title')
+        # The count ran in another thread...
+        self.assertNotEqual(set(threads), {threading.main_thread()})
+        # ...and was still recorded.
+        self.assertEqual(
+            r.json['meta']['debug']['timing']['db_count'], len(threads)
+        )
+
+class TestBatchViews(DBTestBase):
+    '''Test one view per route dispatching on the request method.'''
+
+    app_options = {'pyramid_jsonapi.batch_views': 'true'}
+
+    def test_batch_views_methods(self):
+        '''Should dispatch each request method to its view method.'''
+        self.test_app.get('/people/1')
+        self.test_app.get('/people/1/posts')
+        self.test_app.patch_json(
+            '/people/1',
+            {'data': {'type': 'people', 'id': '1',
+                      'attributes': {'name': 'alice2'}}},
+            headers={'Content-Type': 'application/vnd.api+json'}
+        )
+        r = self.test_app.get('/people/1')
+        self.assertEqual(r.json['data']['attributes']['name'], 'alice2')
+
+    def test_batch_views_method_not_supported(self):
+        '''Should 404 for a request method with no view method.'''
+        r = self.test_app.put('/people/1', status=404)
+        self.assertEqual(r.json['errors'][0]['code'], '404')
+
+
+class TestGenericRoutes(DBTestBase):
+    '''Test serving all collections from generic routes.'''
+
+    app_options = {'pyramid_jsonapi.generic_routes': 'true'}
+
+    def test_generic_routes_urls(self):
+        '''Should generate the same URLs as per collection routes.'''
+        r = self.test_app.get('/people?page[limit]=1')
+        self.assertEqual(
+            r.json['data'][0]['links']['self'], 'http://localhost/people/1'
+        )
+        self.assertTrue(
+            r.json['links']['next'].startswith('http://localhost/people?')
+        )
+
+    def test_generic_routes_all_shapes(self):
+        '''Should serve item, related and relationships URLs.'''
+        self.test_app.get('/people/1')
+        self.test_app.get('/people/1/posts')
+        self.test_app.get('/people/1/relationships/posts')
+
+    def test_generic_routes_unknown_collection(self):
+        '''Should 404 for a collection that does not exist.'''
+        self.test_app.get('/frogs', status=404)
+
+    def test_generic_routes_method_not_supported(self):
+        '''Should 404 for a request method with no view method.'''
+        self.test_app.put('/people/1', status=404)
+
+    def test_generic_routes_per_app(self):
+        '''Should only serve the collections of each app.'''
+        saved = dict(pyramid_jsonapi.view_classes)
+
+        def restore():
+            pyramid_jsonapi.view_classes.clear()
+            pyramid_jsonapi.view_classes.update(saved)
+        self.addCleanup(restore)
+        config = Configurator(settings={
+            'pyramid_jsonapi.generic_routes': 'true',
+        })
+        pyramid_jsonapi.create_jsonapi(
+            config, [test_project.models.Blog], lambda view: DBSession
+        )
+        other_app = config.make_wsgi_app()
+        self.assertEqual(
+            set(pyramid_jsonapi.get_collection_view_classes(other_app)),
+            {'blogs'}
+        )
+        webtest.TestApp(other_app).get('/people', status=404)
+        self.test_app.get('/people')
+
+
+class TestSchemaCache(DBTestBase):
+    '''Test creating the API from a cached schema.'''
+
+    def cached_app(self, path):
+        with warnings.catch_warnings():
+            warnings.simplefilter(
+                "ignore",
+                category=SAWarning
+            )
+            app = make_app({'pyramid_jsonapi.schema_cache': path})
+        return webtest.TestApp(app)
+
+    def test_schema_cache_roundtrip(self):
+        '''Should write the cache then serve the same API from it.'''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'schema.json')
+            first = self.cached_app(path).get('/people/1?include=posts').json
+            with open(path) as f:
+                cache = json.load(f)
+            self.assertEqual(
+                cache['models']['test_project.models:Person'][
+                    'collection_name'
+                ],
+                'people'
+            )
+            second = self.cached_app(path).get('/people/1?include=posts').json
+        self.assertEqual(first, second)
+
+    def test_schema_cache_skips_introspection(self):
+        '''Should not introspect models when booting from the cache.'''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'schema.json')
+            self.cached_app(path)
+            with unittest.mock.patch(
+                    'pyramid_jsonapi.describe_model',
+                    side_effect=pyramid_jsonapi.describe_model
+            ) as describe_model:
+                self.cached_app(path).get('/people/1?include=posts')
+        describe_model.assert_not_called()
+
+    def test_schema_cache_explicit_arguments(self):
+        '''Should not use a cached schema with collection_name or fields.'''
+        saved = dict(pyramid_jsonapi.view_classes)
+
+        def restore():
+            pyramid_jsonapi.view_classes.clear()
+            pyramid_jsonapi.view_classes.update(saved)
+        self.addCleanup(restore)
+        Person = test_project.models.Person
+        schema = pyramid_jsonapi.schema_cache.view_entry(
+            pyramid_jsonapi.view_classes[Person]
+        )
+        pyramid_jsonapi.create_resource(
+            Configurator(), Person, lambda view: DBSession,
+            collection_name='humans',
+            expose_fields={'name'}, schema=schema
+        )
+        view = pyramid_jsonapi.view_classes[Person]
+        self.assertEqual(view.collection_name, 'humans')
+        self.assertEqual(set(view.fields), {'name'})
+
+    def test_schema_cache_key_table(self):
+        '''Should change the key if a model's table changes.'''
+        def model(*columns):
+            Base = sqlalchemy.ext.declarative.declarative_base()
+            return type('Thing', (Base,), {
+                '__table__': sqlalchemy.Table(
+                    'things', Base.metadata,
+                    sqlalchemy.Column('id', sqlalchemy.Integer,
+                                      primary_key=True),
+                    *columns
+                )
+            })
+        self.assertNotEqual(
+            pyramid_jsonapi.schema_cache.model_hash([model()], {}),
+            pyramid_jsonapi.schema_cache.model_hash([model(
+                sqlalchemy.Column('name', sqlalchemy.Text)
+            )], {})
+        )
+
+    def test_schema_cache_stale(self):
+        '''Should ignore and rewrite a cache with the wrong key.'''
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'schema.json')
+            with open(path, 'w') as f:
+                json.dump({'version': 1, 'key': 'stale', 'models': {}}, f)
+            self.cached_app(path).get('/people/1')
+            with open(path) as f:
+                self.assertNotEqual(json.load(f)['key'], 'stale')
+
+
+class TestWarmup(DBTestBase):
+    '''Test warming up an app before forking.'''
+
+    def test_warmup(self):
+        '''Should GET every collection successfully.'''
+        result = pyramid_jsonapi.warmup(self.app, freeze=False)
+        self.assertIn('people', result['statuses'])
+        self.assertEqual(set(result['statuses'].values()), {200})
+
+    def test_warmup_own_collections(self):
+        '''Should only GET the collections of the app warmed up.'''
+        saved = dict(pyramid_jsonapi.view_classes)
+
+        def restore():
+            pyramid_jsonapi.view_classes.clear()
+            pyramid_jsonapi.view_classes.update(saved)
+        self.addCleanup(restore)
+        # Another app with the same collections at different URLs.
+        config = Configurator(settings={
+            'pyramid_jsonapi.route_pattern_prefix': 'other',
+        })
+        pyramid_jsonapi.create_jsonapi(
+            config, test_project.models, lambda view: DBSession
+        )
+        config.make_wsgi_app()
+        result = pyramid_jsonapi.warmup(self.app, freeze=False)
+        self.assertIn('people', result['statuses'])
+        self.assertEqual(set(result['statuses'].values()), {200})
+
+
+class TestTiming(DBTestBase):
+    '''Test per-request statement counts and timings.'''
+
+    app_options = {
+        'pyramid_jsonapi.timing': 'true',
+        'pyramid_jsonapi.debug.meta': 'true',
+    }
+
+    def test_timing_header(self):
+        '''Should send a Server-Timing header with db and view timings.'''
+        r = self.test_app.get('/people?include=posts')
+        header = r.headers['Server-Timing']
+        self.assertTrue(header.startswith('db;dur='))
+        for phase in ('parse', 'query', 'serialise', 'callbacks', 'total'):
+            self.assertIn(phase + ';dur=', header)
+
+    def test_timing_debug_meta(self):
+        '''Should count statements in meta.debug.timing.'''
+        r = self.test_app.get('/people/1')
+        timing = r.json['meta']['debug']['timing']
+        self.assertGreater(timing['db_count'], 0)
+        self.assertIn('total', timing['phases_ms'])
+
+    def test_timing_failed_statement(self):
+        '''Should record failed statements and not leak their start times.'''
+        request_timing = pyramid_jsonapi.timing.RequestTiming()
+        bind = DBSession.get_bind()
+        pyramid_jsonapi.timing.instrument(bind)
+        token = pyramid_jsonapi.timing.current.set(request_timing)
+        try:
+            with bind.connect() as conn:
+                with self.assertRaises(sqlalchemy.exc.DBAPIError):
+                    conn.execute('SELECT * FROM no_such_table')
+                self.assertEqual(conn.info['pyramid_jsonapi_started'], [])
+        finally:
+            pyramid_jsonapi.timing.current.reset(token)
+        self.assertEqual(request_timing.db_count, 1)
+
+    def test_timing_error(self):
+        '''Should send a Server-Timing header with error responses.'''
+        r = self.test_app.get('/people/99999', status=404)
+        self.assertIn('Server-Timing', r.headers)
+
+
+class TestQueryBudget(DBTestBase):
+    '''Test the N+1 detector and per route statement budgets.'''
+
+    app_options = {
+        'pyramid_jsonapi.query_budget.repeat': '3',
+        'pyramid_jsonapi.query_budget.routes':
+            '\npyramid_jsonapi:people:item 1',
+    }
+
+    def test_fingerprint(self):
+        '''Should strip literals and parameters from statements.'''
+        self.assertEqual(
+            pyramid_jsonapi.query_budget.fingerprint(
+                "SELECT * FROM people WHERE id IN (1, 2, 3) "
+                "AND name = 'alice' AND blog_id = %(param_1)s"
+            ),
+            'SELECT * FROM people WHERE id IN (?) AND name = ? AND blog_id = ?'
+        )
+
+    def test_query_budget_repeated(self):
+        '''Should warn about statements repeated for each person.'''
+        with self.assertLogs('pyramid_jsonapi.query_budget', 'WARNING') as cm:
+            self.test_app.get('/people?include=posts')
+        self.assertIn('people.posts', cm.output[0])
+
+    def test_query_budget_route(self):
+        '''Should warn when a route's budget is exceeded.'''
+        with self.assertLogs('pyramid_jsonapi.query_budget', 'WARNING') as cm:
+            self.test_app.get('/people/1')
+        self.assertIn('"budget": 1', cm.output[0])
+
+
+class TestMetrics(DBTestBase):
+    '''Test the metrics registry and /metrics endpoint.'''
+
+    app_options = {'pyramid_jsonapi.metrics': 'true'}
+
+    def test_metrics_endpoint(self):
+        '''Should serve request metrics in Prometheus text format.'''
+        self.test_app.get('/people')
+        r = self.test_app.get('/metrics')
+        self.assertTrue(r.content_type.startswith('text/plain'))
+        self.assertIn(
+            'pyramid_jsonapi_request_seconds_count{collection="people",'
+            'endpoint="collection_get",method="GET"}',
+            r.text
+        )
+        self.assertIn(
+            'pyramid_jsonapi_items_serialised_total{collection="people"}',
+            r.text
+        )
+
+    def test_metrics_histogram(self):
+        '''Should render cumulative buckets, sum and count.'''
+        histogram = pyramid_jsonapi.metrics.Histogram(
+            'test_seconds', 'Test.', ('x',), buckets=(1, 2)
+        )
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value, 'a')
+        self.assertEqual(
+            histogram.render()[2:],
+            [
+                'test_seconds_bucket{x="a",le="1"} 1',
+                'test_seconds_bucket{x="a",le="2"} 3',
+                'test_seconds_bucket{x="a",le="+Inf"} 4',
+                'test_seconds_sum{x="a"} 6.5',
+                'test_seconds_count{x="a"} 4',
+            ]
+        )
+
+
+class TestSlowLog(DBTestBase):
+    '''Test logging slow requests with their SQL.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.log_path = os.path.join(cls.tmpdir.name, 'slow.jsonl')
+        cls.app_options = {
+            'pyramid_jsonapi.slow_log.threshold_ms': '0',
+            'pyramid_jsonapi.slow_log.path': cls.log_path,
+            'pyramid_jsonapi.slow_log.explain': 'true',
+        }
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def last_record(self):
+        '''The last record written, once pending EXPLAINs are done.'''
+        self.app.registry.pyramid_jsonapi_slow_log.flush()
+        with open(self.log_path) as f:
+            return json.loads(f.read().splitlines()[-1])
+
+    def test_slow_log_record(self):
+        '''Should log the query, statements and a plan as a JSON line.'''
+        self.test_app.get('/people?sort=-name&include=posts')
+        record = self.last_record()
+        self.assertEqual(record['view'], 'people')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(
+            record['query']['sort'], [{'key': 'name', 'ascending': False}]
+        )
+        self.assertEqual(record['query']['include'], ['posts'])
+        self.assertTrue(record['statements'])
+        self.assertIn('plan', record['explain'])
+
+    def test_slow_log_failed_request(self):
+        '''Should log requests which fail.'''
+        self.test_app.get('/people/99999', status=404)
+        record = self.last_record()
+        self.assertEqual(record['url'], 'http://localhost/people/99999')
+        self.assertEqual(record['status'], 404)
+        self.assertTrue(record['error'].startswith('HTTPNotFound'))
+
+    def test_slow_log_explain_max_pending(self):
+        '''Should not queue more EXPLAINs than allowed.'''
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with unittest.mock.patch.object(
+                self.app.registry.pyramid_jsonapi_slow_log,
+                'explain_slots', slots
+        ):
+            self.test_app.get('/people')
+        self.assertEqual(
+            self.last_record()['explain']['error'],
+            'too many EXPLAINs pending'
+        )
+
+
+class TestProfiling(DBTestBase):
+    '''Test profiling requests and downloading the profiles.'''
+
+    app_options = {
+        'pyramid_jsonapi.debug.profile.sample': '1',
+        'pyramid_jsonapi.debug.debug_endpoints': 'true',
+        'pyramid_jsonapi.debug.test_data_module': 'test_project.test_data',
+    }
+
+    def test_profile_sampled(self):
+        '''Should store a profile and serve it in each format.'''
+        r = self.test_app.get('/people')
+        profile_id = r.headers['X-JSONAPI-Profile-Id']
+        profiles = self.test_app.get('/debug/profiles').json['profiles']
+        self.assertIn(profile_id, [p['id'] for p in profiles])
+        r = self.test_app.get('/debug/profiles/{}'.format(profile_id))
+        self.assertEqual(r.content_type, 'application/octet-stream')
+        r = self.test_app.get(
+            '/debug/profiles/{}?format=collapsed'.format(profile_id)
+        )
+        self.assertRegex(r.text.splitlines()[0], r'^\S.* \d+$')
+        self.test_app.get('/debug/profiles/nosuchprofile', status=404)
+
+    def test_profile_signed_header(self):
+        '''Should only accept a valid, unexpired signature.'''
+        profiler = pyramid_jsonapi.profiling.Profiler(
+            secret='secret', max_age=300
+        )
+        good = profiler.sign()
+        self.assertTrue(profiler.valid_header(
+            webtest.TestRequest.blank('/', headers={
+                'X-JSONAPI-Profile': good
+            })
+        ))
+        for bad in (good[:-1] + 'x', profiler.sign(0), 'nonsense'):
+            self.assertFalse(profiler.valid_header(
+                webtest.TestRequest.blank('/', headers={
+                    'X-JSONAPI-Profile': bad
+                })
+            ))
+
+
+class TestProfilingUnprotected(DBTestBase):
+    '''Test that profiles are not served without a secret or debug server.'''
+
+    app_options = {
+        'pyramid_jsonapi.debug.profile.sample': '1',
+    }
+
+    def test_profiles_not_served(self):
+        '''Should profile requests but not add the profile endpoints.'''
+        r = self.test_app.get('/people')
+        profile_id = r.headers['X-JSONAPI-Profile-Id']
+        self.test_app.get('/debug/profiles', status=404)
+        self.test_app.get(
+            '/debug/profiles/{}'.format(profile_id), status=404
+        )
+
+
+class TestProfilingSecret(DBTestBase):
+    '''Test that profile endpoints need a signed header if there's a secret.'''
+
+    app_options = {
+        'pyramid_jsonapi.debug.profile.secret': 'secret',
+        'pyramid_jsonapi.debug.profile.sample': '1',
+    }
+
+    def test_profiles_need_header(self):
+        '''Should refuse unsigned requests for profiles.'''
+        r = self.test_app.get('/people')
+        profile_id = r.headers['X-JSONAPI-Profile-Id']
+        self.test_app.get('/debug/profiles', status=403)
+        self.test_app.get(
+            '/debug/profiles/{}'.format(profile_id), status=403
+        )
+        signed = {
+            'X-JSONAPI-Profile': pyramid_jsonapi.profiling.Profiler(
+                secret='secret'
+            ).sign()
+        }
+        profiles = self.test_app.get(
+            '/debug/profiles', headers=signed
+        ).json['profiles']
+        self.assertIn(profile_id, [p['id'] for p in profiles])
+
+
+class TestCallbackStats(DBTestBase):
+    '''Test callback chains and their stats.'''
+
+    app_options = {
+        'pyramid_jsonapi.callback_stats': 'true',
+    }
+
+    def test_callback_chain_plain_deque(self):
+        '''Should run callbacks assigned as a plain deque.'''
+        person_view = pyramid_jsonapi.view_classes[test_project.models.Person]
+        old = person_view.callbacks['after_get']
+        self.addCleanup(
+            person_view.callbacks.__setitem__, 'after_get', old
+        )
+
+        def add_meta(view, ret):
+            ret.setdefault('meta', {})['plain'] = True
+            return ret
+        person_view.callbacks['after_get'] = collections.deque([add_meta])
+        chain = person_view.callbacks['after_get']
+        self.assertIsInstance(
+            chain, pyramid_jsonapi.callback_chain.CallbackChain
+        )
+        self.assertEqual(chain.record_stats, old.record_stats)
+        r = self.test_app.get('/people/1')
+        self.assertTrue(r.json['meta']['plain'])
+        self.assertEqual(
+            person_view.callback_stats()['after_get'][
+                'test_project.tests.TestCallbackStats.'
+                'test_callback_chain_plain_deque.<locals>.add_meta'
+            ]['calls'],
+            1
+        )
+
+    def test_callback_chain_order(self):
+        '''Should run the callbacks in the deque's current order.'''
+        chain = pyramid_jsonapi.callback_chain.CallbackChain(name='test')
+        self.assertEqual(chain.run(None, 1), 1)
+        chain.append(lambda view, value: value + 1)
+        chain.append(lambda view, value: value * 10)
+        self.assertEqual(chain.run(None, 1), 20)
+        chain.rotate(1)
+        self.assertEqual(chain.run(None, 1), 11)
+        chain.clear()
+        self.assertEqual(chain.run(None, 1), 1)
+
+    def test_callback_stats(self):
+        '''Should count calls to callbacks run per serialised object.'''
+        person_view = pyramid_jsonapi.view_classes[test_project.models.Person]
+        before = person_view.callback_stats().get(
+            'after_serialise_object', {}
+        )
+        r = self.test_app.get('/people')
+        after = person_view.callback_stats()['after_serialise_object']
+        name = 'test_project.person_callback_add_information'
+        self.assertEqual(
+            after[name]['calls'] - before.get(name, {}).get('calls', 0),
+            len(r.json['data'])
+        )
+
+
+class TestSyntheticPopulate(DBTestBase):
+    '''Test /debug/populate?scale=N.'''
+
+    app_options = {
+        'pyramid_jsonapi.debug.debug_endpoints': 'true',
+        'pyramid_jsonapi.debug.test_data_module': 'test_project.test_data',
+    }
+
+    def test_populate_scale(self):
+        '''Should add scale rows to every table, with valid references.'''
+        before = self.test_app.get('/blogs').json['meta']['results']
+        r = self.test_app.get('/debug/populate?scale=50')
+        self.assertEqual(
+            r.json['populated'],
+            {table: 50 for table in Base.metadata.tables}
+        )
+        after = self.test_app.get('/blogs?page[limit]=100').json
+        self.assertEqual(
+            after['meta']['results']['available'],
+            before['available'] + 50
+        )
+        # References to synthetic rows should resolve.
+        blog_id = after['data'][-1]['id']
+        self.test_app.get('/blogs/{}/owner'.format(blog_id))
+        self.test_app.get('/blogs/{}/posts'.format(blog_id))
+        # Sequences should have moved past the synthetic ids.
+        self.test_app.post_json(
+            '/blogs',
+            {'data': {'type': 'blogs', 'attributes': {'title': 'new'}}},
+            headers={'Content-Type': 'application/vnd.api+json'}
+        )
+
+    def test_populate_twice_unique(self):
+        '''Should keep unique columns unique over repeated runs.'''
+        metadata = sqlalchemy.MetaData()
+        things = sqlalchemy.Table(
+            'things', metadata,
+            sqlalchemy.Column('id', sqlalchemy.Integer, primary_key=True),
+            sqlalchemy.Column('name', sqlalchemy.Text, unique=True),
+        )
+        labels = sqlalchemy.Table(
+            'labels', metadata,
+            sqlalchemy.Column(
+                'thing_id', sqlalchemy.Integer,
+                sqlalchemy.ForeignKey('things.id'), primary_key=True
+            ),
+            sqlalchemy.Column('label', sqlalchemy.String(8), unique=True),
+        )
+        bind = sqlalchemy.create_engine('sqlite://')
+        metadata.create_all(bind)
+        for _ in range(2):
+            pyramid_jsonapi.synthetic.populate(bind, metadata, 20)
+        for table, column in ((things, things.c.name), (labels, labels.c.label)):
+            self.assertEqual(
+                bind.execute(
+                    sqlalchemy.select([sqlalchemy.func.count(
+                        sqlalchemy.distinct(column)
+                    )])
+                ).scalar(),
+                40
+            )
+
+    def test_populate_bad_scale(self):
+        '''Should refuse a scale which is not a positive integer.'''
+        for scale in ('0', '-1', 'lots'):
+            self.test_app.get(
+                '/debug/populate?scale={}'.format(scale), status=400
+            )
+
+
+class TestAllowedQueryFilter(DBTestBase):
+    '''Test filtering forbidden items in SQL with allowed_query_filter.'''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        person_view = pyramid_jsonapi.view_classes[test_project.models.Person]
+        person_view.allowed_query_filter = lambda view: \
+            view.model.name != 'secret_squirrel'
+
+    def test_collection_filtered(self):
+        '''Should neither return nor count forbidden people.'''
+        r = self.test_app.get('/people')
+        names = [item['attributes']['name'] for item in r.json['data']]
+        self.assertNotIn('secret_squirrel', names)
+        self.assertEqual(r.json['meta']['results']['available'], len(names))
+
+    def test_item_forbidden(self):
+        '''Should 403 for a forbidden item and 404 for a missing one.'''
+        self.test_app.get('/people/4', status=403)
+        self.test_app.get('/people/1')
+        self.test_app.get('/people/1000', status=404)
+
+    def test_related_filtered(self):
+        '''Should leave forbidden people out of related and included.'''
+        r = self.test_app.get('/blogs/5/owner')
+        self.assertIsNone(r.json['data'])
+        r = self.test_app.get('/blogs/5?include=owner')
+        self.assertNotIn(
+            ('people', '4'),
+            [(item['type'], item['id']) for item in r.json.get('included', [])]
+        )
+
+
+class TestAllowedQueryFilterWrites(DBTestBase):
+    '''Test that writes leave items excluded by allowed_query_filter alone.'''
+
+    app_options = {
+        'pyramid_jsonapi.bulk_collection_writes': 'true',
+        'pyramid_jsonapi.rowcount_delete': 'true',
+        'pyramid_jsonapi.upsert': 'true',
+    }
+
+    filters = {
+        test_project.models.Person: lambda view:
+            view.model.name != 'secret_squirrel',
+        test_project.models.Comment: lambda view:
+            view.model.comments_id != 2,
+    }
+
+    def setUp(self):
+        super().setUp()
+        for model, allowed_query_filter in self.filters.items():
+            pyramid_jsonapi.view_classes[model].allowed_query_filter = \
+                allowed_query_filter
+        self.addCleanup(self.unfilter)
+
+    def unfilter(self):
+        '''Remove the filters, to check what was written.'''
+        for model in self.filters:
+            view_class = pyramid_jsonapi.view_classes[model]
+            if 'allowed_query_filter' in vars(view_class):
+                del view_class.allowed_query_filter
+
+    def secret_squirrel(self):
+        '''people/4 from the database (test_project forbids GETs of it).'''
+        return DBSession.query(test_project.models.Person).get(4)
+
+    def test_bulk_patch_forbidden(self):
+        '''Should not update forbidden items in a bulk PATCH.'''
+        r = self.test_app.patch_json(
+            '/people?filter[name:eq]=secret_squirrel&ids=true',
+            {'data': {'type': 'people', 'attributes': {'name': 'exposed'}}},
+            headers={'Content-Type': 'application/vnd.api+json'}
+        )
+        self.assertEqual(r.json['meta']['results']['affected'], 0)
+        self.assertEqual(r.json['data'], [])
+        self.assertEqual(self.secret_squirrel().name, 'secret_squirrel')
+
+    def test_bulk_delete_forbidden(self):
+        '''Should only delete allowed items in a bulk DELETE.'''
+        r = self.test_app.delete('/comments?filter[post_id:eq]=4&ids=true')
+        self.assertEqual(
+            {item['id'] for item in r.json['data']}, {'1', '5'}
+        )
+        self.unfilter()
+        self.test_app.get('/comments/2')
+        self.test_app.get('/comments/1', status=404)
+
+    def test_rowcount_delete_forbidden(self):
+        '''Should 403 rather than delete a forbidden item by rowcount.'''
+        self.test_app.delete('/comments/2', status=403)
+        r = self.test_app.delete('/comments/99999')
+        self.assertIsNone(r.json['data'])
+        self.unfilter()
+        self.test_app.get('/comments/2')
+
+    def test_item_writes_forbidden(self):
+        '''Should 403 for PATCH, DELETE or relationship writes of an item.'''
+        headers = {'Content-Type': 'application/vnd.api+json'}
+        self.test_app.patch_json(
+            '/people/4',
+            {'data': {'type': 'people', 'id': '4',
+                      'attributes': {'name': 'exposed'}}},
+            headers=headers, status=403
+        )
+        # Not deleted by rowcount: people have TOMANY relationships.
+        self.test_app.delete('/people/4', status=403)
+        self.test_app.post_json(
+            '/people/4/relationships/comments',
+            {'data': [{'type': 'comments', 'id': '1'}]},
+            headers=headers, status=403
+        )
+        person = self.secret_squirrel()
+        self.assertEqual(person.name, 'secret_squirrel')
+        self.assertEqual(person.comments, [])
+
+    def test_upsert_forbidden(self):
+        '''Should 403 rather than upsert over a forbidden item.'''
+        self.test_app.post_json(
+            '/people',
+            {'data': {'type': 'people', 'id': '4',
+                      'attributes': {'name': 'exposed'}}},
+            headers={'Content-Type': 'application/vnd.api+json'},
+            status=403
+        )
+        self.assertEqual(self.secret_squirrel().name, 'secret_squirrel')
+
+class TestAllowedFieldsCache(DBTestBase):
+    '''Test sharing allowed_fields between requests.'''
+
+    app_options = {
+        'pyramid_jsonapi.allowed_fields_cache_size': '16',
+    }
+
+    def test_allowed_fields_cached(self):
+        '''Should compute allowed_fields once per method and user.'''
+        person_view = pyramid_jsonapi.view_classes[test_project.models.Person]
+        cache = person_view.allowed_fields_cache
+        cache.cache_clear()
+        for _ in range(3):
+            r = self.test_app.get('/people')
+        info = cache.cache_info()
+        self.assertEqual((info.misses, info.currsize), (1, 1))
+        self.assertGreater(info.hits, 0)
+        # Fields added by callbacks are still filtered.
+        item = r.json['data'][0]
+        self.assertIn('name_copy', item['attributes'])
+        self.assertNotIn('age', item['attributes'])
+        self.assertIn('age', item['meta']['forbidden_fields'])
+
+
 class TestErrors(DBTestBase):
     '''Test that erros are thrown properly.'''
 